@@ -1,6 +1,28 @@
-from .client import AsyncClient
-from .auth_manager import AuthManager
-from .api import create_app
+import importlib
 
-__all__ = ['AsyncClient', 'AuthManager', 'create_app']
-__version__ = '0.1.0'
\ No newline at end of file
+# Тяжёлые зависимости (aiohttp, Flask, Playwright) импортируются при первом обращении к имени
+_LAZY = {
+    'AsyncClient': '.client',
+    'Client': '.client',
+    'AuthManager': '.auth_manager',
+    'create_app': '.api',
+    'create_aio_app': '.aio_api',
+    'SessionStore': '.sessions',
+    'Scheduler': '.scheduler',
+}
+
+__all__ = ['AsyncClient', 'Client', 'AuthManager', 'create_app', 'create_aio_app', 'SessionStore', 'Scheduler']
+__version__ = '0.1.0'
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
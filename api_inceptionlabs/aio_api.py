@@ -0,0 +1,338 @@
+import asyncio
+import json
+from contextlib import aclosing
+from aiohttp import web
+from .auth_manager import AuthManager
+from .cache import ResponseCache, make_key
+from .batch import completion_fetcher, parse_batch_body, collect_batch
+from .fanout import StreamMultiplexer, StreamLagged
+from .coalesce import StreamCoalescer
+from .compression import negotiate, compress, should_compress, StreamEncoder
+from .metrics import (register_cache_metrics, register_fanout_metrics, register_session_metrics,
+                      register_scheduler_metrics)
+from .sessions import SessionStore, SessionNotFoundError, reply_message, record_stream
+from .scheduler import Scheduler, OverloadedError, client_key, parse_priority, scheduled
+from .stopping import StopCondition, stream_limited, complete_limited
+from .sse import encode_event, encode_error
+from .errors import UpstreamError, error_response
+from .timeouts import Timeouts
+from . import config
+
+AUTH_MANAGER = web.AppKey("auth_manager", AuthManager)
+MAINTENANCE_TASK = web.AppKey("maintenance_task", asyncio.Task)
+WARMUP_TASK = web.AppKey("warmup_task", asyncio.Task)
+PASSTHROUGH = web.AppKey("passthrough", bool)
+CACHE = web.AppKey("cache", ResponseCache)
+FANOUT = web.AppKey("fanout", StreamMultiplexer)
+COALESCER = web.AppKey("coalescer", StreamCoalescer)
+COMPRESSION = web.AppKey("compression", bool)
+SESSIONS = web.AppKey("sessions", SessionStore)
+SCHEDULER = web.AppKey("scheduler", Scheduler)
+
+
+def create_aio_app(auth_manager=None, maintain_accounts=True, passthrough=True, cache=None, fanout=None,
+                   timeouts=None, resilience=None, coalescer=None, compression=config.COMPRESSION, sessions=None,
+                   scheduler=None):
+    app = web.Application(middlewares=[compression_middleware] if compression else [])
+    # passthrough: ответы upstream (события SSE и не-потоковые тела) пересылаются без разбора JSON
+    app[PASSTHROUGH] = passthrough
+    app[CACHE] = cache
+    app[FANOUT] = fanout
+    app[COALESCER] = coalescer
+    app[COMPRESSION] = compression
+    app[SESSIONS] = sessions
+    app[SCHEDULER] = scheduler
+
+    async def on_startup(app):
+        app[AUTH_MANAGER] = auth_manager or AuthManager(timeouts=timeouts, resilience=resilience)
+        if fanout is not None and fanout.auth_manager is None:
+            fanout.auth_manager = app[AUTH_MANAGER]
+        registry = app[AUTH_MANAGER].metrics.registry
+        if cache is not None:
+            register_cache_metrics(registry, cache)
+        if fanout is not None:
+            register_fanout_metrics(registry, fanout)
+        if sessions is not None:
+            register_session_metrics(registry, sessions)
+        if scheduler is not None:
+            register_scheduler_metrics(registry, scheduler)
+        app[WARMUP_TASK] = asyncio.create_task(app[AUTH_MANAGER].warmup())
+        if maintain_accounts:
+            # Обслуживание аккаунтов в том же event loop, что и запросы
+            app[MAINTENANCE_TASK] = asyncio.create_task(app[AUTH_MANAGER].maintain())
+
+    async def on_cleanup(app):
+        for key in (WARMUP_TASK, MAINTENANCE_TASK):
+            task = app.get(key)
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        await app[AUTH_MANAGER].close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post('/api/chat/completions', chat_completions)
+    app.router.add_post('/api/chat/completions/batch', batch_completions)
+    app.router.add_get('/metrics', metrics_handler)
+    if sessions is not None:
+        app.router.add_post('/api/sessions', create_session)
+        app.router.add_get('/api/sessions/{session_id}', get_session)
+        app.router.add_delete('/api/sessions/{session_id}', delete_session)
+    return app
+
+
+async def chat_completions(request):
+    auth_manager = request.app[AUTH_MANAGER]
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        return web.json_response({"error": "Invalid JSON body"}, status=400)
+    if not isinstance(data, dict):
+        return web.json_response({"error": "Body must be a JSON object"}, status=400)
+    model = data.get('model', config.DEFAULT_MODEL)
+    messages = data.get('messages', [])
+    params = request_params(data)
+    try:
+        timeouts = Timeouts.coerce(data.get('timeout'))
+        condition = StopCondition.from_params(params)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    session = None
+    if data.get('session_id') is not None:
+        # Клиент прислал только новые сообщения — дополняем их историей сессии
+        sessions = request.app[SESSIONS]
+        if sessions is None:
+            return web.json_response({"error": "Sessions are disabled on this server"}, status=400)
+        if not isinstance(data['session_id'], str):
+            return web.json_response({"error": "session_id must be a string"}, status=400)
+        session = (data['session_id'], messages)
+        try:
+            messages = await sessions.run(sessions.prepare, data['session_id'], messages)
+        except SessionNotFoundError as e:
+            status, body, headers = error_response(e)
+            return web.json_response(body, status=status, headers=headers)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+    scheduler = request.app[SCHEDULER]
+    ticket = None
+    if scheduler is not None:
+        # Слот upstream занимается до ответа клиенту, для потока — до его конца
+        try:
+            ticket = await scheduler.acquire(client_key(request.headers, request.remote),
+                                             request.headers.get('X-Priority'))
+        except OverloadedError as e:
+            status, body, headers = error_response(e)
+            return web.json_response(body, status=status, headers=headers)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+    try:
+        if data.get('stream', False):
+            return await stream_response(request, auth_manager, model, messages, params, timeouts, session,
+                                         condition)
+        try:
+            return await complete_response(request, model, messages, params, timeouts, session, condition)
+        except Exception as e:
+            print(f"Error in chat_completions: {str(e)}")
+            status, body, headers = error_response(e)
+            return web.json_response(body, status=status, headers=headers)
+    finally:
+        if ticket is not None:
+            scheduler.release(ticket)
+
+
+async def batch_completions(request):
+    try:
+        requests, concurrency = parse_batch_body(await request.json())
+    except json.JSONDecodeError:
+        return web.json_response({"error": "Invalid JSON body"}, status=400)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    try:
+        priority = parse_priority(request.headers.get('X-Priority'))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    # Каждый запрос пакета занимает свой слот планировщика
+    fetch = completion_fetcher(scheduled(request.app[SCHEDULER],
+                                         lambda model, messages, params, timeouts, condition:
+                                         complete(request.app, model, messages, params, timeouts, condition),
+                                         client_key(request.headers, request.remote), priority))
+    return web.json_response(await collect_batch(fetch, requests, concurrency))
+
+
+async def complete(app, model, messages, params, timeouts=None, condition=None):
+    auth_manager = app[AUTH_MANAGER]
+    cache = app[CACHE]
+    if condition is None:
+        fetch = lambda: auth_manager.complete_chat(model, messages, timeouts, **params)
+    else:
+        # stop/max_tokens/max_chars: ответ собирается из потока, который закрывается, как только условие выполнено
+        fetch = lambda: complete_limited(auth_manager, model, messages, condition, timeouts, **params)
+    if cache is None:
+        return await fetch()
+    return await cache.get_or_fetch(make_key(model, messages, params), fetch)
+
+
+async def complete_response(request, model, messages, params, timeouts=None, session=None, condition=None):
+    # session — (id сессии, новые сообщения клиента) или None
+    app = request.app
+    if session is not None or app[CACHE] is not None or not app[PASSTHROUGH] or condition is not None:
+        response_text = await complete(app, model, messages, params, timeouts, condition)
+        if session is not None:
+            # Ответ ассистента нужен для истории — здесь тело приходится разобрать
+            sessions = app[SESSIONS]
+            await sessions.run(sessions.commit, *session, reply_message(response_text))
+        if app[PASSTHROUGH]:
+            # Кэш хранит текст ответа upstream — отдаём его без json.loads/json.dumps
+            return web.Response(text=response_text, content_type='application/json')
+        return web.json_response(json.loads(response_text))
+    # Байты upstream уходят клиенту как есть, в том же Content-Encoding, если клиент его принимает
+    upstream = await app[AUTH_MANAGER].complete_chat_raw(model, messages, timeouts, **params)
+    body, encoding = upstream.for_client(request.headers.get('Accept-Encoding'))
+    response = web.Response(body=body, headers={'Content-Type': upstream.content_type})
+    if upstream.encoding is not None:
+        response.headers['Vary'] = 'Accept-Encoding'
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+async def create_session(request):
+    sessions = request.app[SESSIONS]
+    try:
+        data = await request.json() if request.can_read_body else {}
+    except json.JSONDecodeError:
+        return web.json_response({"error": "Invalid JSON body"}, status=400)
+    if not isinstance(data, dict):
+        return web.json_response({"error": "Body must be a JSON object"}, status=400)
+    try:
+        # Начальные сообщения (например, system) можно передать сразу
+        session_id = await sessions.run(sessions.create, data.get('messages', []))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    return web.json_response({"session_id": session_id}, status=201)
+
+
+async def get_session(request):
+    sessions = request.app[SESSIONS]
+    session_id = request.match_info['session_id']
+    try:
+        messages = await sessions.run(sessions.history, session_id)
+    except SessionNotFoundError as e:
+        status, body, headers = error_response(e)
+        return web.json_response(body, status=status, headers=headers)
+    return web.json_response({"session_id": session_id, "messages": messages})
+
+
+async def delete_session(request):
+    sessions = request.app[SESSIONS]
+    if not await sessions.run(sessions.delete, request.match_info['session_id']):
+        status, body, headers = error_response(SessionNotFoundError(request.match_info['session_id']))
+        return web.json_response(body, status=status, headers=headers)
+    return web.Response(status=204)
+
+
+async def metrics_handler(request):
+    registry = request.app[AUTH_MANAGER].metrics.registry
+    return web.Response(text=registry.render(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+@web.middleware
+async def compression_middleware(request, handler):
+    # Сжатие готовых ответов (JSON, /metrics); потоки SSE сжимает stream_response покадрово
+    response = await handler(request)
+    if type(response) is web.Response and 'Content-Encoding' not in response.headers:
+        if 'Accept-Encoding' not in response.headers.getall('Vary', ()):
+            response.headers.add('Vary', 'Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        body = response.body
+        if isinstance(body, bytes) and should_compress(body, response.content_type, encoding):
+            response.body = compress(body, encoding)
+            response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def request_params(data):
+    # Параметры сэмплирования и прочие поля запроса уходят в upstream как есть
+    return {k: v for k, v in data.items() if k not in ('model', 'messages', 'stream', 'timeout', 'session_id')}
+
+
+async def stream_response(request, auth_manager, model, messages, params, timeouts=None, session=None,
+                          condition=None):
+    app = request.app
+    headers = {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }
+    encoder = None
+    if app[COMPRESSION]:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            encoder = StreamEncoder(encoding)
+    response = web.StreamResponse(headers=headers)
+    await response.prepare(request)
+    if encoder is None:
+        write = response.write
+    else:
+        async def write(data):
+            await response.write(encoder.frame(data))
+    source = app[FANOUT] or auth_manager
+
+    def upstream(raw):
+        if condition is None:
+            events = (source.stream_chat_raw if raw else source.stream_chat)(model, messages, timeouts, **params)
+        else:
+            # Текст проверяется по мере прихода; как только условие выполнено, поток upstream закрывается
+            events = stream_limited(source, model, messages, condition, timeouts, raw, **params)
+        if session is not None:
+            # Ответ ассистента копится из событий и попадает в историю, если поток дошёл до конца
+            events = record_stream(app[SESSIONS], *session, events)
+        return events
+
+    try:
+        # Отключение клиента (ошибка записи или отмена обработчика) закрывает генератор,
+        # а с ним и ответ upstream
+        if app[COALESCER] is not None:
+            # Режим throughput: мелкие дельты склеиваются в более крупные события
+            async with aclosing(upstream(True)) as events:
+                async with aclosing(app[COALESCER].coalesce(events)) as frames:
+                    async for frame in frames:
+                        await write(encode_event(frame))
+        elif app[PASSTHROUGH]:
+            # События upstream пересылаются байт в байт, без json.loads/json.dumps
+            async with aclosing(upstream(True)) as events:
+                async for event in events:
+                    await write(encode_event(event))
+        else:
+            async with aclosing(upstream(False)) as chunks:
+                async for chunk in chunks:
+                    await write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+    except ConnectionResetError:
+        return response
+    except (UpstreamError, StreamLagged) as e:
+        # Ошибка после отправки заголовков — отдельным событием error
+        await write(encode_error(e))
+    await write(b"data: [DONE]\n\n")
+    if encoder is not None:
+        await response.write(encoder.finish())
+    await response.write_eof()
+    return response
+
+
+def run_aio_api(port=config.API_PORT, host=config.API_HOST, default_model=config.DEFAULT_MODEL,
+                min_accounts=config.MIN_ACCOUNTS, cache=None, fanout=None, timeouts=None, resilience=None,
+                coalescer=None, compression=config.COMPRESSION, sessions=None, scheduler=None):
+    config.update_config(port=port, host=host, default_model=default_model, min_accounts=min_accounts)
+    app = create_aio_app(cache=cache, fanout=fanout, timeouts=timeouts, resilience=resilience,
+                         coalescer=coalescer, compression=compression, sessions=sessions, scheduler=scheduler)
+    print(f"API running at http://{config.API_HOST}:{port}/api/chat/completions (aiohttp)")
+    # handler_cancellation: обработчик отменяется, как только клиент закрыл соединение
+    web.run_app(app, host=config.API_HOST, port=port, print=None, handler_cancellation=True)
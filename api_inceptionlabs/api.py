@@ -1,64 +1,256 @@
 from flask import Flask, request, Response, jsonify
-import json
 import asyncio
+from contextlib import aclosing
 from .auth_manager import AuthManager
-from .config import API_HOST, API_PORT, DEFAULT_MODEL, MIN_ACCOUNTS, update_config
+from .sse import encode_event, encode_error
+from .errors import UpstreamError, error_response
+from .cache import make_key
+from .batch import completion_fetcher, parse_batch_body, collect_batch
+from .timeouts import Timeouts
+from .metrics import register_cache_metrics, register_session_metrics, register_scheduler_metrics
+from .sessions import SessionNotFoundError, reply_message, record_stream
+from .scheduler import OverloadedError, client_key, parse_priority, scheduled
+from .stopping import StopCondition, stream_limited, complete_limited
+from .compression import negotiate, compress, should_compress, StreamEncoder
+from .config import API_HOST, API_PORT, DEFAULT_MODEL, MIN_ACCOUNTS, COMPRESSION, update_config
 
-def create_app():
+def create_app(auth_manager=None, cache=None, timeouts=None, maintain_accounts=True, resilience=None,
+               coalescer=None, compression=COMPRESSION, sessions=None, scheduler=None):
     app = Flask(__name__)
-    auth_manager = AuthManager()
+    auth_manager = auth_manager or AuthManager(timeouts=timeouts, resilience=resilience)
     
     # Запускаем инициализацию аккаунтов в фоновом режиме
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.create_task(auth_manager.initialize_accounts())
+    if maintain_accounts:
+        loop.create_task(auth_manager.initialize_accounts())
+    if cache is not None:
+        register_cache_metrics(auth_manager.metrics.registry, cache)
+    if sessions is not None:
+        register_session_metrics(auth_manager.metrics.registry, sessions)
+    if scheduler is not None:
+        # Планировщик общий для всех потоков Flask: лимит upstream-запросов — на процесс
+        register_scheduler_metrics(auth_manager.metrics.registry, scheduler)
+
+    if compression:
+        @app.after_request
+        def compress_response(response):
+            # Потоки SSE сжимает generate_stream покадрово, здесь — только готовые ответы
+            if response.is_streamed or 'Content-Encoding' in response.headers:
+                return response
+            response.vary.add('Accept-Encoding')
+            encoding = negotiate(request.headers.get('Accept-Encoding'))
+            body = response.get_data()
+            if should_compress(body, response.content_type or '', encoding):
+                response.set_data(compress(body, encoding))
+                response.headers['Content-Encoding'] = encoding
+            return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(auth_manager.metrics.registry.render(), content_type='text/plain; version=0.0.4')
     
     @app.route('/api/chat/completions', methods=['POST'])
     def chat_completions():
         data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"error": "Body must be a JSON object"}), 400
         model = data.get('model', DEFAULT_MODEL)
         messages = data.get('messages', [])
         stream = data.get('stream', False)
+        params = {k: v for k, v in data.items()
+                  if k not in ('model', 'messages', 'stream', 'timeout', 'session_id')}
+        try:
+            timeouts = Timeouts.coerce(data.get('timeout'))
+            condition = StopCondition.from_params(params)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        session = None
+        if data.get('session_id') is not None:
+            # Клиент прислал только новые сообщения — дополняем их историей сессии
+            if sessions is None:
+                return jsonify({"error": "Sessions are disabled on this server"}), 400
+            if not isinstance(data['session_id'], str):
+                return jsonify({"error": "session_id must be a string"}), 400
+            session = (data['session_id'], messages)
+            try:
+                messages = sessions.prepare(data['session_id'], messages)
+            except SessionNotFoundError as e:
+                status, body, headers = error_response(e)
+                return jsonify(body), status, headers
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
+        ticket = None
+        if scheduler is not None:
+            try:
+                ticket = loop.run_until_complete(scheduler.acquire(client_key(request.headers, request.remote_addr),
+                                                                   request.headers.get('X-Priority')))
+            except (OverloadedError, ValueError) as e:
+                loop.close()
+                if isinstance(e, ValueError):
+                    return jsonify({"error": str(e)}), 400
+                status, body, headers = error_response(e)
+                return jsonify(body), status, headers
+
         try:
             if stream:
                 print("Processing stream request...")
-                return Response(generate_stream(auth_manager, model, messages, loop),
-                                content_type='text/event-stream',
-                                headers={'X-Accel-Buffering': 'no'})
+                headers = {'X-Accel-Buffering': 'no'}
+                encoding = negotiate(request.headers.get('Accept-Encoding')) if compression else None
+                if encoding is not None:
+                    headers['Content-Encoding'] = encoding
+                response = Response(generate_stream(auth_manager, model, messages, params, timeouts, loop, encoding,
+                                                    session, condition),
+                                    content_type='text/event-stream', headers=headers)
+                if ticket is not None:
+                    # Слот занят, пока поток не отдан или клиент не отключился
+                    response.call_on_close(lambda: scheduler.release(ticket))
+                return response
             else:
                 print("Processing non-stream request...")
-                response_text = loop.run_until_complete(auth_manager.complete_chat(model, messages))
-                return jsonify(json.loads(response_text))
+                if session is not None or cache is not None or condition is not None:
+                    # Кэш хранит текст ответа upstream — отдаём его без json.loads/jsonify
+                    response_text = loop.run_until_complete(complete(model, messages, params, timeouts, condition))
+                    if session is not None:
+                        # Ответ ассистента нужен для истории — здесь тело приходится разобрать
+                        sessions.commit(*session, reply_message(response_text))
+                    return Response(response_text, content_type='application/json')
+                # Байты upstream уходят клиенту как есть, в том же Content-Encoding, если клиент его принимает
+                upstream = loop.run_until_complete(auth_manager.complete_chat_raw(model, messages, timeouts, **params))
+                body, encoding = upstream.for_client(request.headers.get('Accept-Encoding'))
+                response = Response(body, content_type=upstream.content_type)
+                if upstream.encoding is not None:
+                    response.vary.add('Accept-Encoding')
+                if encoding is not None:
+                    response.headers['Content-Encoding'] = encoding
+                return response
         except Exception as e:
             print(f"Error in chat_completions: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+            status, body, headers = error_response(e)
+            return jsonify(body), status, headers
         finally:
+            if ticket is not None and not stream:
+                scheduler.release(ticket)
             if not stream:
+                # Каждый запрос Flask живёт в своём loop, пул соединений с ним не переживёт
+                loop.run_until_complete(auth_manager.close())
                 loop.close()
 
-    def generate_stream(auth_manager, model, messages, loop):
+    @app.route('/api/chat/completions/batch', methods=['POST'])
+    def batch_completions():
+        try:
+            requests, concurrency = parse_batch_body(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            priority = parse_priority(request.headers.get('X-Priority'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            # Каждый запрос пакета занимает свой слот планировщика
+            fetch = completion_fetcher(scheduled(scheduler, complete,
+                                                 client_key(request.headers, request.remote_addr), priority))
+            return jsonify(loop.run_until_complete(collect_batch(fetch, requests, concurrency)))
+        finally:
+            loop.run_until_complete(auth_manager.close())
+            loop.close()
+
+    if sessions is not None:
+        @app.route('/api/sessions', methods=['POST'])
+        def create_session():
+            data = request.get_json(silent=True) if request.content_length else {}
+            if not isinstance(data, dict):
+                return jsonify({"error": "Body must be a JSON object"}), 400
+            try:
+                # Начальные сообщения (например, system) можно передать сразу
+                return jsonify({"session_id": sessions.create(data.get('messages', []))}), 201
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        @app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+        def session_resource(session_id):
+            try:
+                if request.method == 'DELETE':
+                    if not sessions.delete(session_id):
+                        raise SessionNotFoundError(session_id)
+                    return Response(status=204)
+                return jsonify({"session_id": session_id, "messages": sessions.history(session_id)})
+            except SessionNotFoundError as e:
+                status, body, headers = error_response(e)
+                return jsonify(body), status, headers
+
+    async def complete(model, messages, params, timeouts=None, condition=None):
+        if condition is None:
+            fetch = lambda: auth_manager.complete_chat(model, messages, timeouts, **params)
+        else:
+            # Ответ собирается из потока, который закрывается, как только условие выполнено
+            fetch = lambda: complete_limited(auth_manager, model, messages, condition, timeouts, **params)
+        if cache is None:
+            return await fetch()
+        return await cache.get_or_fetch(make_key(model, messages, params), fetch)
+
+    def generate_stream(auth_manager, model, messages, params, timeouts, loop, encoding=None, session=None,
+                        condition=None):
+        encoder = StreamEncoder(encoding) if encoding is not None else None
+
+        async def frames():
+            if condition is None:
+                events = auth_manager.stream_chat_raw(model, messages, timeouts, **params)
+            else:
+                events = stream_limited(auth_manager, model, messages, condition, timeouts, raw=True, **params)
+            if session is not None:
+                # Ответ ассистента копится из событий и попадает в историю, если поток дошёл до конца
+                events = record_stream(sessions, *session, events)
+            async with aclosing(events) as events:
+                if coalescer is None:
+                    async for event in events:
+                        yield encode_event(event)
+                    return
+                # Режим throughput: мелкие дельты склеиваются в более крупные события
+                async with aclosing(coalescer.coalesce(events)) as coalesced:
+                    async for event in coalesced:
+                        yield encode_event(event)
+
         async def stream():
-            async for chunk in auth_manager.stream_chat(model, messages):
-                yield f"data: {json.dumps(chunk)}\n\n"
-            yield "data: [DONE]\n\n"
+            try:
+                async with aclosing(frames()) as events:
+                    async for frame in events:
+                        yield frame if encoder is None else encoder.frame(frame)
+            except UpstreamError as e:
+                yield encode_error(e) if encoder is None else encoder.frame(encode_error(e))
+            done = b"data: [DONE]\n\n"
+            yield done if encoder is None else encoder.frame(done) + encoder.finish()
 
         async_gen = stream()
-        while True:
-            try:
-                yield loop.run_until_complete(anext(async_gen))
-            except StopAsyncIteration:
-                loop.close()
-                break
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(anext(async_gen))
+                except StopAsyncIteration:
+                    break
+        finally:
+            # Клиент отключился (Werkzeug закрывает генератор) или поток закончился:
+            # закрываем ответ upstream и пул соединений этого loop
+            loop.run_until_complete(async_gen.aclose())
+            loop.run_until_complete(auth_manager.close())
+            loop.close()
 
     return app
 
-def run_api(port=API_PORT, host=API_HOST, default_model=DEFAULT_MODEL, min_accounts=MIN_ACCOUNTS):
+def run_api(port=API_PORT, host=API_HOST, default_model=DEFAULT_MODEL, min_accounts=MIN_ACCOUNTS, cache=None,
+            timeouts=None, resilience=None, coalescer=None, compression=COMPRESSION, sessions=None,
+            scheduler=None):
     update_config(port=port, host=host, default_model=default_model, min_accounts=min_accounts)
-    app = create_app()
+    app = create_app(cache=cache, timeouts=timeouts, resilience=resilience, coalescer=coalescer,
+                     compression=compression, sessions=sessions, scheduler=scheduler)
     print(f"API running at http://{API_HOST}:{port}/api/chat/completions")
     print(f"Docs: http://{API_HOST}:{port}/docs (not implemented yet)")
     app.run(host=API_HOST, port=port, debug=False, use_reloader=False)
\ No newline at end of file
@@ -1,62 +1,68 @@
 import asyncio
 import os
-import json
+import threading
 import time
-import random
+import weakref
+from contextlib import aclosing
 import aiohttp
-import requests
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
-from .playwright_auth import get_new_credentials
-from .config import TOKEN_TTL, MIN_ACCOUNTS, PRE_EXPIRY_THRESHOLD, MAX_WORKERS
+from .sse import SSEParser, DONE, parse_event
+from .credential_store import CredentialStore
+from .metrics import default_metrics
+from .json_backend import dumps
+from .timeouts import Timeouts, Deadline
+from .errors import UpstreamError, UpstreamHTTPError, UpstreamConnectionError, NoAccountsError
+from .compression import EncodedBody, decompress
+from .resilience import Resilience, ACCOUNT_STATUSES
+from .config import (UPSTREAM_HOST, MIN_ACCOUNTS, PRE_EXPIRY_THRESHOLD, POOL_LIMIT,
+                     POOL_LIMIT_PER_HOST, DNS_CACHE_TTL, KEEPALIVE_TIMEOUT, WARMUP_CONNECTIONS)
 
 class AuthManager:
-    def __init__(self):
-        self.api_host = "https://chat.inceptionlabs.ai"
-        self.accounts_file = os.path.join(os.path.dirname(__file__), 'accounts.json')
-        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-        self.accounts = {"active": [], "rate_limited": []}  # Инициализация по умолчанию
+    def __init__(self, pool_limit=POOL_LIMIT, pool_limit_per_host=POOL_LIMIT_PER_HOST, api_host=None,
+                 accounts_file=None, metrics=None, timeouts=None, generate_accounts=True, resilience=None):
+        self.api_host = api_host or UPSTREAM_HOST
+        self.accounts_file = accounts_file or os.path.join(os.path.dirname(__file__), 'accounts.json')
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self._sessions = weakref.WeakKeyDictionary()
+        self._sessions_lock = threading.Lock()  # словарь меняют потоки запросов Flask, читает /metrics
+        self._connections_created = 0
+        self.timeouts = Timeouts.default().merged(timeouts)
+        self.metrics = metrics or default_metrics()
+        self.metrics.track(self)
+        # Повторы, бюджет повторов, circuit breaker и хеджирование общие для всех запросов менеджера
+        self.resilience = resilience or Resilience()
+        if self.resilience.metrics is None:
+            self.resilience.metrics = self.metrics
+        # False — аккаунты создаёт другой процесс (супервизор), этот только читает общий файл
+        self.generate_accounts = generate_accounts
+        # Конструктор без I/O: файл аккаунтов читается при первом обращении
+        self.store = CredentialStore(self.accounts_file)
         self.active_account = None
-        self.load_accounts()  # Синхронная загрузка
-        if self.accounts["active"]:
-            self.active_account = random.choice(self.accounts["active"])
+        self._loaded = False
+
+    @property
+    def accounts(self):
+        self._ensure_loaded()
+        return {"active": self.store.active_accounts, "rate_limited": self.store.rate_limited_accounts}
 
     def load_accounts(self):
-        default_accounts = {"active": [], "rate_limited": []}
-        if not os.path.exists(self.accounts_file):
-            self.accounts = default_accounts
-            self.save_accounts()
-        else:
-            try:
-                with open(self.accounts_file, 'r') as f:
-                    content = f.read().strip()
-                    if not content:
-                        self.accounts = default_accounts
-                    else:
-                        self.accounts = json.loads(content)
-            except (json.JSONDecodeError, IOError) as e:
-                self.accounts = default_accounts
-            self.save_accounts()
-        self._cleanup_expired_accounts()
+        self._loaded = True
+        self.store.load()
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load_accounts()
 
     def save_accounts(self):
-        with open(self.accounts_file, 'w') as f:
-            json.dump(self.accounts, f, indent=2)
+        self.store.schedule_flush()
 
     def _cleanup_expired_accounts(self):
-        current_time = time.time()
-        self.accounts["active"] = [
-            acc for acc in self.accounts["active"]
-            if acc.get("created_at", 0) + TOKEN_TTL > current_time
-        ]
-        self.accounts["rate_limited"] = [
-            acc for acc in self.accounts["rate_limited"]
-            if acc.get("created_at", 0) + TOKEN_TTL > current_time
-        ]
-        self.save_accounts()
+        self.store.expire()
 
     async def _generate_account(self):
         try:
+            # Playwright нужен только для генерации аккаунтов
+            from .playwright_auth import get_new_credentials
             creds = await get_new_credentials()
             if creds:
                 creds["created_at"] = time.time()
@@ -68,50 +74,139 @@ class AuthManager:
         tasks = [self._generate_account() for _ in range(count)]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         new_accounts = [r for r in results if r and not isinstance(r, Exception)]
-        if not new_accounts and not self.accounts["active"]:
+        if not new_accounts and not len(self.store):
             print(f"Failed to generate {count} accounts")
-        self.accounts["active"].extend(new_accounts)
+        for account in new_accounts:
+            self.store.add(account)
         self.save_accounts()
 
     async def _maintain_accounts(self):
+        self._ensure_loaded()
         while True:
+            self.store.maybe_refresh()
             self._cleanup_expired_accounts()
-            current_time = time.time()
-            active_count = len(self.accounts["active"])
-            near_expiry = sum(1 for acc in self.accounts["active"]
-                              if acc.get("created_at", 0) + TOKEN_TTL - current_time < PRE_EXPIRY_THRESHOLD)
+            active_count = len(self.store)
+            near_expiry = self.store.count_expiring(PRE_EXPIRY_THRESHOLD)
             if active_count + near_expiry < MIN_ACCOUNTS:
                 needed = MIN_ACCOUNTS - (active_count - near_expiry)
                 await self._generate_multiple_accounts(needed)
             await asyncio.sleep(60)
 
     async def initialize_accounts(self):
-        if not self.accounts["active"]:
+        self._ensure_loaded()
+        if not len(self.store):
             await self._generate_multiple_accounts(MIN_ACCOUNTS)
-        if self.accounts["active"]:
-            self.active_account = random.choice(self.accounts["active"])
-        else:
-            raise ValueError("No active accounts available after initialization")
+        self.active_account = self.store.random_active()
+        if self.active_account is None:
+            raise NoAccountsError("No active accounts available after initialization")
+
+    async def maintain(self):
+        # Инициализация и фоновое обслуживание аккаунтов в текущем event loop
+        try:
+            await self.initialize_accounts()
+        except Exception as e:
+            print(f"Account initialization failed: {str(e)}")
+        await self._maintain_accounts()
 
     async def get_active_account(self):
-        self._cleanup_expired_accounts()
-        if not self.accounts.get("active"):
+        self._ensure_loaded()
+        self.store.maybe_refresh()
+        account = self.store.random_active()
+        if account is None and self.generate_accounts:
             await self._generate_multiple_accounts(MIN_ACCOUNTS)
-        self.active_account = random.choice(self.accounts["active"])
+            account = self.store.random_active()
+        if account is None:
+            raise NoAccountsError("No active accounts available")
+        self.active_account = account
         return self.active_account
 
     def mark_rate_limited(self, account):
         if not account:
             return
-        if account in self.accounts["active"]:
-            self.accounts["active"].remove(account)
+        self._ensure_loaded()
+        self.store.mark_rate_limited(account)
         self.save_accounts()
 
-    async def get_headers(self):
-        if not self.active_account:
-            self.active_account = await self.get_active_account()
-        bearer = self.active_account.get("bearer")
-        cookies = self.active_account.get("cookies", {})
+    async def __aenter__(self):
+        await self.get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def get_session(self):
+        # Сессия привязана к event loop: у каждого loop (например, потока Flask) свой пул
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_start.append(self._on_connection_create_start)
+            trace_config.on_connection_create_end.append(self._on_connection_created)
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+            with self._sessions_lock:
+                self._sessions[loop] = session
+        return session
+
+    async def _on_connection_create_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.connect_started = time.perf_counter()
+
+    async def _on_connection_created(self, session, trace_config_ctx, params):
+        self._connections_created += 1
+        started = getattr(trace_config_ctx, 'connect_started', None)
+        if started is not None:
+            self.metrics.connect_seconds.observe(time.perf_counter() - started)
+
+    async def warmup(self, connections=WARMUP_CONNECTIONS):
+        session = await self.get_session()
+
+        async def touch():
+            try:
+                async with session.head(self.api_host, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+        await asyncio.gather(*(touch() for _ in range(connections)))
+
+    def pool_stats(self):
+        stats = {"idle": 0, "in_use": 0, "created": self._connections_created,
+                 "limit": self.pool_limit, "limit_per_host": self.pool_limit_per_host}
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            try:
+                if session.closed:
+                    continue
+                connector = session.connector
+                idle = sum(len(conns) for conns in list(connector._conns.values()))
+                in_use = len(connector._acquired)
+            except (RuntimeError, AttributeError):
+                # Пул меняет поток другого запроса или сессию закрыли во время обхода — пропускаем её
+                continue
+            stats["idle"] += idle
+            stats["in_use"] += in_use
+        return stats
+
+    async def close(self):
+        with self._sessions_lock:
+            session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def get_headers(self, account=None):
+        if account is None:
+            if not self.active_account:
+                self.active_account = await self.get_active_account()
+            account = self.active_account
+        bearer = account.get("bearer")
+        cookies = account.get("cookies", {})
         cookie_string = "; ".join([f"{k}={v}" for k, v in cookies.items()])
         return {
             "Content-Type": "application/json",
@@ -120,69 +215,193 @@ class AuthManager:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         }
 
-    async def stream_chat(self, model, messages):
+    async def stream_chat_raw(self, model, messages, timeouts=None, **params):
+        # Отдаёт payload событий SSE как есть (bytes), без декодирования и json.loads.
+        # Закрытие генератора (aclose, отмена задачи) сразу закрывает ответ upstream.
+        # Попытка повторяется по политике resilience, пока потребителю не отдано ни одного события;
+        # ошибки выбрасываются как UpstreamError.
         url = f"{self.api_host}/api/chat/completions"
-        headers = await self.get_headers()
-        data = {"model": model, "messages": messages, "stream": True}
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, headers=headers, json=data, timeout=60) as response:
-                    if response.status == 401:
-                        self.mark_rate_limited(self.active_account)
-                        self.active_account = await self.get_active_account()
-                        headers = await self.get_headers()
-                        async with session.post(url, headers=headers, json=data, timeout=60) as retry_response:
-                            if retry_response.status != 200:
-                                error_text = await retry_response.text()
-                                yield {"choices": [{"delta": f"API error: {retry_response.status} - {error_text[:200]}"}]}
-                            else:
-                                async for line in retry_response.content:
-                                    line = line.decode('utf-8', errors='replace').strip()
-                                    if line.startswith('data: '):
-                                        if line == 'data: [DONE]':
-                                            break
-                                        try:
-                                            json_str = line[6:]
-                                            chunk = json.loads(json_str)
-                                            yield chunk
-                                        except json.JSONDecodeError as e:
-                                            yield {"choices": [{"delta": f"JSON decode error: {str(e)}"}]}
-                    else:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            yield {"choices": [{"delta": f"API error: {response.status} - {error_text[:200]}"}]}
-                        else:
-                            async for line in response.content:
-                                line = line.decode('utf-8', errors='replace').strip()
-                                if line.startswith('data: '):
-                                    if line == 'data: [DONE]':
-                                        break
-                                    try:
-                                        json_str = line[6:]
-                                        chunk = json.loads(json_str)
-                                        yield chunk
-                                    except json.JSONDecodeError as e:
-                                        yield {"choices": [{"delta": f"JSON decode error: {str(e)}"}]}
-            except Exception as e:
-                yield {"choices": [{"delta": f"Stream error: {str(e)}"}]}
-
-    async def complete_chat(self, model, messages):
+        body = dumps({**params, "model": model, "messages": messages, "stream": True})
+        session = await self.get_session()
+        metrics = self.metrics
+        resilience = self.resilience
+        ctx = metrics.request_started(model, True, len(body))
+        timeouts = self.timeouts.merged(timeouts)
+        origin = asyncio.get_running_loop().time()
+        retry = resilience.retry_state(None if timeouts.total is None else origin + timeouts.total)
+        attempts = 0
+        error = None
+        try:
+            while True:
+                resilience.check()
+                if attempts:
+                    ctx.bytes_out += len(body)
+                attempts += 1
+                deadline = Deadline(timeouts, origin)
+                response = None
+                delivered = False
+                try:
+                    response = await self._send(session, url, body, deadline, ctx)
+                    async for event in _iter_events(response, deadline, metrics, ctx):
+                        delivered = True
+                        yield event
+                    # Успех — только дочитанный поток: обрыв посреди тела должен копиться в circuit breaker
+                    resilience.succeeded()
+                    response.release()
+                    return
+                except UpstreamError as e:
+                    resilience.failed(e)
+                    delay = None if delivered else retry.delay(e)
+                    if delay is None:
+                        raise
+                finally:
+                    deadline.cancel()
+                    if response is not None:
+                        # Недочитанный ответ закрываем вместе с соединением; после release — ничего не делает
+                        response.close()
+                if delay:
+                    await asyncio.sleep(delay)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            metrics.request_finished(ctx, error)
+
+    async def stream_chat(self, model, messages, timeouts=None, **params):
+        async with aclosing(self.stream_chat_raw(model, messages, timeouts, **params)) as events:
+            async for event in events:
+                yield parse_event(event)
+
+    async def complete_chat(self, model, messages, timeouts=None, **params):
+        # Возвращает текст ответа upstream; ошибки — UpstreamError после всех повторов
+        return (await self.complete_chat_raw(model, messages, timeouts, **params)).text()
+
+    async def complete_chat_raw(self, model, messages, timeouts=None, **params):
+        # Возвращает EncodedBody: байты ответа upstream без распаковки и декодирования
         url = f"{self.api_host}/api/chat/completions"
-        headers = await self.get_headers()
-        data = {"model": model, "messages": messages, "stream": False}
-        async with aiohttp.ClientSession() as session:
+        body = dumps({**params, "model": model, "messages": messages, "stream": False})
+        session = await self.get_session()
+        metrics = self.metrics
+        ctx = metrics.request_started(model, False, len(body))
+        timeouts = self.timeouts.merged(timeouts)
+        origin = asyncio.get_running_loop().time()
+        attempts = 0
+        error = None
+
+        async def attempt(account=None):
+            nonlocal attempts
+            if attempts:
+                ctx.bytes_out += len(body)
+            attempts += 1
+            deadline = Deadline(timeouts, origin)
+            response = None
+            try:
+                response = await self._send(session, url, body, deadline, ctx, account, auto_decompress=False)
+                content = await _read_body(response, deadline)
+                ctx.bytes_in = len(content)
+                response.release()
+                headers = response.headers
+                return EncodedBody(content, headers.get('Content-Encoding'),
+                                   headers.get('Content-Type', 'application/json'))
+            finally:
+                deadline.cancel()
+                if response is not None:
+                    response.close()
+
+        async def hedge():
+            # Дублёр медленного запроса идёт с другого случайного аккаунта
+            return await attempt(self.store.random_active())
+
+        try:
+            return await self.resilience.call(attempt, hedge,
+                                              None if timeouts.total is None else origin + timeouts.total)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            metrics.request_finished(ctx, error)
+
+    async def _send(self, session, url, body, deadline, ctx, account=None, auto_decompress=True):
+        # Одна попытка: ответ 200 или UpstreamError; после 401/429 аккаунт уходит в rate limited
+        if account is None:
+            if not self.active_account:
+                self.active_account = await self.get_active_account()
+            account = self.active_account
+        headers = await self.get_headers(account)
+        response = await self._post(session, url, headers, body, deadline, auto_decompress)
+        self.metrics.upstream_response(ctx, response.status)
+        if response.status == 200:
+            return response
+        try:
+            content = await _read_body(response, deadline)
+        except BaseException:
+            response.close()
+            raise
+        if not auto_decompress:
             try:
-                async with session.post(url, headers=headers, json=data, timeout=60) as response:
-                    if response.status == 401:
-                        self.mark_rate_limited(self.active_account)
-                        self.active_account = await self.get_active_account()
-                        return await self.complete_chat(model, messages)
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"API error: {response.status} - {error_text[:200]}")
-                    # Возвращаем текст ответа напрямую
-                    return await response.text()
-            except aiohttp.ClientConnectionError as e:
-                raise Exception(f"Connection error: {str(e)}")
-            except Exception as e:
-                raise Exception(f"Request error: {str(e)}")
\ No newline at end of file
+                content = decompress(content, response.headers.get('Content-Encoding', '').lower())
+            except ValueError:
+                pass  # текст ошибки нужен только для сообщения
+        text = content.decode('utf-8', 'replace')
+        response.release()
+        if response.status in ACCOUNT_STATUSES:
+            if response.status == 401:
+                self.metrics.auth_retries.inc()
+            self.mark_rate_limited(account)
+            if self.active_account is account:
+                self.active_account = None
+        raise UpstreamHTTPError(response.status, text, _retry_after(response.headers))
+
+    async def _post(self, session, url, headers, body, deadline, auto_decompress=True):
+        try:
+            response = await deadline.request(
+                session.post(url, headers=headers, data=body, timeout=deadline.client_timeout,
+                             auto_decompress=auto_decompress))
+        except aiohttp.ClientError as e:
+            raise UpstreamConnectionError(f"Connection error: {str(e)}") from e
+        deadline.watch(response)
+        return response
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None  # нет заголовка или HTTP-дата
+
+
+async def _iter_events(response, deadline, metrics, ctx):
+    parser = SSEParser()
+    try:
+        async for data in response.content.iter_any():
+            deadline.data()
+            ctx.bytes_in += len(data)
+            for event in parser.feed(data):
+                if event == DONE:
+                    return
+                metrics.chunk(ctx, event)
+                deadline.pause()
+                yield event
+                deadline.touch()
+    except aiohttp.ClientError as e:
+        deadline.check()
+        raise UpstreamConnectionError(f"Stream error: {str(e)}") from e
+    deadline.check()
+    for event in parser.flush():
+        if event == DONE:
+            return
+        metrics.chunk(ctx, event)
+        yield event
+
+
+async def _read_body(response, deadline):
+    chunks = []
+    try:
+        async for data in response.content.iter_any():
+            deadline.data()
+            chunks.append(data)
+    except aiohttp.ClientError as e:
+        deadline.check()
+        raise UpstreamConnectionError(f"Connection error: {str(e)}") from e
+    deadline.check()
+    return b"".join(chunks)
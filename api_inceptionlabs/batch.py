@@ -0,0 +1,189 @@
+import asyncio
+import sys
+from collections import deque
+from .json_backend import dumps, loads, JSONDecodeError
+from .timeouts import Timeouts
+from .errors import UpstreamError
+from .stopping import StopCondition, complete_limited
+from . import config
+
+
+class BatchResult:
+    __slots__ = ('index', 'request', 'response', 'error')
+
+    def __init__(self, index, request, response=None, error=None):
+        self.index = index
+        self.request = request
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def as_dict(self):
+        item = {"index": self.index}
+        if isinstance(self.request, dict) and "custom_id" in self.request:
+            item["custom_id"] = self.request["custom_id"]
+        if self.error is None:
+            item["response"] = self.response
+        else:
+            item["error"] = str(self.error)
+        return item
+
+
+def split_request(request):
+    # Запрос пакета — тело обычного /api/chat/completions, плюс необязательный custom_id
+    if not isinstance(request, dict):
+        raise ValueError("Batch item must be a JSON object")
+    params = {k: v for k, v in request.items() if k not in ('model', 'messages', 'stream', 'custom_id', 'timeout')}
+    timeouts = Timeouts.coerce(request.get('timeout'))
+    return request.get('model', config.DEFAULT_MODEL), request.get('messages', []), params, timeouts
+
+
+def completion_fetcher(complete):
+    # complete(model, messages, params, timeouts, condition) -> тело ответа upstream; результат разбирается в dict.
+    # condition — StopCondition из stop/max_tokens/max_chars запроса или None
+    async def fetch(request):
+        model, messages, params, timeouts = split_request(request)
+        return loads(await complete(model, messages, params, timeouts, StopCondition.from_params(params)))
+    return fetch
+
+
+def parse_batch_body(data):
+    # Тело /api/chat/completions/batch: {"requests": [...], "concurrency": n}
+    requests = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(requests, list):
+        raise ValueError("'requests' must be a list")
+    if len(requests) > config.BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {config.BATCH_MAX_ITEMS} requests per batch")
+    concurrency = data.get('concurrency', config.BATCH_CONCURRENCY)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError("'concurrency' must be a positive integer")
+    return requests, min(concurrency, config.BATCH_MAX_CONCURRENCY)
+
+
+async def collect_batch(fetch, requests, concurrency):
+    results = [None] * len(requests)
+    async for result in run_batch(fetch, requests, concurrency, ordered=False):
+        results[result.index] = result.as_dict()
+    return {"object": "batch", "results": results}
+
+
+async def _run_one(fetch, index, request, retries, retry_delay):
+    error = None
+    for attempt in range(retries + 1):
+        try:
+            return BatchResult(index, request, await fetch(request))
+        except asyncio.CancelledError:
+            raise
+        except (ValueError, UpstreamError) as e:
+            # Некорректный запрос: повтор не поможет. Ошибки upstream уже повторены Resilience
+            # (или фатальны, как 400) — повтор здесь только умножил бы попытки
+            return BatchResult(index, request, error=e)
+        except Exception as e:
+            error = e
+            if attempt < retries:
+                await asyncio.sleep(retry_delay * 2 ** attempt)
+    return BatchResult(index, request, error=error)
+
+
+async def iter_batch(fetch, items, concurrency=config.BATCH_CONCURRENCY, ordered=True,
+                     retries=config.BATCH_RETRIES, retry_delay=config.BATCH_RETRY_DELAY):
+    # items — итератор пар (index, request); читается лениво, в работе не больше concurrency запросов.
+    # ordered=True отдаёт результаты в порядке items, иначе — по мере готовности.
+    items = iter(items)
+    pending = deque() if ordered else set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    index, request = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                task = asyncio.ensure_future(_run_one(fetch, index, request, retries, retry_delay))
+                if ordered:
+                    pending.append(task)
+                else:
+                    pending.add(task)
+            if not pending:
+                return
+            if ordered:
+                yield await pending.popleft()
+            else:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def run_batch(fetch, requests, concurrency=config.BATCH_CONCURRENCY, ordered=True,
+              retries=config.BATCH_RETRIES, retry_delay=config.BATCH_RETRY_DELAY):
+    return iter_batch(fetch, enumerate(requests), concurrency, ordered, retries, retry_delay)
+
+
+def load_checkpoint(path, retry_errors=False):
+    # Индексы, уже записанные в выходной файл. Недописанная последняя строка обрезается.
+    done = set()
+    try:
+        f = open(path, 'rb+')
+    except FileNotFoundError:
+        return done
+    with f:
+        offset = valid_end = 0
+        for line in f:
+            offset += len(line)
+            if not line.endswith(b"\n"):
+                break
+            valid_end = offset
+            try:
+                item = loads(line)
+            except JSONDecodeError:
+                continue
+            if retry_errors and "error" in item:
+                continue
+            done.add(item["index"])
+        f.truncate(valid_end)
+    return done
+
+
+def read_requests(path, skip=()):
+    # Пары (номер строки, запрос); номер строки — стабильный индекс между перезапусками
+    with open(path, 'rb') as f:
+        for index, line in enumerate(f):
+            if index in skip or not line.strip():
+                continue
+            try:
+                yield index, loads(line)
+            except JSONDecodeError:
+                yield index, None  # split_request отклонит его как некорректный
+
+
+async def process_jsonl(auth_manager, input_path, output_path, concurrency=config.BATCH_CONCURRENCY,
+                        retries=config.BATCH_RETRIES, retry_errors=False):
+    done = load_checkpoint(output_path, retry_errors)
+    async def complete(model, messages, params, timeouts, condition):
+        if condition is None:
+            return await auth_manager.complete_chat(model, messages, timeouts, **params)
+        return await complete_limited(auth_manager, model, messages, condition, timeouts, **params)
+
+    fetch = completion_fetcher(complete)
+    processed = errors = 0
+    with open(output_path, 'ab') as out:
+        async for result in iter_batch(fetch, read_requests(input_path, done), concurrency, ordered=False,
+                                       retries=retries):
+            out.write(dumps(result.as_dict()) + b"\n")
+            out.flush()
+            processed += 1
+            if not result.ok:
+                errors += 1
+    print(f"Batch finished: {processed} processed, {errors} errors, {len(done)} skipped from checkpoint",
+          file=sys.stderr)
+    return processed, errors
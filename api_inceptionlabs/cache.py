@@ -0,0 +1,328 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from .config import CACHE_TTL, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES
+
+
+def make_key(model, messages, params=None):
+    # Канонический JSON: одинаковые запросы с разным порядком ключей дают один ключ
+    payload = json.dumps([model, messages, params or {}], sort_keys=True, separators=(',', ':'),
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    blocking = False
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time() + ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+class DiskBackend:
+    # Один файл на ключ: первая строка — время истечения, дальше тело ответа.
+    # Запись атомарная (tmp + os.replace), поэтому каталог можно делить между процессами.
+    blocking = True
+
+    def __init__(self, directory, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._index = OrderedDict()  # key -> size, порядок LRU
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if len(name) != 64:
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        with self._lock:
+            known = key in self._index
+            if known:
+                self._index.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at = float(f.readline())
+                value = f.read()
+        except FileNotFoundError:
+            if known:
+                self.delete(key)
+            return None
+        except (OSError, ValueError):
+            self.delete(key)
+            return None
+        if not known:
+            # Файл записал другой процесс с тем же каталогом
+            with self._lock:
+                if key not in self._index:
+                    self._index[key] = len(value)
+                    self._bytes += len(value)
+        if expires_at < time.time():
+            self.delete(key)
+            return None
+        return value.decode('utf-8')
+
+    def set(self, key, value, ttl):
+        data = f"{time.time() + ttl}\n".encode('utf-8') + value.encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._bytes += len(data)
+            evicted = []
+            while len(self._index) > self.max_entries or self._bytes > self.max_bytes:
+                evicted_key, evicted_size = self._index.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            self._unlink(evicted_key)
+
+    def delete(self, key):
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+        self._unlink(key)
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._index)
+            self._index.clear()
+            self._bytes = 0
+        for key in keys:
+            self._unlink(key)
+
+    def _unlink(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+class SQLiteBackend:
+    # Одна база SQLite в режиме WAL на несколько процессов: воркеры сервера видят ответы
+    # друг друга, LRU и лимиты общие. Соединение своё у каждого потока.
+    blocking = True
+
+    def __init__(self, path, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires_at REAL, accessed_at REAL, "
+            "size INTEGER, value BLOB)")
+        self._connection().execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3  # нужен только этому бэкенду
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT expires_at, value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[0] < now:
+            self.delete(key)
+            return None
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[1].decode('utf-8')
+
+    def set(self, key, value, ttl):
+        data = value.encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                         (key, now + ttl, now, len(data), data))
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            while count > self.max_entries or total > self.max_bytes:
+                evicted_key, size = conn.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed_at LIMIT 1").fetchone()
+                conn.execute("DELETE FROM entries WHERE key = ?", (evicted_key,))
+                count -= 1
+                total -= size
+                self.evictions += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries")
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def size_bytes(self):
+        return self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=CACHE_TTL):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # Запросы в полёте: ключ -> concurrent.futures.Future, общие для всех потоков и event loop —
+        # Flask выполняет каждый запрос в своём loop, и одинаковые запросы всё равно объединяются
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        if self.backend.blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, self.backend.get, key)
+        return self.backend.get(key)
+
+    async def set(self, key, value):
+        if self.backend.blocking:
+            await asyncio.get_running_loop().run_in_executor(None, self.backend.set, key, value, self.ttl)
+        else:
+            self.backend.set(key, value, self.ttl)
+
+    async def get_or_fetch(self, key, fetch):
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        while True:
+            with self._lock:
+                future = self._inflight.get(key)
+                if future is None:
+                    self.misses += 1
+                    future = self._inflight[key] = concurrent.futures.Future()
+                    break
+                self.coalesced += 1
+            # Такой же запрос уже идёт в upstream, возможно из другого потока, — ждём его результат
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # Отменили того, кто делал запрос (например, клиент отключился) — идём в upstream сами
+
+        try:
+            value = await fetch()
+            await self.set(key, value)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return value
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.backend.evictions,
+            "entries": len(self.backend),
+            "bytes": self.backend.size_bytes,
+        }
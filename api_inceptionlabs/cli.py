@@ -1,5 +1,101 @@
 import argparse
-from .api import run_api
+import asyncio
+import functools
+import os
+from .cache import ResponseCache, MemoryBackend, DiskBackend, SQLiteBackend
+from .fanout import StreamMultiplexer
+from .timeouts import Timeouts
+from .resilience import Resilience, RetryPolicy, CircuitBreaker, HedgePolicy
+from .coalesce import StreamCoalescer, MODES as SSE_MODES
+from .sessions import SessionStore
+from .scheduler import Scheduler
+from .config import (CACHE_TTL, CACHE_MAX_ENTRIES, FANOUT_BUFFER_SIZE, BATCH_CONCURRENCY, BATCH_RETRIES,
+                     CONNECT_TIMEOUT, FIRST_BYTE_TIMEOUT, IDLE_TIMEOUT, REQUEST_TIMEOUT, RETRY_ATTEMPTS,
+                     BREAKER_FAILURES, BREAKER_RECOVERY, HEDGE_PERCENTILE, SSE_MODE, SSE_COALESCE_BYTES,
+                     SSE_COALESCE_DELAY, COMPRESSION, SESSION_TTL, SESSION_MAX_SESSIONS, SESSION_MAX_MESSAGES,
+                     SCHEDULER_MAX_QUEUE, SCHEDULER_MAX_QUEUE_PER_CLIENT, SCHEDULER_MAX_WAIT)
+
+def timeouts_from_args(args):
+    return Timeouts(args.connect_timeout, args.first_byte_timeout, args.idle_timeout, args.request_timeout)
+
+def resilience_from_args(args):
+    return Resilience(policy=RetryPolicy(attempts=args.upstream_attempts),
+                      breaker=CircuitBreaker(args.breaker_failures, args.breaker_recovery),
+                      hedge=HedgePolicy(percentile=args.hedge_percentile))
+
+def build_cache(args):
+    if args.cache == 'memory':
+        return ResponseCache(MemoryBackend(max_entries=args.cache_size), ttl=args.cache_ttl)
+    if args.cache == 'disk':
+        return ResponseCache(DiskBackend(args.cache_dir, max_entries=args.cache_size), ttl=args.cache_ttl)
+    if args.cache == 'sqlite':
+        path = os.path.join(args.cache_dir, "cache.sqlite3")
+        return ResponseCache(SQLiteBackend(path, max_entries=args.cache_size), ttl=args.cache_ttl)
+    return None
+
+def build_fanout(args):
+    if not args.fanout:
+        return None
+    return StreamMultiplexer(buffer_size=args.fanout_buffer, slow_consumer=args.fanout_slow_policy)
+
+def build_coalescer(args):
+    if args.sse_mode != 'throughput':
+        return None
+    return StreamCoalescer(max_bytes=args.sse_coalesce_bytes, max_delay=args.sse_coalesce_ms / 1000)
+
+def build_sessions(args):
+    if not args.sessions:
+        return None
+    max_messages = args.session_max_messages or None  # 0 — без ограничения
+    return SessionStore(ttl=args.session_ttl, max_sessions=args.session_max, max_messages=max_messages,
+                        directory=args.session_dir)
+
+def build_scheduler(args):
+    if not args.max_inflight:
+        return None
+    return Scheduler(max_inflight=args.max_inflight, max_queue=args.max_queue,
+                     max_queue_per_client=args.max_queue_per_client, max_wait=args.max_queue_wait)
+
+def build_worker_app(args):
+    # Вызывается в каждом процессе-воркере (--workers): аккаунты ведёт супервизор
+    from .auth_manager import AuthManager
+    from . import config
+    config.update_config(port=args.port, host=args.host, default_model=args.model, min_accounts=args.min_accounts)
+    auth_manager = AuthManager(timeouts=timeouts_from_args(args), resilience=resilience_from_args(args),
+                               generate_accounts=False)
+    if args.server == 'aiohttp':
+        from .aio_api import create_aio_app
+        return create_aio_app(auth_manager, maintain_accounts=False, cache=build_cache(args),
+                              fanout=build_fanout(args), coalescer=build_coalescer(args), compression=args.compress,
+                              scheduler=build_scheduler(args))
+    from .api import create_app
+    return create_app(auth_manager, cache=build_cache(args), maintain_accounts=False,
+                      coalescer=build_coalescer(args), compression=args.compress, scheduler=build_scheduler(args))
+
+def run_workers_command(args):
+    from .auth_manager import AuthManager
+    from .workers import run_workers
+    if args.cache == 'memory':
+        # Память у каждого воркера своя — общий кэш держим в SQLite
+        print(f"--cache memory with --workers: using a shared SQLite cache in {args.cache_dir}")
+        args.cache = 'sqlite'
+    print(f"API running at http://{args.host}:{args.port}/api/chat/completions "
+          f"({args.workers} {args.server} workers)")
+    run_workers(functools.partial(build_worker_app, args), args.host, args.port, args.workers,
+                server=args.server, auth_manager_factory=AuthManager)
+
+def run_batch_command(args):
+    from .auth_manager import AuthManager
+    from .batch import process_jsonl
+
+    async def run():
+        async with AuthManager(timeouts=timeouts_from_args(args),
+                               resilience=resilience_from_args(args)) as auth_manager:
+            await auth_manager.initialize_accounts()
+            await process_jsonl(auth_manager, args.input, args.output, concurrency=args.concurrency,
+                                retries=args.retries, retry_errors=args.retry_errors)
+
+    asyncio.run(run())
 
 def main():
     parser = argparse.ArgumentParser(description="Run Chat Library API")
@@ -7,10 +103,109 @@ def main():
     parser.add_argument('--host', type=str, default="0.0.0.0", help="Host to run the API on")
     parser.add_argument('--model', type=str, default="lambda.mercury-coder-small", help="Default model for API")
     parser.add_argument('--min-accounts', type=int, default=2, help="Minimum number of accounts to maintain")
+    parser.add_argument('--server', choices=['flask', 'aiohttp'], default='flask',
+                        help="Server backend: threaded Flask or single event loop aiohttp")
+    parser.add_argument('--cache', choices=['none', 'memory', 'disk', 'sqlite'], default='none',
+                        help="Cache for non-streaming completions")
+    parser.add_argument('--cache-dir', type=str, default=".cache/completions",
+                        help="Directory for --cache disk and sqlite")
+    parser.add_argument('--cache-ttl', type=int, default=CACHE_TTL, help="Cache entry TTL in seconds")
+    parser.add_argument('--cache-size', type=int, default=CACHE_MAX_ENTRIES, help="Maximum number of cached responses")
+    parser.add_argument('--fanout', action='store_true',
+                        help="Share one upstream stream between identical concurrent streaming requests (aiohttp only)")
+    parser.add_argument('--fanout-buffer', type=int, default=FANOUT_BUFFER_SIZE,
+                        help="Per-subscriber buffer size for --fanout, in events")
+    parser.add_argument('--fanout-slow-policy', choices=['disconnect', 'history'], default='disconnect',
+                        help="What to do with a subscriber whose buffer overflows")
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT,
+                        help="Upstream connect timeout, seconds")
+    parser.add_argument('--first-byte-timeout', type=float, default=FIRST_BYTE_TIMEOUT,
+                        help="Time allowed until the first upstream data, seconds")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="Longest allowed pause between upstream chunks, seconds")
+    parser.add_argument('--request-timeout', type=float, default=REQUEST_TIMEOUT,
+                        help="Deadline for a whole upstream request, seconds (default: none)")
+    parser.add_argument('--upstream-attempts', type=int, default=RETRY_ATTEMPTS,
+                        help="Attempts per upstream request for timeouts, connection errors and 5xx responses")
+    parser.add_argument('--breaker-failures', type=int, default=BREAKER_FAILURES,
+                        help="Consecutive upstream failures that open the circuit breaker, 0 = disabled")
+    parser.add_argument('--breaker-recovery', type=float, default=BREAKER_RECOVERY,
+                        help="Seconds the circuit stays open before a probe request")
+    parser.add_argument('--hedge-percentile', type=float, default=HEDGE_PERCENTILE,
+                        help="Send a second non-streaming attempt once the first exceeds this latency "
+                             "percentile of recent requests, e.g. 0.95 (default: off)")
+    parser.add_argument('--sse-mode', choices=SSE_MODES, default=SSE_MODE,
+                        help="latency: forward every upstream event at once; throughput: merge small "
+                             "content deltas into fewer, larger events")
+    parser.add_argument('--sse-coalesce-bytes', type=int, default=SSE_COALESCE_BYTES,
+                        help="--sse-mode throughput: flush a merged event once it reaches this size")
+    parser.add_argument('--sse-coalesce-ms', type=float, default=SSE_COALESCE_DELAY * 1000,
+                        help="--sse-mode throughput: longest time a delta waits to be merged, ms")
+    parser.add_argument('--compress', action='store_true', default=COMPRESSION,
+                        help="Compress responses and streams with br or gzip when the client accepts it")
+    parser.add_argument('--sessions', action='store_true',
+                        help="Keep conversation history on the server: POST /api/sessions, then send only new "
+                             "messages with \"session_id\"")
+    parser.add_argument('--session-ttl', type=float, default=SESSION_TTL,
+                        help="Seconds an idle session is kept")
+    parser.add_argument('--session-max', type=int, default=SESSION_MAX_SESSIONS,
+                        help="Sessions kept in memory; the least recently used ones are evicted")
+    parser.add_argument('--session-max-messages', type=int, default=SESSION_MAX_MESSAGES,
+                        help="Messages of history kept per session besides the leading system ones, 0 = all")
+    parser.add_argument('--session-dir', type=str, default=None,
+                        help="Write sessions evicted from memory to this directory instead of dropping them")
+    parser.add_argument('--max-inflight', type=int, default=0,
+                        help="Upstream requests in flight per process; the rest wait in a fair queue (default: off)")
+    parser.add_argument('--max-queue', type=int, default=SCHEDULER_MAX_QUEUE,
+                        help="--max-inflight: queued requests before new ones get 503")
+    parser.add_argument('--max-queue-per-client', type=int, default=SCHEDULER_MAX_QUEUE_PER_CLIENT,
+                        help="--max-inflight: queued requests of one client before its new ones get 429")
+    parser.add_argument('--max-queue-wait', type=float, default=SCHEDULER_MAX_WAIT,
+                        help="--max-inflight: seconds a request may wait for a slot before it gets 503")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Server processes sharing the port; a supervisor maintains accounts and restarts workers")
+    subparsers = parser.add_subparsers(dest='command')
+    batch_parser = subparsers.add_parser(
+        'batch', help="Process a JSONL file of completion requests into a JSONL file of results",
+        description="Each input line is a request body ({\"model\", \"messages\", ...}, optional \"custom_id\"). "
+                    "Results are appended to OUTPUT as they complete; rerunning with the same OUTPUT "
+                    "skips lines that are already there.")
+    batch_parser.add_argument('input', help="Input JSONL file")
+    batch_parser.add_argument('output', help="Output JSONL file, also used as the checkpoint")
+    batch_parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help="Requests in flight")
+    batch_parser.add_argument('--retries', type=int, default=BATCH_RETRIES, help="Retries per failed request")
+    batch_parser.add_argument('--retry-errors', action='store_true',
+                              help="On resume, run again the lines whose previous result was an error")
     args = parser.parse_args()
+
+    if args.command == 'batch':
+        run_batch_command(args)
+        return
+    if args.fanout and args.server != 'aiohttp':
+        # Flask выполняет каждый запрос в своём event loop — общий upstream-поток между ними не разделить
+        parser.error("--fanout requires --server aiohttp")
+    if args.workers > 1:
+        if args.sessions:
+            # История живёт в памяти процесса, а запросы одной сессии попадают в разные воркеры
+            parser.error("--sessions is not supported with --workers")
+        run_workers_command(args)
+        return
     
+    cache = build_cache(args)
+
     # Передаём аргументы в run_api
-    run_api(port=args.port, host=args.host, default_model=args.model, min_accounts=args.min_accounts)
+    if args.server == 'aiohttp':
+        from .aio_api import run_aio_api
+        run_aio_api(port=args.port, host=args.host, default_model=args.model, min_accounts=args.min_accounts,
+                    cache=cache, fanout=build_fanout(args), timeouts=timeouts_from_args(args),
+                    resilience=resilience_from_args(args), coalescer=build_coalescer(args),
+                    compression=args.compress, sessions=build_sessions(args), scheduler=build_scheduler(args))
+    else:
+        from .api import run_api
+        run_api(port=args.port, host=args.host, default_model=args.model, min_accounts=args.min_accounts,
+                cache=cache, timeouts=timeouts_from_args(args), resilience=resilience_from_args(args),
+                coalescer=build_coalescer(args), compression=args.compress, sessions=build_sessions(args),
+                scheduler=build_scheduler(args))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
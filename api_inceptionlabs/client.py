@@ -1,100 +1,345 @@
 import asyncio
-import json
+import queue
+import threading
 import time
-import brotli
+from contextlib import aclosing, nullcontext
 from .auth_manager import AuthManager
-from .config import DEFAULT_MODEL
+from .cache import make_key
+from .json_backend import loads, JSONDecodeError
+from .metrics import (register_cache_metrics, register_fanout_metrics, register_session_metrics,
+                      register_scheduler_metrics)
+from .sessions import reply_message, record_stream
+from .scheduler import scheduled
+from .stopping import StopCondition, stream_limited, complete_limited
+from .batch import run_batch, split_request
+from .timeouts import Timeouts
+from .config import DEFAULT_MODEL, BATCH_CONCURRENCY, BATCH_RETRIES, SYNC_STREAM_BUFFER
 
 class Completions:
     def __init__(self, client):
         self.client = client
 
-    async def create(self, model=DEFAULT_MODEL, messages=None, **kwargs):
-        response = await self.client._complete_chat(model, messages or [])
+    # timeout — число секунд на весь запрос, Timeouts или словарь с connect/first_byte/idle/total;
+    # session_id — сессия из client.sessions.create(): messages содержат только новые сообщения;
+    # priority — класс планировщика (high, normal, low), если клиент создан с scheduler;
+    # stop, max_tokens, max_chars и stop_when(text) обрывают ответ upstream, как только условие выполнено
+    async def create(self, model=DEFAULT_MODEL, messages=None, timeout=None, session_id=None, priority=None,
+                     stop_when=None, **kwargs):
+        timeouts = Timeouts.coerce(timeout)
+        condition = StopCondition.from_params(kwargs, stop_when)
+        async with self.client._slot(priority):
+            if session_id is not None:
+                response = await self.client._session_chat(model, messages or [], session_id, timeouts, condition,
+                                                           **kwargs)
+            else:
+                response = await self.client._complete_chat(model, messages or [], timeouts, condition, **kwargs)
         return CompletionResponse(response, model)
 
-    async def stream(self, model=DEFAULT_MODEL, messages=None, **kwargs):
-        return self.client._stream_chat(model, messages or [])
+    async def stream(self, model=DEFAULT_MODEL, messages=None, timeout=None, session_id=None, priority=None,
+                     stop_when=None, **kwargs):
+        return self.client._stream_chat(model, messages or [], Timeouts.coerce(timeout), session_id, priority,
+                                        StopCondition.from_params(kwargs, stop_when), **kwargs)
+
+    async def batch(self, requests, concurrency=BATCH_CONCURRENCY, ordered=True, retries=BATCH_RETRIES):
+        # requests — итерируемое тел запросов ({"model", "messages", ...}); читается лениво
+        return self.client._batch_chat(requests, concurrency, ordered, retries)
 
 class Chat:
     def __init__(self, client):
         self.completions = Completions(client)
 
 class CompletionResponse:
+    # Тело ответа разбирается только при первом обращении к choices
+    __slots__ = ('raw_response', 'model', 'created', '_choices')
+    object = "chat.completion"
+
     def __init__(self, response, model):
         self.raw_response = response
-        self.choices = [
-            Choice(
-                message=Message(role="assistant", content=self._extract_content()),
-                index=0,
-                finish_reason="stop"
-            )
-        ]
-        self.created = int(time.time())
-        self.id = f"chatcmpl-{self.created}"
         self.model = model
-        self.object = "chat.completion"
+        self.created = int(time.time())
+        self._choices = None
+
+    @property
+    def id(self):
+        return f"chatcmpl-{self.created}"
+
+    @property
+    def choices(self):
+        if self._choices is None:
+            content, finish_reason = self._extract_content()
+            self._choices = [Choice(Message("assistant", content), 0, finish_reason)]
+        return self._choices
 
     def _extract_content(self):
-        if self.raw_response.status != 200:
-            return self.raw_response.content.decode('utf-8')
-        content_encoding = self.raw_response.headers.get('Content-Encoding', '').lower()
+        # -> (текст ответа, finish_reason); "length" — ответ оборван по max_tokens/max_chars
+        raw = self.raw_response
+        if isinstance(raw, (str, bytes)):
+            # AuthManager.complete_chat возвращает тело ответа, а не объект ответа
+            body = raw
+        else:
+            body = raw.content
+            if raw.status != 200:
+                return body.decode('utf-8', 'replace'), "stop"
+            if raw.headers.get('Content-Encoding', '').lower() == 'br':
+                import brotli  # импорт откладывается до первого сжатого ответа
+                body = brotli.decompress(body)
         try:
-            content = self.raw_response.content.decode('utf-8')
-            if content_encoding == 'br':
-                content = brotli.decompress(self.raw_response.content).decode('utf-8')
-            return json.loads(content)["choices"][0]["message"]["content"]
-        except (json.JSONDecodeError, KeyError) as e:
-            return content
+            choice = loads(body)["choices"][0]
+            return choice["message"]["content"], choice.get("finish_reason") or "stop"
+        except (JSONDecodeError, KeyError, IndexError, TypeError, AttributeError):
+            return (body.decode('utf-8', 'replace') if isinstance(body, bytes) else body), "stop"
 
 class StreamChunk:
+    # Обёртка над словарём чанка: объекты Choice/Message создаются только по запросу
+    __slots__ = ('chunk', 'model', '_id', '_choices')
+    object = "chat.completion.chunk"
+
     def __init__(self, chunk, model):
-        delta_content = self._extract_delta_content(chunk)
-        self.choices = [
-            Choice(
-                message=Message(role="assistant", content=delta_content),
-                index=0,
-                finish_reason=chunk["choices"][0].get("finish_reason") if "choices" in chunk else None
-            )
-        ] if delta_content else []
-        self.id = chunk.get("id", f"chatcmpl-{int(time.time())}")
+        self.chunk = chunk
         self.model = model
-        self.object = "chat.completion.chunk"
+        self._id = None
+        self._choices = None
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = self.chunk.get("id") or f"chatcmpl-{int(time.time())}"
+        return self._id
 
-    def _extract_delta_content(self, chunk):
+    @property
+    def choices(self):
+        if self._choices is None:
+            delta_content = self._extract_delta_content(self.chunk)
+            if delta_content:
+                finish_reason = self.chunk["choices"][0].get("finish_reason")
+                self._choices = [Choice(Message("assistant", delta_content), 0, finish_reason)]
+            else:
+                self._choices = []
+        return self._choices
+
+    @staticmethod
+    def _extract_delta_content(chunk):
         try:
-            if "choices" in chunk and chunk["choices"]:
-                if isinstance(chunk["choices"][0]["delta"], str):
-                    return chunk["choices"][0]["delta"]
-                return chunk["choices"][0]["delta"].get("content")
-            return chunk["choices"][0]["delta"] if "choices" in chunk else None
-        except (KeyError, IndexError):
+            delta = chunk["choices"][0]["delta"]
+        except (KeyError, IndexError, TypeError):
             return None
+        if isinstance(delta, str):
+            return delta
+        return delta.get("content") if isinstance(delta, dict) else None
 
 class Choice:
+    __slots__ = ('message', 'index', 'finish_reason', '_delta')
+
     def __init__(self, message, index, finish_reason):
         self.message = message
         self.index = index
         self.finish_reason = finish_reason
-        self.delta = Delta(content=message.content)
+        self._delta = None
+
+    @property
+    def delta(self):
+        if self._delta is None:
+            self._delta = Delta(self.message.content)
+        return self._delta
 
 class Message:
+    __slots__ = ('role', 'content')
+
     def __init__(self, role, content):
         self.role = role
         self.content = content
 
 class Delta:
+    __slots__ = ('content',)
+
     def __init__(self, content):
         self.content = content
 
 class AsyncClient:
-    def __init__(self, auth_manager=None):
+    # scheduler — общий Scheduler, ограничивающий одновременные запросы к upstream;
+    # client_id — ключ честной очереди для запросов этого клиента
+    def __init__(self, auth_manager=None, cache=None, fanout=None, sessions=None, scheduler=None, client_id=None):
         self.auth_manager = auth_manager or AuthManager()
+        self.cache = cache
+        self.fanout = fanout
+        self.sessions = sessions
+        self.scheduler = scheduler
+        self.client_id = client_id
+        if fanout is not None and fanout.auth_manager is None:
+            fanout.auth_manager = self.auth_manager
+        if cache is not None:
+            register_cache_metrics(self.auth_manager.metrics.registry, cache)
+        if fanout is not None:
+            register_fanout_metrics(self.auth_manager.metrics.registry, fanout)
+        if sessions is not None:
+            register_session_metrics(self.auth_manager.metrics.registry, sessions)
+        if scheduler is not None:
+            register_scheduler_metrics(self.auth_manager.metrics.registry, scheduler)
         self.chat = Chat(self)
 
-    async def _complete_chat(self, model, messages):
-        return await self.auth_manager.complete_chat(model, messages)
+    def _slot(self, priority=None):
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(self.client_id, priority)
+
+    async def _complete_chat(self, model, messages, timeouts=None, condition=None, **params):
+        if condition is None:
+            fetch = lambda: self.auth_manager.complete_chat(model, messages, timeouts, **params)
+        else:
+            # Ответ собирается из потока, который закрывается, как только условие выполнено
+            fetch = lambda: complete_limited(self.auth_manager, model, messages, condition, timeouts, **params)
+        if self.cache is None or (condition is not None and condition.stop_when is not None):
+            return await fetch()  # stop_when не входит в ключ кэша
+        return await self.cache.get_or_fetch(make_key(model, messages, params), fetch)
+
+    def _session_store(self):
+        if self.sessions is None:
+            raise ValueError("session_id requires AsyncClient(sessions=SessionStore())")
+        return self.sessions
+
+    async def _session_chat(self, model, messages, session_id, timeouts=None, condition=None, **params):
+        sessions = self._session_store()
+        context = await sessions.run(sessions.prepare, session_id, messages)
+        response = await self._complete_chat(model, context, timeouts, condition, **params)
+        await sessions.run(sessions.commit, session_id, messages, reply_message(response))
+        return response
+
+    def _batch_chat(self, requests, concurrency, ordered, retries):
+        async def fetch(request):
+            model, messages, params, timeouts = split_request(request)
+            condition = StopCondition.from_params(params)
+            return CompletionResponse(await self._complete_chat(model, messages, timeouts, condition, **params), model)
+        return run_batch(scheduled(self.scheduler, fetch, self.client_id), requests, concurrency, ordered, retries)
+
+    async def _stream_chat(self, model, messages, timeouts=None, session_id=None, priority=None, condition=None,
+                           **params):
+        source = self.fanout if self.fanout is not None else self.auth_manager
+
+        def upstream(context):
+            if condition is None:
+                return source.stream_chat(model, context, timeouts, **params)
+            return stream_limited(source, model, context, condition, timeouts, **params)
+
+        # Слот планировщика занят до конца потока
+        async with self._slot(priority):
+            if session_id is None:
+                chunks = upstream(messages)
+            else:
+                sessions = self._session_store()
+                context = await sessions.run(sessions.prepare, session_id, messages)
+                chunks = record_stream(sessions, session_id, messages, upstream(context))
+            async with aclosing(chunks) as chunks:
+                async for chunk in chunks:
+                    yield StreamChunk(chunk, model)
+
+
+class SyncCompletions:
+    def __init__(self, client):
+        self.client = client
+        self.completions = client.async_client.chat.completions
+
+    def create(self, model=DEFAULT_MODEL, messages=None, timeout=None, session_id=None, priority=None, **kwargs):
+        return self.client._call(self.completions.create(model, messages, timeout, session_id, priority, **kwargs))
+
+    def stream(self, model=DEFAULT_MODEL, messages=None, timeout=None, session_id=None, priority=None, **kwargs):
+        # Обычный итератор StreamChunk; запрос уходит при первом next()
+        return self.client._iterate(lambda: self.completions.stream(model, messages, timeout, session_id, priority,
+                                                                    **kwargs))
+
+    def batch(self, requests, concurrency=BATCH_CONCURRENCY, ordered=True, retries=BATCH_RETRIES):
+        return self.client._iterate(lambda: self.completions.batch(requests, concurrency, ordered, retries))
+
+class SyncChat:
+    def __init__(self, client):
+        self.completions = SyncCompletions(client)
+
+_END = object()
+
+async def _pump(source, items, free):
+    # Элементы асинхронного итератора — в потокобезопасную очередь читателя;
+    # free ограничивает число непрочитанных элементов
+    try:
+        iterator = await source()
+        async with aclosing(iterator):
+            async for item in iterator:
+                await free.acquire()
+                items.put((item, None))
+    except Exception as e:
+        items.put((_END, e))
+    else:
+        items.put((_END, None))
+
+class Client:
+    # Синхронный AsyncClient: вызовы из любых потоков выполняются в одном фоновом event loop,
+    # поэтому пул соединений AuthManager общий и loop не создаётся на каждый вызов.
+    # Поток с loop стартует при первом запросе; close() закрывает пул и останавливает его.
+    def __init__(self, auth_manager=None, cache=None, fanout=None, sessions=None, scheduler=None, client_id=None,
+                 stream_buffer=SYNC_STREAM_BUFFER):
+        self.async_client = AsyncClient(auth_manager, cache, fanout, sessions, scheduler, client_id)
+        self.auth_manager = self.async_client.auth_manager
+        self.sessions = sessions
+        self.stream_buffer = stream_buffer
+        self.chat = SyncChat(self)
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="api-inceptionlabs-loop", daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+            if threading.current_thread() is self._thread:
+                # Ожидание результата заблокировало бы сам loop
+                raise RuntimeError("Client cannot be used from its own event loop, use AsyncClient there")
+            return self._loop
+
+    def _call(self, coro):
+        try:
+            loop = self._get_loop()
+        except RuntimeError:
+            coro.close()
+            raise
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()  # KeyboardInterrupt в вызывающем потоке отменяет и запрос
+            raise
+
+    def _iterate(self, source):
+        loop = self._get_loop()
+        items = queue.SimpleQueue()
+        free = asyncio.Semaphore(self.stream_buffer)
+        future = asyncio.run_coroutine_threadsafe(_pump(source, items, free), loop)
+        try:
+            while True:
+                item, error = items.get()
+                if item is _END:
+                    if error is not None:
+                        raise error
+                    return
+                loop.call_soon_threadsafe(free.release)
+                yield item
+        finally:
+            # Читатель бросил итератор (break, close, исключение): отмена закрывает ответ upstream
+            future.cancel()
 
-    async def _stream_chat(self, model, messages):
-        async for chunk in self.auth_manager.stream_chat(model, messages):
-            yield StreamChunk(chunk, model)
\ No newline at end of file
+    def close(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.auth_manager.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
@@ -0,0 +1,135 @@
+import asyncio
+from .json_backend import dumps, loads, JSONDecodeError
+from .config import SSE_COALESCE_BYTES, SSE_COALESCE_DELAY
+
+MODES = ('latency', 'throughput')
+_DELTA_KEYS = frozenset(('content', 'role'))
+_CHOICE_KEYS = frozenset(('index', 'delta', 'finish_reason', 'logprobs'))
+_CHUNK_KEYS = frozenset(('id', 'object', 'created', 'model', 'choices', 'system_fingerprint'))
+
+
+class _Merger:
+    # Склеивает чанки chat.completion.chunk в один: content дельт конкатенируется по index,
+    # id/model/created и role берутся из первого чанка, finish_reason — из последнего.
+    # Чанки с чем-то кроме content/role в delta (tool_calls, usage...) не склеиваются.
+    __slots__ = ('raw', 'base', 'parts', 'finish', 'size', 'count')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.raw = None
+        self.base = None
+        self.parts = {}
+        self.finish = {}
+        self.size = 0
+        self.count = 0
+
+    def add(self, payload, chunk):
+        # False — чанк нельзя добавить к накопленным
+        choices = chunk.get("choices") if isinstance(chunk, dict) else None
+        if not choices or not isinstance(choices, list):
+            return False
+        if any(value is not None for key, value in chunk.items() if key not in _CHUNK_KEYS):
+            return False  # usage и прочие поля верхнего уровня не теряем
+        for choice in choices:
+            delta = choice.get("delta") if isinstance(choice, dict) else None
+            if (not isinstance(delta, dict) or not _CHOICE_KEYS.issuperset(choice)
+                    or not _DELTA_KEYS.issuperset(delta) or choice.get("logprobs") is not None):
+                return False
+            index = choice.get("index", 0)
+            if index in self.finish or (self.count and "role" in delta):
+                return False
+        if self.count == 0:
+            self.raw = payload
+            self.base = chunk
+        for choice in choices:
+            index = choice.get("index", 0)
+            content = choice["delta"].get("content")
+            if content:
+                self.parts.setdefault(index, []).append(content)
+            if choice.get("finish_reason") is not None:
+                self.finish[index] = choice["finish_reason"]
+        self.size += len(payload)
+        self.count += 1
+        return True
+
+    def flush(self):
+        if self.count == 1:
+            payload = self.raw  # один чанк — отдаём байты upstream без пересериализации
+        else:
+            base = self.base
+            choices = []
+            for choice in base["choices"]:
+                index = choice.get("index", 0)
+                delta = dict(choice["delta"])
+                delta["content"] = "".join(self.parts.get(index, ()))
+                choices.append({**choice, "delta": delta, "finish_reason": self.finish.get(index)})
+            indexes = {choice.get("index", 0) for choice in base["choices"]}
+            for index in sorted(set(self.parts) - indexes):
+                choices.append({"index": index, "delta": {"content": "".join(self.parts[index])},
+                                "finish_reason": self.finish.get(index)})
+            payload = dumps({**base, "choices": choices})
+        self.reset()
+        return payload
+
+
+class StreamCoalescer:
+    # Режим throughput: мелкие дельты upstream копятся до max_bytes или max_delay секунд
+    # с первого накопленного чанка и уходят клиенту одним событием data:.
+    # Режим latency — каждое событие отдаётся сразу, без разбора (StreamCoalescer не нужен).
+    def __init__(self, max_bytes=SSE_COALESCE_BYTES, max_delay=SSE_COALESCE_DELAY):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
+    async def coalesce(self, events):
+        # events — асинхронный итератор payload событий (bytes), как stream_chat_raw
+        loop = asyncio.get_running_loop()
+        merger = _Merger()
+        pending = None
+        deadline = 0.0
+        try:
+            while True:
+                if merger.count:
+                    # Есть накопленное — ждём следующее событие не дольше окна
+                    if pending is None:
+                        pending = asyncio.ensure_future(events.__anext__())
+                    timeout = deadline - loop.time()
+                    if timeout > 0:
+                        await asyncio.wait((pending,), timeout=timeout)
+                    if not pending.done():
+                        yield merger.flush()
+                        continue
+                    next_event, pending = pending, None
+                elif pending is not None:
+                    next_event, pending = pending, None
+                else:
+                    next_event = events.__anext__()
+                try:
+                    payload = await next_event
+                except StopAsyncIteration:
+                    break
+                except Exception:
+                    if merger.count:
+                        yield merger.flush()  # полученное до ошибки доходит до клиента
+                    raise
+                try:
+                    chunk = loads(payload)
+                except JSONDecodeError:
+                    chunk = None
+                if not merger.add(payload, chunk):
+                    if merger.count:
+                        yield merger.flush()
+                    if not merger.add(payload, chunk):
+                        yield payload  # не склеиваемое событие — как есть
+                        continue
+                if merger.count == 1:
+                    deadline = loop.time() + self.max_delay
+                if merger.size >= self.max_bytes:
+                    yield merger.flush()
+            if merger.count:
+                yield merger.flush()
+        finally:
+            if pending is not None:
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
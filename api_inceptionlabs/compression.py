@@ -0,0 +1,117 @@
+import zlib
+from .errors import UpstreamStreamError
+from .config import COMPRESS_MIN_SIZE, COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY
+
+ENCODINGS = ('br', 'gzip')  # в порядке предпочтения сервера
+
+
+def negotiate(accept_encoding, encodings=ENCODINGS):
+    # Разбор Accept-Encoding с q-значениями: "gzip;q=0.5, br" -> "br"; None — без сжатия
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best = None
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, encoding)
+    return best[1] if best else None
+
+
+def compress(data, encoding):
+    # Сжатие ответа целиком
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data, encoding):
+    # Распаковка тела по Content-Encoding; ValueError — неизвестное сжатие или битые данные
+    if encoding in (None, '', 'identity'):
+        return data
+    try:
+        if encoding == 'br':
+            import brotli
+            try:
+                return brotli.decompress(data)
+            except brotli.error as e:
+                raise ValueError(str(e)) from e
+        if encoding in ('gzip', 'x-gzip'):
+            return zlib.decompress(data, 47)  # 47 — gzip или zlib заголовок
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(data)
+            except zlib.error:
+                return zlib.decompress(data, -15)  # deflate без zlib заголовка
+    except zlib.error as e:
+        raise ValueError(str(e)) from e
+    raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+
+
+def should_compress(body, content_type, encoding):
+    return (encoding is not None and len(body) >= COMPRESS_MIN_SIZE
+            and content_type.startswith(('application/json', 'text/')))
+
+
+class EncodedBody:
+    # Тело не-потокового ответа upstream в том виде, в каком оно пришло по сети:
+    # сервер пересылает его клиенту без распаковки и json.loads/json.dumps
+    __slots__ = ('body', 'encoding', 'content_type')
+
+    def __init__(self, body, encoding=None, content_type='application/json'):
+        self.body = body
+        self.encoding = None if encoding in (None, '', 'identity') else encoding.lower()
+        self.content_type = content_type
+
+    def decoded(self):
+        try:
+            return decompress(self.body, self.encoding)
+        except ValueError as e:
+            raise UpstreamStreamError(f"Undecodable response body: {e}") from e
+
+    def text(self):
+        return self.decoded().decode('utf-8')
+
+    def for_client(self, accept_encoding):
+        # (байты, Content-Encoding или None): сжатое тело уходит как есть, если клиент принимает
+        # это сжатие, иначе распаковывается
+        if self.encoding is not None and negotiate(accept_encoding, (self.encoding,)) == self.encoding:
+            return self.body, self.encoding
+        return self.decoded(), None
+
+
+class StreamEncoder:
+    # Потоковое сжатие SSE: каждый кадр выталкивается из компрессора сразу (sync flush),
+    # чтобы клиент не ждал заполнения буфера, а контекст сжатия общий на весь поток
+    __slots__ = ('encoding', '_compressor', '_brotli')
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._brotli = encoding == 'br'
+        if self._brotli:
+            import brotli
+            self._compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def frame(self, data):
+        if self._brotli:
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self._brotli:
+            return self._compressor.finish()
+        return self._compressor.flush()
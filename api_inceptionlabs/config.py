@@ -1,8 +1,90 @@
-import multiprocessing
-
 TOKEN_TTL = 6 * 60 * 60
 PRE_EXPIRY_THRESHOLD = 1 * 60 * 60
-MAX_WORKERS = max(2, multiprocessing.cpu_count() // 2)
+
+# Хранилище аккаунтов: задержка записи на диск и интервал проверки изменений от других процессов
+STORE_FLUSH_DELAY = 1.0
+STORE_REFRESH_INTERVAL = 5.0
+
+# Пул соединений к upstream
+POOL_LIMIT = 1000
+POOL_LIMIT_PER_HOST = 0  # 0 — без отдельного лимита на хост
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+WARMUP_CONNECTIONS = 2
+
+# Кэш не-потоковых ответов
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Раздача одного upstream-потока нескольким одинаковым запросам
+FANOUT_BUFFER_SIZE = 256
+FANOUT_SLOW_POLICY = "disconnect"
+
+# Сессии: история диалога на стороне сервера, клиент присылает только новые сообщения.
+# Неактивная сессия живёт SESSION_TTL секунд; сверх лимитов вытесняется самая давно
+# использованная (на диск, если задан каталог). SESSION_MAX_MESSAGES — сколько сообщений
+# истории хранить, не считая начальных system; None — без ограничения.
+SESSION_TTL = 60 * 60
+SESSION_MAX_SESSIONS = 1024
+SESSION_MAX_BYTES = 64 * 1024 * 1024
+SESSION_MAX_MESSAGES = 200
+
+# Допуск к upstream (Scheduler): запросов в полёте, мест в очереди всего и на одного клиента,
+# максимальное ожидание слота в секундах
+SCHEDULER_MAX_INFLIGHT = 256
+SCHEDULER_MAX_QUEUE = 1024
+SCHEDULER_MAX_QUEUE_PER_CLIENT = 64
+SCHEDULER_MAX_WAIT = 10.0
+
+# Синхронный Client: непрочитанных чанков потока в очереди, дальше фоновый loop ждёт читателя
+SYNC_STREAM_BUFFER = 64
+
+# Пакетная обработка
+BATCH_CONCURRENCY = 8
+BATCH_RETRIES = 2
+BATCH_RETRY_DELAY = 1.0
+BATCH_MAX_ITEMS = 1000        # предел запросов в одном вызове /api/chat/completions/batch
+BATCH_MAX_CONCURRENCY = 32    # предел параллельности, которую может запросить клиент API
+
+# Таймауты запроса к upstream по умолчанию, секунды (None — без ограничения)
+CONNECT_TIMEOUT = 10
+FIRST_BYTE_TIMEOUT = 60
+IDLE_TIMEOUT = 30
+REQUEST_TIMEOUT = None
+
+# Повторы запросов к upstream
+RETRY_ATTEMPTS = 3                          # попыток на запрос, включая первую
+RETRY_BACKOFF = 0.25                        # база экспоненциальной задержки (full jitter), секунды
+RETRY_MAX_BACKOFF = 5.0
+RETRY_STATUSES = (408, 500, 502, 503, 504)  # остальные коды, кроме 401/429, не повторяются
+ACCOUNT_RETRIES = 3                         # смен аккаунта после 401/429 на один запрос
+RETRY_BUDGET_TOKENS = 20                    # бюджет повторов: неудача -1, успех +RETRY_BUDGET_RATIO,
+RETRY_BUDGET_RATIO = 0.2                    # повторы разрешены, пока токенов больше половины
+
+# Circuit breaker: после BREAKER_FAILURES неудач подряд запросы отклоняются BREAKER_RECOVERY секунд
+BREAKER_FAILURES = 5
+BREAKER_RECOVERY = 30.0
+
+# Хеджирование не-потоковых запросов: вторая попытка, если первая дольше перцентиля задержек
+HEDGE_PERCENTILE = None  # например 0.95; None — выключено
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+# Отдача потока клиентам: latency — каждое событие сразу, throughput — мелкие дельты
+# склеиваются в одно событие до SSE_COALESCE_BYTES байт или SSE_COALESCE_DELAY секунд
+SSE_MODE = "latency"
+SSE_COALESCE_BYTES = 1024
+SSE_COALESCE_DELAY = 0.02
+
+# Сжатие ответов клиентам по Accept-Encoding (br, gzip); JSON меньше COMPRESS_MIN_SIZE не сжимается
+COMPRESSION = False
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 4
+
+UPSTREAM_HOST = "https://chat.inceptionlabs.ai"
 
 # Значения по умолчанию, которые будут переопределяться из cli.py
 API_HOST = "0.0.0.0"
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import json
+import os
+import random
+import threading
+import time
+from .config import TOKEN_TTL, STORE_FLUSH_DELAY, STORE_REFRESH_INTERVAL
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки, запись всё равно атомарная
+    fcntl = None
+
+
+def account_key(account):
+    return account.get("bearer") or json.dumps(account, sort_keys=True)
+
+
+class CredentialStore:
+    # Аккаунты в памяти с индексом по времени истечения (куча), выбор активного
+    # аккаунта и пометка rate limited — O(1)/O(log n) без обращения к диску.
+    # Файл в формате accounts.json пишется атомарно (tmp + os.replace) с задержкой,
+    # под файловой блокировкой и со слиянием изменений других процессов.
+    # Состояние защищено self._lock: отложенная запись идёт из потока threading.Timer.
+    def __init__(self, path, ttl=TOKEN_TTL, flush_delay=STORE_FLUSH_DELAY,
+                 refresh_interval=STORE_REFRESH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self.refresh_interval = refresh_interval
+        self._active = {}        # key -> account
+        self._active_keys = []   # для random.choice за O(1)
+        self._positions = {}     # key -> индекс в _active_keys
+        self._rate_limited = {}  # key -> account
+        self._expiry = []        # куча (expires_at, key), удалённые ключи пропускаются лениво
+        self._removed = set()    # ключи, убранные из active с последней записи
+        self._mtime = None
+        self._next_refresh = 0
+        self._flush_handle = None  # threading.Timer отложенной записи
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._active_keys)
+
+    @property
+    def active_accounts(self):
+        with self._lock:
+            return [self._active[key] for key in self._active_keys]
+
+    @property
+    def rate_limited_accounts(self):
+        with self._lock:
+            return list(self._rate_limited.values())
+
+    def load(self):
+        data, mtime = self._read()
+        with self._lock:
+            self._mtime = mtime
+            self._merge(data)
+            self.expire()
+        if data is None:
+            self.flush()
+
+    def add(self, account):
+        with self._lock:
+            self._add(account)
+
+    def _add(self, account):
+        key = account_key(account)
+        if key in self._active or key in self._rate_limited:
+            return
+        self._active[key] = account
+        self._positions[key] = len(self._active_keys)
+        self._active_keys.append(key)
+        self._removed.discard(key)
+        heapq.heappush(self._expiry, (account.get("created_at", 0) + self.ttl, key))
+
+    def random_active(self):
+        with self._lock:
+            self.expire()
+            if not self._active_keys:
+                return None
+            return self._active[random.choice(self._active_keys)]
+
+    def mark_rate_limited(self, account):
+        key = account_key(account)
+        with self._lock:
+            account = self._remove_active(key)
+            if account is not None:
+                self._rate_limited[key] = account
+                self._removed.add(key)
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            expiry = self._expiry
+            while expiry and expiry[0][0] <= now:
+                _, key = heapq.heappop(expiry)
+                if self._remove_active(key) is not None:
+                    self._removed.add(key)
+                self._rate_limited.pop(key, None)
+
+    def count_expiring(self, within):
+        # Обходим кучу только по вершинам раньше deadline: поддерево с более поздней вершиной пропускаем целиком.
+        # Устаревшие записи (срок не совпадает с текущим аккаунтом по ключу) не считаются, ключи — без повторов
+        deadline = time.time() + within
+        with self._lock:
+            expiry = self._expiry
+            keys = set()
+            stack = [0] if expiry else []
+            while stack:
+                index = stack.pop()
+                expires_at, key = expiry[index]
+                if expires_at >= deadline:
+                    continue
+                account = self._active.get(key)
+                if account is not None and account.get("created_at", 0) + self.ttl == expires_at:
+                    keys.add(key)
+                stack.extend(child for child in (2 * index + 1, 2 * index + 2) if child < len(expiry))
+            return len(keys)
+
+    def _remove_active(self, key):
+        account = self._active.pop(key, None)
+        if account is None:
+            return None
+        # Переносим последний ключ на место удаляемого, чтобы не сдвигать список
+        index = self._positions.pop(key)
+        last_key = self._active_keys.pop()
+        if last_key != key:
+            self._active_keys[index] = last_key
+            self._positions[last_key] = index
+        return account
+
+    def maybe_refresh(self):
+        # Подхватываем аккаунты, добавленные другими процессами; не чаще refresh_interval
+        now = time.monotonic()
+        if now < self._next_refresh:
+            return
+        self._next_refresh = now + self.refresh_interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            data, mtime = self._read()
+            with self._lock:
+                self._mtime = mtime
+                self._merge(data)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                content = f.read().strip()
+        except OSError:
+            return None, None
+        try:
+            return (json.loads(content) if content else None), mtime
+        except json.JSONDecodeError:
+            return None, mtime
+
+    def _merge(self, data):
+        if not data:
+            return
+        for account in data.get("active", []):
+            if account_key(account) not in self._removed:
+                self._add(account)
+        for account in data.get("rate_limited", []):
+            key = account_key(account)
+            if key not in self._rate_limited:
+                if self._remove_active(key) is None:
+                    heapq.heappush(self._expiry, (account.get("created_at", 0) + self.ttl, key))
+                self._rate_limited[key] = account
+
+    def schedule_flush(self):
+        # Вне event loop пишем сразу. Внутри — откладываем таймером в своём потоке, а не call_later:
+        # loop запроса Flask закрывается сразу после ответа, и таймер в нём никогда бы не сработал
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        with self._lock:
+            if self._flush_handle is None:
+                self._flush_handle = threading.Timer(self.flush_delay, self._flush_in_background)
+                self._flush_handle.daemon = True
+                self._flush_handle.start()
+
+    def _flush_in_background(self):
+        with self._lock:
+            self._flush_handle = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Failed to save accounts: {str(e)}")
+
+    def flush(self):
+        data, removed = self._snapshot()
+        self._apply(self._write(data, removed), removed)
+
+    def _snapshot(self):
+        with self._lock:
+            return ({"active": self.active_accounts, "rate_limited": self.rate_limited_accounts},
+                    set(self._removed))
+
+    def _write(self, data, removed):
+        # Может выполняться в потоке таймера: только файловые операции над снимком состояния
+        with self._write_lock:
+            lock_file = open(self.path + '.lock', 'a') if fcntl else None
+            try:
+                if lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                disk, mtime = self._read()
+                if disk and mtime != self._mtime:
+                    # Файл менял другой процесс — не затираем его аккаунты
+                    rate_limited_keys = {account_key(a) for a in data["rate_limited"]}
+                    for account in disk.get("rate_limited", []):
+                        if account_key(account) not in rate_limited_keys:
+                            rate_limited_keys.add(account_key(account))
+                            data["rate_limited"].append(account)
+                    known = {account_key(a) for a in data["active"]} | rate_limited_keys | removed
+                    data["active"] = [a for a in data["active"] if account_key(a) not in rate_limited_keys]
+                    data["active"] += [a for a in disk.get("active", []) if account_key(a) not in known]
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp_path, self.path)
+                return data, os.stat(self.path).st_mtime_ns
+            finally:
+                if lock_file:
+                    lock_file.close()
+
+    def _apply(self, result, removed):
+        data, mtime = result
+        with self._lock:
+            self._mtime = mtime
+            self._removed -= removed
+            self._merge(data)
@@ -0,0 +1,72 @@
+class UpstreamError(Exception):
+    # Базовый класс ошибок запроса к upstream.
+    # http_status — код, с которым ошибку отдают наши серверы, retryable — имеет ли смысл повтор.
+    error_type = "upstream_error"
+    http_status = 502
+    retryable = False
+
+
+class UpstreamHTTPError(UpstreamError):
+    error_type = "upstream_http_error"
+
+    def __init__(self, status, body="", retry_after=None):
+        super().__init__(f"API error: {status} - {body[:200]}")
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after  # секунды из заголовка Retry-After
+        self.retryable = status in (401, 408, 429) or status >= 500
+
+    @property
+    def http_status(self):
+        # Ошибки запроса клиента (400, 404, 422...) и 429 возвращаем как есть, проблемы upstream — как 502
+        if self.status == 429 or status_is_client_error(self.status):
+            return self.status
+        return 502
+
+
+class UpstreamConnectionError(UpstreamError):
+    error_type = "upstream_connection_error"
+    retryable = True
+
+
+class UpstreamStreamError(UpstreamError):
+    # Поток прервался событием об ошибке или неразборчивым событием
+    error_type = "upstream_stream_error"
+
+
+class CircuitOpenError(UpstreamError):
+    error_type = "circuit_open"
+    http_status = 503
+    retryable = True
+
+    def __init__(self, retry_after):
+        super().__init__(f"Upstream is unavailable, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class NoAccountsError(UpstreamError, ValueError):
+    # ValueError — для совместимости с кодом, который ловил прежнее исключение
+    error_type = "no_accounts"
+    http_status = 503
+
+
+def status_is_client_error(status):
+    return 400 <= status < 500 and status not in (401, 408, 429)
+
+
+def error_body(error):
+    # Тело ответа об ошибке для JSON и для SSE-события error
+    body = {"error": str(error), "type": getattr(error, 'error_type', 'internal_error')}
+    status = getattr(error, 'status', None)
+    if status is not None:
+        body["status"] = status
+    return body
+
+
+def error_response(error):
+    # (HTTP-код, тело, заголовки) для ответа сервера
+    headers = {}
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return getattr(error, 'http_status', 500), error_body(error), headers
@@ -0,0 +1,154 @@
+import asyncio
+import weakref
+from collections import deque
+from contextlib import aclosing
+from .cache import make_key
+from .sse import parse_event
+from .metrics import STOPPED, stopping
+from .config import FANOUT_BUFFER_SIZE, FANOUT_SLOW_POLICY
+
+SLOW_POLICIES = ('disconnect', 'history')
+
+
+class StreamLagged(Exception):
+    pass
+
+
+class _Subscriber:
+    __slots__ = ('buffer', 'cursor', 'event', 'finished', 'lagged')
+
+    def __init__(self, cursor):
+        self.buffer = deque()
+        self.cursor = cursor  # индекс в истории, пока не догнали живой хвост
+        self.event = asyncio.Event()
+        self.finished = False
+        self.lagged = False
+
+
+class _SharedStream:
+    __slots__ = ('history', 'subscribers', 'task', 'done', 'error')
+
+    def __init__(self):
+        self.history = []
+        self.subscribers = set()
+        self.task = None
+        self.done = False
+        self.error = None
+
+
+class StreamMultiplexer:
+    # Первый запрос открывает upstream-поток, одинаковые запросы подключаются к нему:
+    # получают уже отданные события из истории и дальше живой хвост.
+    # У каждого подписчика свой ограниченный буфер; при переполнении:
+    #   'disconnect' — подписчик получает StreamLagged, остальные не ждут его;
+    #   'history'    — подписчик дочитывает из общей истории потока в своём темпе.
+    def __init__(self, auth_manager=None, buffer_size=FANOUT_BUFFER_SIZE, slow_consumer=FANOUT_SLOW_POLICY):
+        if slow_consumer not in SLOW_POLICIES:
+            raise ValueError(f"slow_consumer must be one of {SLOW_POLICIES}")
+        self.auth_manager = auth_manager
+        self.buffer_size = buffer_size
+        self.slow_consumer = slow_consumer
+        self.upstream_streams = 0
+        self.attached = 0
+        self.lagged = 0
+        self._streams = weakref.WeakKeyDictionary()  # loop -> {key: _SharedStream}
+
+    async def stream_chat_raw(self, model, messages, timeouts=None, **params):
+        # Таймауты берутся у подписчика, открывшего upstream-поток
+        key = make_key(model, messages, params)
+        source = lambda: self.auth_manager.stream_chat_raw(model, messages, timeouts, **params)
+        async with aclosing(self.subscribe(key, source)) as events:
+            async for event in events:
+                yield event
+
+    async def stream_chat(self, model, messages, timeouts=None, **params):
+        async with aclosing(self.stream_chat_raw(model, messages, timeouts, **params)) as events:
+            async for event in events:
+                yield parse_event(event)
+
+    async def subscribe(self, key, source):
+        loop = asyncio.get_running_loop()
+        streams = self._streams.setdefault(loop, {})
+        shared = streams.get(key)
+        if shared is None:
+            shared = _SharedStream()
+            streams[key] = shared
+            shared.task = loop.create_task(self._pump(streams, key, shared, source()))
+            self.upstream_streams += 1
+        else:
+            self.attached += 1
+
+        subscriber = _Subscriber(0 if shared.history else None)
+        shared.subscribers.add(subscriber)
+        try:
+            history = shared.history
+            while True:
+                if subscriber.cursor is not None:
+                    if subscriber.cursor < len(history):
+                        yield history[subscriber.cursor]
+                        subscriber.cursor += 1
+                        continue
+                    if not shared.done:
+                        # Догнали живой хвост — дальше читаем из собственного буфера
+                        subscriber.cursor = None
+                        continue
+                elif subscriber.buffer:
+                    yield subscriber.buffer.popleft()
+                    continue
+                if subscriber.finished:
+                    break
+                subscriber.event.clear()
+                await subscriber.event.wait()
+            if subscriber.lagged:
+                raise StreamLagged("Subscriber fell behind the shared stream")
+            if shared.error is not None:
+                raise shared.error
+        finally:
+            shared.subscribers.discard(subscriber)
+            if not shared.subscribers and not shared.done:
+                # Последний подписчик ушёл — upstream больше никому не нужен
+                shared.task.cancel(STOPPED if stopping() else None)
+                if streams.get(key) is shared:
+                    del streams[key]
+
+    async def _pump(self, streams, key, shared, iterator):
+        try:
+            async for item in iterator:
+                shared.history.append(item)
+                for subscriber in list(shared.subscribers):
+                    if subscriber.cursor is not None:
+                        subscriber.event.set()
+                    elif len(subscriber.buffer) < self.buffer_size:
+                        subscriber.buffer.append(item)
+                        subscriber.event.set()
+                    else:
+                        self._on_slow(shared, subscriber)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            shared.error = e
+        finally:
+            shared.done = True
+            if streams.get(key) is shared:
+                del streams[key]
+            for subscriber in shared.subscribers:
+                subscriber.finished = True
+                subscriber.event.set()
+            await iterator.aclose()
+
+    def _on_slow(self, shared, subscriber):
+        self.lagged += 1
+        if self.slow_consumer == 'history':
+            # Текущее событие уже в истории, буфер подписчика — предшествующие ему события
+            subscriber.cursor = len(shared.history) - 1 - len(subscriber.buffer)
+            subscriber.buffer.clear()
+        else:
+            shared.subscribers.discard(subscriber)
+            subscriber.lagged = True
+            subscriber.finished = True
+        subscriber.event.set()
+
+    def stats(self):
+        active = sum(len(streams) for streams in list(self._streams.values()))
+        return {"active_streams": active, "upstream_streams": self.upstream_streams,
+                "attached": self.attached, "lagged": self.lagged}
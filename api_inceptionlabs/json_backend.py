@@ -0,0 +1,22 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: pip install api_inceptionlabs[fast]
+    orjson = None
+
+# orjson.JSONDecodeError наследует json.JSONDecodeError, поэтому ловить можно одно и то же
+JSONDecodeError = json.JSONDecodeError
+
+if orjson is not None:
+    BACKEND = "orjson"
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    BACKEND = "json"
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
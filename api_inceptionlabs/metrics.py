@@ -0,0 +1,357 @@
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+import weakref
+from .timeouts import UpstreamTimeout
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Поток закрыт намеренно (выполнено условие остановки), а не брошен вызывающим.
+# Прямое закрытие помечается контекстной переменной, отмена задачи (раздача потока) — сообщением отмены
+STOPPED = "stopped"
+_stopping = contextvars.ContextVar("inceptionlabs_stopping", default=False)
+
+
+def stopping():
+    return _stopping.get()
+
+
+async def stop_stream(stream):
+    token = _stopping.set(True)
+    try:
+        await stream.aclose()
+    finally:
+        _stopping.reset(token)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function  # значение считается при выгрузке
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames) if self.labelnames else ()
+
+    def samples(self):
+        if self.function is not None:
+            return [("", (), self.function())]
+        with self._lock:
+            return [("", key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, value in self.samples():
+            labels = key if isinstance(key, str) else _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}{suffix}{labels} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        if self.function is not None:
+            return self.function()
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket", _format_labels(self.labelnames, key, ("le", le)), cumulative))
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif kwargs.get("function") is not None:
+                metric.function = kwargs["function"]
+            return metric
+
+    def counter(self, name, help, labelnames=(), function=None):
+        return self._register(Counter, name, help, labelnames, function=function)
+
+    def gauge(self, name, help, labelnames=(), function=None):
+        return self._register(Gauge, name, help, labelnames, function=function)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Hooks:
+    # Списки колбэков; пустой список — почти бесплатная проверка на горячем пути
+    def __init__(self):
+        self.on_request_start = []  # hook(ctx)
+        self.on_first_chunk = []    # hook(ctx)
+        self.on_chunk = []          # hook(ctx, chunk)
+        self.on_complete = []       # hook(ctx, error)
+
+    def add(self, name, callback):
+        getattr(self, name).append(callback)
+        return callback
+
+    def remove(self, name, callback):
+        getattr(self, name).remove(callback)
+
+
+class RequestContext:
+    __slots__ = ('model', 'stream', 'start', 'first_chunk_at', 'chunks', 'bytes_in', 'bytes_out', 'status',
+                 'state')
+
+    def __init__(self, model, stream, bytes_out):
+        self.model = model
+        self.stream = stream
+        self.start = time.perf_counter()
+        self.first_chunk_at = None
+        self.chunks = 0
+        self.bytes_in = 0
+        self.bytes_out = bytes_out
+        self.status = None
+        self.state = {}  # для пользовательских хуков
+
+
+class Metrics:
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else Registry()
+        self.hooks = Hooks()
+        self._auth_managers = weakref.WeakSet()
+        r = self.registry
+        self.connect_seconds = r.histogram(
+            "inceptionlabs_upstream_connect_seconds", "Time to open a new upstream connection")
+        self.first_chunk_seconds = r.histogram(
+            "inceptionlabs_first_chunk_seconds", "Time from request start to the first streamed chunk")
+        self.request_seconds = r.histogram(
+            "inceptionlabs_request_seconds", "Total upstream request latency", ("mode",))
+        self.stream_chunks = r.histogram(
+            "inceptionlabs_stream_chunks", "Chunks per streamed response", buckets=COUNT_BUCKETS)
+        self.bytes_in = r.histogram(
+            "inceptionlabs_upstream_received_bytes", "Response bytes received from upstream per request",
+            ("mode",), buckets=BYTES_BUCKETS)
+        self.bytes_out = r.histogram(
+            "inceptionlabs_upstream_sent_bytes", "Request body bytes sent upstream per request",
+            ("mode",), buckets=BYTES_BUCKETS)
+        self.upstream_responses = r.counter(
+            "inceptionlabs_upstream_responses_total", "Upstream responses by HTTP status", ("status",))
+        self.auth_retries = r.counter(
+            "inceptionlabs_auth_retries_total", "Requests retried with another account after a 401")
+        self.errors = r.counter(
+            "inceptionlabs_request_errors_total", "Upstream requests that failed", ("mode",))
+        self.cancelled = r.counter(
+            "inceptionlabs_requests_cancelled_total", "Upstream requests abandoned by the caller", ("mode",))
+        self.stopped = r.counter(
+            "inceptionlabs_streams_stopped_total", "Upstream streams closed early because a stop condition was met")
+        self.timeouts = r.counter(
+            "inceptionlabs_request_timeouts_total", "Upstream requests that timed out", ("mode", "phase"))
+        self.retries = r.counter(
+            "inceptionlabs_upstream_retries_total", "Upstream attempts retried, by reason", ("reason",))
+        self.hedges = r.counter(
+            "inceptionlabs_hedged_requests_total", "Second attempts started for slow non-streaming requests")
+        self.hedge_wins = r.counter(
+            "inceptionlabs_hedge_wins_total", "Hedged attempts that finished before the original")
+        self.circuit_rejected = r.counter(
+            "inceptionlabs_circuit_rejected_total", "Requests rejected while the circuit breaker was open")
+        self.in_flight = r.gauge(
+            "inceptionlabs_in_flight_requests", "Upstream requests in progress")
+        r.gauge("inceptionlabs_accounts_active", "Active accounts",
+                function=lambda: self._sum_managers(lambda m: len(m.store)))
+        r.gauge("inceptionlabs_accounts_rate_limited", "Accounts marked rate limited",
+                function=lambda: self._sum_managers(lambda m: len(m.store.rate_limited_accounts)))
+        r.gauge("inceptionlabs_connections_idle", "Idle pooled upstream connections",
+                function=lambda: self._sum_managers(lambda m: m.pool_stats()["idle"]))
+        r.gauge("inceptionlabs_connections_in_use", "Upstream connections in use",
+                function=lambda: self._sum_managers(lambda m: m.pool_stats()["in_use"]))
+        r.gauge("inceptionlabs_circuit_open", "Circuit breakers currently open or half-open",
+                function=lambda: self._sum_managers(lambda m: int(m.resilience.breaker.is_open)))
+
+    def track(self, auth_manager):
+        self._auth_managers.add(auth_manager)
+
+    def _sum_managers(self, value):
+        return sum(value(manager) for manager in list(self._auth_managers))
+
+    def request_started(self, model, stream, bytes_out):
+        ctx = RequestContext(model, stream, bytes_out)
+        self.in_flight.inc()
+        for hook in self.hooks.on_request_start:
+            hook(ctx)
+        return ctx
+
+    def upstream_response(self, ctx, status):
+        ctx.status = status
+        self.upstream_responses.inc(status=status)
+
+    def chunk(self, ctx, chunk):
+        ctx.chunks += 1
+        if ctx.chunks == 1:
+            ctx.first_chunk_at = time.perf_counter()
+            self.first_chunk_seconds.observe(ctx.first_chunk_at - ctx.start)
+            for hook in self.hooks.on_first_chunk:
+                hook(ctx)
+        for hook in self.hooks.on_chunk:
+            hook(ctx, chunk)
+
+    def request_finished(self, ctx, error=None):
+        mode = "stream" if ctx.stream else "complete"
+        self.in_flight.dec()
+        self.request_seconds.observe(time.perf_counter() - ctx.start, mode=mode)
+        self.bytes_in.observe(ctx.bytes_in, mode=mode)
+        self.bytes_out.observe(ctx.bytes_out, mode=mode)
+        if ctx.stream:
+            self.stream_chunks.observe(ctx.chunks)
+        if isinstance(error, UpstreamTimeout):
+            self.timeouts.inc(mode=mode, phase=error.phase)
+        elif isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+            if _stopping.get() or error.args == (STOPPED,):
+                self.stopped.inc()
+            else:
+                self.cancelled.inc(mode=mode)
+        elif error is not None:
+            self.errors.inc(mode=mode)
+        for hook in self.hooks.on_complete:
+            hook(ctx, error)
+
+
+REGISTRY = Registry()
+_default_metrics = None
+
+
+def default_metrics():
+    global _default_metrics
+    if _default_metrics is None:
+        _default_metrics = Metrics(REGISTRY)
+    return _default_metrics
+
+
+def register_cache_metrics(registry, cache):
+    registry.counter("inceptionlabs_cache_hits_total", "Response cache hits", function=lambda: cache.hits)
+    registry.counter("inceptionlabs_cache_misses_total", "Response cache misses", function=lambda: cache.misses)
+    registry.counter("inceptionlabs_cache_coalesced_total", "Requests that waited for an identical in-flight call",
+                     function=lambda: cache.coalesced)
+    registry.counter("inceptionlabs_cache_evictions_total", "Response cache evictions",
+                     function=lambda: cache.backend.evictions)
+    registry.gauge("inceptionlabs_cache_entries", "Cached responses", function=lambda: len(cache.backend))
+    registry.gauge("inceptionlabs_cache_bytes", "Cached response bytes", function=lambda: cache.backend.size_bytes)
+
+
+def register_fanout_metrics(registry, fanout):
+    registry.counter("inceptionlabs_fanout_upstream_streams_total", "Upstream streams opened by the multiplexer",
+                     function=lambda: fanout.upstream_streams)
+    registry.counter("inceptionlabs_fanout_attached_total", "Subscribers attached to an existing stream",
+                     function=lambda: fanout.attached)
+    registry.counter("inceptionlabs_fanout_lagged_total", "Subscribers that overflowed their buffer",
+                     function=lambda: fanout.lagged)
+
+
+def register_session_metrics(registry, sessions):
+    registry.gauge("inceptionlabs_sessions", "Conversation sessions held in memory", function=lambda: len(sessions))
+    registry.gauge("inceptionlabs_session_bytes", "Bytes of session history held in memory",
+                   function=lambda: sessions.size_bytes)
+    registry.counter("inceptionlabs_session_evictions_total", "Sessions evicted from memory",
+                     function=lambda: sessions.evictions)
+    registry.counter("inceptionlabs_session_spilled_total", "Evicted sessions written to disk",
+                     function=lambda: sessions.spilled)
+    registry.counter("inceptionlabs_session_truncated_messages_total", "Old messages dropped from session history",
+                     function=lambda: sessions.truncated)
+
+
+def register_scheduler_metrics(registry, scheduler):
+    registry.gauge("inceptionlabs_scheduler_inflight", "Requests holding an upstream slot",
+                   function=lambda: scheduler.inflight)
+    registry.gauge("inceptionlabs_scheduler_queue_depth", "Requests waiting for an upstream slot",
+                   function=lambda: scheduler.queued)
+    registry.counter("inceptionlabs_scheduler_admitted_total", "Requests admitted to upstream",
+                     function=lambda: scheduler.admitted)
+    scheduler.wait_seconds = registry.histogram("inceptionlabs_scheduler_wait_seconds",
+                                                "Time spent waiting for an upstream slot", ("priority",))
+    scheduler.shed_total = registry.counter("inceptionlabs_scheduler_shed_total",
+                                            "Requests rejected by admission control", ("reason",))
@@ -0,0 +1,278 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from .errors import UpstreamError, UpstreamHTTPError, UpstreamConnectionError, CircuitOpenError
+from .timeouts import UpstreamTimeout
+from .config import (RETRY_ATTEMPTS, RETRY_BACKOFF, RETRY_MAX_BACKOFF, RETRY_STATUSES, ACCOUNT_RETRIES,
+                     RETRY_BUDGET_TOKENS, RETRY_BUDGET_RATIO, BREAKER_FAILURES, BREAKER_RECOVERY,
+                     HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, HEDGE_WINDOW)
+
+ACCOUNT_STATUSES = (401, 429)  # ошибка аккаунта: повторяем сразу с другим аккаунтом
+
+
+def is_account_error(error):
+    return isinstance(error, UpstreamHTTPError) and error.status in ACCOUNT_STATUSES
+
+
+def is_upstream_failure(error):
+    # Признак нездоровья upstream для circuit breaker и бюджета повторов
+    if isinstance(error, UpstreamHTTPError):
+        return error.status >= 500
+    return isinstance(error, (UpstreamConnectionError, UpstreamTimeout))
+
+
+class RetryPolicy:
+    # Какие ошибки повторять и с какой задержкой: экспоненциальная задержка с full jitter,
+    # Retry-After upstream учитывается, если он не длиннее max_backoff
+    __slots__ = ('attempts', 'backoff', 'max_backoff', 'statuses', 'account_retries')
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF, max_backoff=RETRY_MAX_BACKOFF,
+                 statuses=RETRY_STATUSES, account_retries=ACCOUNT_RETRIES):
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.account_retries = account_retries
+
+    def is_retryable(self, error):
+        if isinstance(error, UpstreamHTTPError):
+            return error.status in ACCOUNT_STATUSES or error.status in self.statuses
+        if isinstance(error, CircuitOpenError):
+            return False  # внутри запроса не ждём восстановления upstream
+        return getattr(error, 'retryable', False)
+
+    def delay(self, retry, retry_after=None):
+        # retry — номер повтора с нуля; None — ждать дольше max_backoff не будем
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+        if retry_after is not None:
+            if retry_after > self.max_backoff:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryBudget:
+    # Бюджет повторов в духе gRPC retry throttling: каждая неудача upstream снимает токен,
+    # каждый успех возвращает ratio токена; повторы и хеджирование разрешены, пока токенов
+    # больше половины. При массовых сбоях повторы прекращаются и не умножают нагрузку.
+    def __init__(self, tokens=RETRY_BUDGET_TOKENS, ratio=RETRY_BUDGET_RATIO):
+        self.max_tokens = tokens
+        self.ratio = ratio
+        self.tokens = float(tokens)
+        self._lock = threading.Lock()  # общий для потоков запросов Flask
+
+    def allow(self):
+        return self.tokens > self.max_tokens / 2
+
+    def success(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def failure(self):
+        with self._lock:
+            self.tokens = max(0.0, self.tokens - 1)
+
+
+class CircuitBreaker:
+    # closed -> open после failures неудач подряд; через recovery секунд один пробный запрос
+    # (half_open): успех закрывает цепь, неудача снова открывает её. failures=0 — выключен.
+    def __init__(self, failures=BREAKER_FAILURES, recovery=BREAKER_RECOVERY):
+        self.failures = failures
+        self.recovery = recovery
+        self.state = 'closed'
+        self.opened = 0  # сколько раз цепь открывалась
+        self._count = 0
+        self._opened_at = 0.0
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.state != 'closed'
+
+    def check(self):
+        if self.state == 'closed':
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                wait = self._opened_at + self.recovery - now
+                if wait > 0:
+                    raise CircuitOpenError(wait)
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                # Пробный запрос мог быть отменён, не сообщив результат, — тогда разрешаем новый
+                if self._probe_at is not None and now - self._probe_at < self.recovery:
+                    raise CircuitOpenError(self._probe_at + self.recovery - now)
+                self._probe_at = now
+
+    def success(self):
+        if self._count or self.state != 'closed':
+            with self._lock:
+                self._count = 0
+                self.state = 'closed'
+                self._probe_at = None
+
+    def failure(self):
+        if not self.failures:
+            return
+        with self._lock:
+            self._count += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self._count >= self.failures):
+                self.state = 'open'
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                self._probe_at = None
+
+
+class HedgePolicy:
+    # Задержка хеджирования — перцентиль задержек последних успешных запросов,
+    # пересчитывается раз в 16 наблюдений
+    def __init__(self, percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY, min_samples=HEDGE_MIN_SAMPLES,
+                 window=HEDGE_WINDOW):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._observed = 0
+        self._delay = None
+        self._lock = threading.Lock()
+
+    def observe(self, latency):
+        if self.percentile is None:
+            return
+        with self._lock:
+            self._latencies.append(latency)
+            self._observed += 1
+            if self._observed % 16 == 0 and len(self._latencies) >= self.min_samples:
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+                self._delay = max(self.min_delay, ordered[index])
+
+    def delay(self):
+        return self._delay
+
+
+class RetryState:
+    # Счётчики повторов одного логического запроса; deadline — время loop, после которого
+    # повтор уже не уложится в total-таймаут
+    __slots__ = ('resilience', 'retries', 'account_retries', 'deadline')
+
+    def __init__(self, resilience, deadline=None):
+        self.resilience = resilience
+        self.retries = 0
+        self.account_retries = 0
+        self.deadline = deadline
+
+    def delay(self, error):
+        # Секунды до следующей попытки или None, если повторять не нужно
+        resilience = self.resilience
+        policy = resilience.policy
+        if not policy.is_retryable(error):
+            return None
+        if is_account_error(error):
+            if self.account_retries >= policy.account_retries:
+                return None
+            self.account_retries += 1
+            delay, reason = 0.0, 'account'
+        else:
+            if self.retries + 1 >= policy.attempts or not resilience.budget.allow():
+                return None
+            delay = policy.delay(self.retries, getattr(error, 'retry_after', None))
+            if delay is None:
+                return None
+            self.retries += 1
+            reason = error.error_type
+        if self.deadline is not None and asyncio.get_running_loop().time() + delay >= self.deadline:
+            return None
+        if resilience.metrics is not None:
+            resilience.metrics.retries.inc(reason=reason)
+        return delay
+
+
+class Resilience:
+    # Политика повторов, бюджет, circuit breaker и хеджирование для запросов AuthManager
+    def __init__(self, policy=None, budget=None, breaker=None, hedge=None, metrics=None):
+        self.policy = policy or RetryPolicy()
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge or HedgePolicy()
+        self.metrics = metrics
+
+    def retry_state(self, deadline=None):
+        return RetryState(self, deadline)
+
+    def check(self):
+        try:
+            self.breaker.check()
+        except CircuitOpenError:
+            if self.metrics is not None:
+                self.metrics.circuit_rejected.inc()
+            raise
+
+    def succeeded(self, latency=None):
+        self.breaker.success()
+        self.budget.success()
+        if latency is not None:
+            self.hedge.observe(latency)
+
+    def failed(self, error):
+        if is_upstream_failure(error):
+            self.breaker.failure()
+            self.budget.failure()
+        elif isinstance(error, UpstreamHTTPError):
+            self.breaker.success()  # upstream ответил, просто не 200
+
+    async def call(self, attempt, hedge_attempt=None, deadline=None):
+        # attempt() — одна попытка запроса, бросает UpstreamError; hedge_attempt — попытка-дублёр
+        state = self.retry_state(deadline)
+        while True:
+            self.check()
+            start = time.perf_counter()
+            try:
+                result = await self._hedged(attempt, hedge_attempt or attempt)
+            except UpstreamError as e:
+                self.failed(e)
+                delay = state.delay(e)
+                if delay is None:
+                    raise
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+            self.succeeded(time.perf_counter() - start)
+            return result
+
+    async def _hedged(self, attempt, hedge_attempt):
+        delay = self.hedge.delay()
+        if delay is None:
+            return await attempt()
+        primary = asyncio.ensure_future(attempt())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.budget.allow():
+                if self.metrics is not None:
+                    self.metrics.hedges.inc()
+                tasks.add(asyncio.ensure_future(hedge_attempt()))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary and self.metrics is not None:
+                            self.metrics.hedge_wins.inc()
+                        return task.result()
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {"circuit": self.breaker.state, "circuit_opened": self.breaker.opened,
+                "retry_tokens": round(self.budget.tokens, 2), "hedge_delay": self.hedge.delay()}
@@ -0,0 +1,210 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from .config import (SCHEDULER_MAX_INFLIGHT, SCHEDULER_MAX_QUEUE, SCHEDULER_MAX_QUEUE_PER_CLIENT,
+                     SCHEDULER_MAX_WAIT)
+
+PRIORITIES = ('high', 'normal', 'low')  # от старшего класса к младшему
+DEFAULT_PRIORITY = 'normal'
+
+
+class OverloadedError(Exception):
+    # Запрос не допущен к upstream: очередь переполнена или ожидание слота слишком долгое.
+    # reason — queue_full, client_queue_full или timeout; retry_after — оценка в секундах.
+    error_type = "overloaded"
+    http_status = 503
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server is overloaded ({reason}), retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClientOverloadedError(OverloadedError):
+    # Этот клиент уже занял свою долю очереди — остальные клиенты не страдают
+    error_type = "too_many_requests"
+    http_status = 429
+
+
+def parse_priority(value):
+    priority = value or DEFAULT_PRIORITY
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    return priority
+
+
+def client_key(headers, remote=None):
+    # Ключ честной очереди: X-Client-Id, API-ключ клиента или адрес соединения
+    for name in ('X-Client-Id', 'Authorization', 'X-API-Key'):
+        value = headers.get(name)
+        if value:
+            return value
+    return remote
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    __slots__ = ('loop', 'future', 'granted')
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+class Ticket:
+    # Занятый слот; передаётся в Scheduler.release
+    __slots__ = ('priority', 'admitted_at', 'released')
+
+    def __init__(self, priority, admitted_at):
+        self.priority = priority
+        self.admitted_at = admitted_at
+        self.released = False
+
+
+class Scheduler:
+    # Допуск запросов к upstream: не больше max_inflight одновременно, остальные ждут
+    # в ограниченной очереди. Классы приоритета обслуживаются строго по старшинству,
+    # внутри класса клиенты — по кругу (по одному запросу от каждого), поэтому один
+    # клиент с пачкой запросов не задерживает остальных.
+    # Потокобезопасен: ожидающие могут жить в разных event loop (потоки Flask).
+    def __init__(self, max_inflight=SCHEDULER_MAX_INFLIGHT, max_queue=SCHEDULER_MAX_QUEUE,
+                 max_queue_per_client=SCHEDULER_MAX_QUEUE_PER_CLIENT, max_wait=SCHEDULER_MAX_WAIT):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+        self.inflight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "client_queue_full": 0, "timeout": 0}
+        self.service_time = 1.0  # EWMA времени занятия слота, секунды
+        self.wait_seconds = None  # Histogram{priority} и Counter{reason}, см. register_scheduler_metrics
+        self.shed_total = None
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}  # клиент -> deque ожидающих
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def slot(self, client=None, priority=None):
+        ticket = await self.acquire(client, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, client=None, priority=None):
+        priority = parse_priority(priority)
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.inflight < self.max_inflight and not self.queued:
+                self.inflight += 1
+                self.admitted += 1
+                return self._admit(priority, start)
+            if self.queued >= self.max_queue:
+                raise self._reject(OverloadedError, "queue_full")
+            clients = self._queues[priority]
+            queue = clients.get(client)
+            if queue is not None and len(queue) >= self.max_queue_per_client:
+                raise self._reject(ClientOverloadedError, "client_queue_full")
+            if queue is None:
+                queue = clients[client] = deque()
+            waiter = _Waiter(loop)
+            queue.append(waiter)
+            self.queued += 1
+        try:
+            await asyncio.wait_for(waiter.future, self.max_wait)
+        except BaseException as e:
+            with self._lock:
+                if waiter.granted:
+                    # Слот выдан одновременно с таймаутом или отменой — возвращаем его
+                    self.inflight -= 1
+                    self._dispatch()
+                else:
+                    self._unqueue(priority, client, waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._reject(OverloadedError, "timeout") from None
+            raise
+        return self._admit(priority, start)
+
+    def release(self, ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        held = time.monotonic() - ticket.admitted_at
+        with self._lock:
+            self.service_time += (held - self.service_time) * 0.1
+            self.inflight -= 1
+            self._dispatch()
+
+    def _admit(self, priority, start):
+        now = time.monotonic()
+        if self.wait_seconds is not None:
+            self.wait_seconds.observe(now - start, priority=priority)
+        return Ticket(priority, now)
+
+    def _reject(self, cls, reason):
+        # Под self._lock: оценка Retry-After — сколько займёт разбор очереди перед нами
+        self.shed[reason] += 1
+        if self.shed_total is not None:
+            self.shed_total.inc(reason=reason)
+        waves = self.queued / max(1, self.max_inflight) + 1
+        return cls(reason, min(60, max(1, math.ceil(self.service_time * waves))))
+
+    def _dispatch(self):
+        # Под self._lock: свободные слоты — следующим ожидающим
+        while self.inflight < self.max_inflight and self.queued:
+            waiter = self._next()
+            waiter.granted = True
+            self.inflight += 1
+            self.queued -= 1
+            self.admitted += 1
+            waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+
+    def _next(self):
+        for priority in PRIORITIES:
+            clients = self._queues[priority]
+            if not clients:
+                continue
+            client, queue = next(iter(clients.items()))
+            waiter = queue.popleft()
+            if queue:
+                clients.move_to_end(client)  # следующий запрос этого клиента — после остальных клиентов
+            else:
+                del clients[client]
+            return waiter
+
+    def _unqueue(self, priority, client, waiter):
+        queue = self._queues[priority].get(client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self._queues[priority][client]
+
+    def depth(self, priority):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues[priority].values())
+
+    def stats(self):
+        return {"inflight": self.inflight, "queued": self.queued, "admitted": self.admitted,
+                "shed": dict(self.shed), "service_time": round(self.service_time, 3),
+                "queue_depth": {priority: self.depth(priority) for priority in PRIORITIES}}
+
+
+def scheduled(scheduler, fetch, client=None, priority=None):
+    # Корутинная функция, каждый вызов которой занимает слот планировщика (для пакетов)
+    if scheduler is None:
+        return fetch
+
+    async def call(*args, **kwargs):
+        async with scheduler.slot(client, priority):
+            return await fetch(*args, **kwargs)
+    return call
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from .json_backend import dumps, loads, JSONDecodeError
+from .config import SESSION_TTL, SESSION_MAX_SESSIONS, SESSION_MAX_BYTES, SESSION_MAX_MESSAGES
+
+
+class SessionNotFoundError(LookupError):
+    # Сессии нет или она истекла: клиент создаёт новую и присылает историю целиком
+    error_type = "session_not_found"
+    http_status = 404
+
+    def __init__(self, session_id):
+        super().__init__(f"Session not found: {session_id}")
+        self.session_id = session_id
+
+
+def check_messages(messages):
+    if not isinstance(messages, (list, tuple)) or not all(isinstance(m, dict) for m in messages):
+        raise ValueError("messages must be a list of objects")
+
+
+class _Session:
+    # История одной сессии; размеры сообщений (байты JSON) хранятся, чтобы не сериализовать историю заново
+    __slots__ = ('messages', 'sizes', 'size', 'expires_at')
+
+    def __init__(self, messages, expires_at):
+        self.messages = []
+        self.sizes = []
+        self.size = 0
+        self.expires_at = expires_at
+        self.extend(messages)
+
+    def extend(self, messages):
+        for message in messages:
+            size = len(dumps(message))
+            self.messages.append(message)
+            self.sizes.append(size)
+            self.size += size
+
+    def truncate(self, max_messages):
+        # Начальные system-сообщения остаются; старые реплики отбрасываются так,
+        # чтобы история после них снова начиналась с сообщения пользователя
+        if max_messages is None:
+            return 0
+        messages = self.messages
+        pinned = 0
+        while pinned < len(messages) and messages[pinned].get("role") == "system":
+            pinned += 1
+        drop = len(messages) - pinned - max_messages
+        if drop <= 0:
+            return 0
+        while pinned + drop < len(messages) and messages[pinned + drop].get("role") != "user":
+            drop += 1
+        self.size -= sum(self.sizes[pinned:pinned + drop])
+        del messages[pinned:pinned + drop]
+        del self.sizes[pinned:pinned + drop]
+        return drop
+
+
+class SessionStore:
+    # Истории диалогов по id сессии. В памяти — LRU с лимитами по числу сессий и байтам;
+    # неактивная сессия истекает через ttl секунд. С directory вытесненные сессии
+    # сохраняются на диск (файл на сессию) и поднимаются обратно при следующем обращении.
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX_SESSIONS, max_bytes=SESSION_MAX_BYTES,
+                 max_messages=SESSION_MAX_MESSAGES, directory=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.directory = directory
+        self.evictions = 0  # вытеснено из памяти
+        self.spilled = 0    # из них сохранено на диск
+        self.truncated = 0  # старых сообщений отброшено
+        self._sessions = OrderedDict()  # id -> _Session, порядок LRU
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._purge_files()
+
+    async def run(self, method, *args):
+        # Вызов метода из event loop: с каталогом на диске — в пуле потоков
+        if self.directory is None:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    def create(self, messages=()):
+        check_messages(messages)
+        session_id = secrets.token_urlsafe(16)
+        session = _Session(messages, time.time() + self.ttl)
+        self.truncated += session.truncate(self.max_messages)
+        with self._lock:
+            self._insert(session_id, session)
+            evicted = self._evict()
+        self._spill(evicted)
+        return session_id
+
+    def history(self, session_id):
+        return list(self._get(session_id).messages)
+
+    def prepare(self, session_id, messages):
+        # Полный контекст для upstream: история сессии и новые сообщения клиента
+        check_messages(messages)
+        return self._get(session_id).messages + list(messages)
+
+    def commit(self, session_id, messages, reply=None):
+        # После успешного ответа в историю дописываются новые сообщения клиента и ответ ассистента
+        session = self._get(session_id)
+        with self._lock:
+            before = session.size
+            session.extend(messages)
+            if reply is not None:
+                session.extend((reply,))
+            self.truncated += session.truncate(self.max_messages)
+            if self._sessions.get(session_id) is session:
+                self._bytes += session.size - before
+            else:
+                self._insert(session_id, session)  # сессию успели вытеснить, пока шёл запрос
+            evicted = self._evict()
+        self._spill(evicted)
+
+    def delete(self, session_id):
+        with self._lock:
+            found = self._remove(session_id)
+        if self.directory is not None:
+            try:
+                os.remove(self._path(session_id))
+                found = True
+            except OSError:
+                pass
+        return found
+
+    def _get(self, session_id):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.expires_at >= now:
+                self._sessions.move_to_end(session_id)
+                session.expires_at = now + self.ttl
+                return session
+            if session is not None:
+                self._remove(session_id)
+        session = self._load(session_id, now) if self.directory is not None else None
+        if session is None:
+            raise SessionNotFoundError(session_id)
+        session.expires_at = now + self.ttl
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is not None:
+                return current  # другой поток поднял её с диска раньше
+            self._insert(session_id, session)
+            evicted = self._evict()
+        self._spill(evicted)
+        return session
+
+    def _insert(self, session_id, session):
+        self._remove(session_id)
+        self._sessions[session_id] = session
+        self._bytes += session.size
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._bytes -= session.size
+        return True
+
+    def _evict(self):
+        # Под self._lock: истёкшие сессии в голове LRU удаляются, сверх лимитов — вытесняются
+        now = time.time()
+        evicted = []
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            expired = session.expires_at < now
+            if not expired and len(self._sessions) <= self.max_sessions and self._bytes <= self.max_bytes:
+                break
+            self._remove(session_id)
+            if not expired:
+                self.evictions += 1
+                evicted.append((session_id, session))
+        return evicted
+
+    def _path(self, session_id):
+        # Имя файла — хеш id, чтобы id из запроса не мог указать путь
+        return os.path.join(self.directory, hashlib.sha256(session_id.encode('utf-8')).hexdigest())
+
+    def _spill(self, evicted):
+        if self.directory is None:
+            return
+        for session_id, session in evicted:
+            path = self._path(session_id)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(dumps({"expires_at": session.expires_at, "messages": session.messages}))
+            os.replace(tmp_path, path)
+            self.spilled += 1
+            if self.spilled % 256 == 0:
+                self._purge_files()
+
+    def _load(self, session_id, now):
+        # Сессия с диска переезжает в память, файл удаляется
+        path = self._path(session_id)
+        try:
+            with open(path, 'rb') as f:
+                data = loads(f.read())
+            os.remove(path)
+        except (OSError, JSONDecodeError):
+            return None
+        if not isinstance(data, dict) or data.get("expires_at", 0) < now:
+            return None
+        return _Session(data.get("messages") or [], now + self.ttl)
+
+    def _purge_files(self):
+        # Файл пишется при вытеснении, поэтому mtime + ttl не раньше срока истечения сессии
+        deadline = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def stats(self):
+        return {"sessions": len(self._sessions), "bytes": self._bytes, "evictions": self.evictions,
+                "spilled": self.spilled, "truncated": self.truncated}
+
+
+def reply_message(response_text):
+    # Сообщение ассистента из тела не-потокового ответа upstream
+    try:
+        message = loads(response_text)["choices"][0]["message"]
+    except (JSONDecodeError, KeyError, IndexError, TypeError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+async def record_stream(store, session_id, messages, events):
+    # Пропускает события потока дальше (bytes из stream_chat_raw или dict из stream_chat)
+    # и собирает ответ ассистента; в историю он попадает, только если поток дошёл до конца
+    role = "assistant"
+    parts = []
+    async with aclosing(events):
+        async for event in events:
+            chunk = event
+            if isinstance(event, (bytes, str)):
+                try:
+                    chunk = loads(event)
+                except JSONDecodeError:
+                    chunk = None
+            try:
+                delta = chunk["choices"][0]["delta"]
+            except (KeyError, IndexError, TypeError):
+                delta = None
+            if isinstance(delta, dict):
+                role = delta.get("role") or role
+                if delta.get("content"):
+                    parts.append(delta["content"])
+            yield event
+    try:
+        await store.run(store.commit, session_id, messages, {"role": role, "content": "".join(parts)})
+    except SessionNotFoundError:
+        # Сессию удалили или она истекла, пока шёл поток: ответ клиенту уже отдан, записывать некуда
+        pass
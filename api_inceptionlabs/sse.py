@@ -0,0 +1,77 @@
+from .json_backend import dumps, loads, JSONDecodeError
+from .errors import UpstreamStreamError, error_body
+
+DONE = b"[DONE]"
+
+
+class SSEParser:
+    # Инкрементальный парсер SSE поверх сырых байтов: события могут приходить
+    # разбитыми на произвольные TCP-чанки, многострочные data: склеиваются через \n.
+    # Возвращает только payload поля data, остальные поля (event:, id:, комментарии) пропускаются.
+    __slots__ = ("_buffer", "_data", "_scan")
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data = []
+        self._scan = 0
+
+    def feed(self, chunk):
+        buffer = self._buffer
+        buffer += chunk
+        events = []
+        start = 0
+        # Хвост без \n уже просмотрен в прошлых вызовах, ищем только в новых байтах
+        search = self._scan
+        # data копируется из буфера один раз, через memoryview; view отпускается до изменения размера буфера
+        with memoryview(buffer) as view:
+            while True:
+                end = buffer.find(b"\n", search)
+                if end == -1:
+                    break
+                line_end = end - 1 if end > start and buffer[end - 1] == 13 else end
+                if line_end == start:
+                    self._dispatch(events)
+                elif buffer.startswith(b"data:", start):
+                    value_start = start + 5
+                    if value_start < line_end and buffer[value_start] == 32:
+                        value_start += 1
+                    self._data.append(bytes(view[value_start:line_end]))
+                start = search = end + 1
+        if start:
+            del buffer[:start]
+        self._scan = len(buffer)
+        return events
+
+    def flush(self):
+        # Конец потока без завершающей пустой строки
+        events = self.feed(b"\n") if self._buffer else []
+        self._dispatch(events)
+        return events
+
+    def _dispatch(self, events):
+        data = self._data
+        if not data:
+            return
+        events.append(data[0] if len(data) == 1 else b"\n".join(data))
+        self._data = []
+
+
+def parse_event(event):
+    # Payload события -> dict; событие об ошибке (например, от другого экземпляра API) — исключение
+    try:
+        chunk = loads(event)
+    except JSONDecodeError as e:
+        raise UpstreamStreamError(f"Malformed stream event: {str(e)}") from e
+    if isinstance(chunk, dict) and "error" in chunk and "choices" not in chunk:
+        raise UpstreamStreamError(str(chunk["error"]))
+    return chunk
+
+
+def encode_error(error):
+    # Ошибка потока — отдельное событие error, а не текст в delta:
+    # event: error / data: {"error": "...", "type": "..."}
+    return b"event: error\ndata: " + dumps(error_body(error)) + b"\n\n"
+
+
+def encode_event(data):
+    return b"data: " + data + b"\n\n"
@@ -0,0 +1,240 @@
+import time
+from collections import deque
+from contextlib import aclosing
+from .json_backend import dumps
+from .metrics import stop_stream
+
+
+class StopMatcher:
+    # Автомат Ахо — Корасик по стоп-строкам: текст просматривается один раз, сколько бы строк ни было.
+    # Состояние переносится между чанками, поэтому строка, разрезанная границей чанков, тоже находится.
+    def __init__(self, stops):
+        self.goto = [{}]
+        self.fail = [0]
+        self.match = [0]  # длина самой длинной стоп-строки, оканчивающейся в этом состоянии
+        self.depth = [0]  # длина пути от корня: столько последних символов может оказаться началом стоп-строки
+        for stop in stops:
+            state = 0
+            for ch in stop:
+                following = self.goto[state].get(ch)
+                if following is None:
+                    following = self.goto[state][ch] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.match.append(0)
+                    self.depth.append(self.depth[state] + 1)
+                state = following
+            self.match[state] = max(self.match[state], len(stop))
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, following in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[following] = self.goto[fail].get(ch, 0)
+                self.match[following] = max(self.match[following], self.match[self.fail[following]])
+                queue.append(following)
+
+    def scan(self, state, text):
+        # -> (состояние, конец первого совпадения в text или -1, длина совпадения)
+        goto, fail, match = self.goto, self.fail, self.match
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if match[state]:
+                return state, i + 1, match[state]
+        return state, -1, 0
+
+
+class _Choice:
+    # Состояние проверки одного варианта ответа (choices[index])
+    __slots__ = ('state', 'held', 'text', 'chars', 'tokens', 'done')
+
+    def __init__(self):
+        self.state = 0
+        self.held = ""  # хвост, который может оказаться началом стоп-строки, ещё не отдан
+        self.text = ""
+        self.chars = 0
+        self.tokens = 0
+        self.done = False
+
+
+class StopCondition:
+    # Когда прекратить генерацию, не дожидаясь конца ответа upstream:
+    # stop — строка или список строк, ответ обрезается перед первой найденной (finish_reason "stop");
+    # max_chars — предел символов ответа, max_tokens — предел чанков с текстом (upstream отдаёт
+    # текст примерно по токену в чанке), оба дают finish_reason "length";
+    # stop_when(text) — своя проверка накопленного текста, True останавливает после текущего чанка.
+    def __init__(self, stop=None, max_chars=None, max_tokens=None, stop_when=None):
+        stops = [stop] if isinstance(stop, str) else stop
+        if stops is not None and (not isinstance(stops, (list, tuple))
+                                  or not all(isinstance(s, str) for s in stops)):
+            raise ValueError("stop must be a string or a list of strings")
+        for name, value in (("max_chars", max_chars), ("max_tokens", max_tokens)):
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+                raise ValueError(f"{name} must be a positive integer")
+        if stop_when is not None and not callable(stop_when):
+            raise ValueError("stop_when must be callable")
+        stops = [s for s in stops or () if s]
+        self.matcher = StopMatcher(stops) if stops else None
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self.stop_when = stop_when
+
+    @classmethod
+    def from_params(cls, params, stop_when=None):
+        # Условие из параметров запроса (stop, max_tokens, max_chars); None — проверять нечего
+        stop, max_chars, max_tokens = params.get('stop'), params.get('max_chars'), params.get('max_tokens')
+        if stop is None and max_chars is None and max_tokens is None and stop_when is None:
+            return None
+        return cls(stop, max_chars, max_tokens, stop_when)
+
+    @staticmethod
+    def upstream(params):
+        # stop и max_tokens уходят и в upstream, max_chars он не знает
+        return {k: v for k, v in params.items() if k != 'max_chars'}
+
+    def feed(self, choice, content):
+        # -> (текст, который можно отдать, finish_reason или None)
+        finish = None
+        if self.matcher is None:
+            emit = content
+        else:
+            text = choice.held + content
+            choice.state, end, length = self.matcher.scan(choice.state, content)
+            if end >= 0:
+                emit, choice.held, finish = text[:len(choice.held) + end - length], "", "stop"
+            else:
+                keep = len(text) - self.matcher.depth[choice.state]
+                emit, choice.held = text[:keep], text[keep:]
+        choice.tokens += 1
+        if finish is None and self.max_tokens is not None and choice.tokens >= self.max_tokens:
+            emit, choice.held, finish = emit + choice.held, "", "length"
+        emit, finish = self._emit(choice, emit, finish)
+        if finish is None and self.stop_when is not None and self.stop_when(choice.text):
+            # Придержанный хвост — обычный текст: стоп-строкой он уже не станет
+            tail, finish = self._emit(choice, choice.held, "stop")
+            emit, choice.held = emit + tail, ""
+        return emit, finish
+
+    def flush(self, choice):
+        # Поток закончился: придержанный хвост отдаётся как есть
+        emit, choice.held = choice.held, ""
+        return self._emit(choice, emit, None)[0]
+
+    def _emit(self, choice, emit, finish):
+        remaining = self.max_chars - choice.chars if self.max_chars is not None else len(emit) + 1
+        if len(emit) > remaining:
+            emit, finish = emit[:remaining], "length"
+        elif len(emit) == remaining:
+            finish = finish or "length"
+        choice.chars += len(emit)
+        if emit and self.stop_when is not None:
+            choice.text += emit
+        return emit, finish
+
+
+async def limit_stream(chunks, condition):
+    # Чанки stream_chat с применённым условием. Как только остановлены все варианты ответа,
+    # поток upstream закрывается (stop_stream — в метриках это не отказ клиента), остаток не генерируется
+    choices = {}
+    last = None
+    async with aclosing(chunks) as chunks:
+        async for chunk in chunks:
+            last = chunk
+            if not isinstance(chunk, dict) or not isinstance(chunk.get("choices"), list):
+                yield chunk
+                continue
+            kept = []
+            for choice in chunk["choices"]:
+                delta = choice.get("delta") if isinstance(choice, dict) else None
+                if not isinstance(delta, dict) or not isinstance(delta.get("content") or "", str):
+                    # Не чанк текста (событие ошибки и т.п.) — отдаём как есть
+                    kept.append(choice)
+                    continue
+                index = choice.get("index", 0)
+                state = choices.get(index)
+                if state is None:
+                    state = choices[index] = _Choice()
+                if state.done:
+                    continue
+                content = delta.get("content") or ""
+                emit, finish = condition.feed(state, content) if content else ("", None)
+                if finish is None and choice.get("finish_reason") is not None:
+                    emit += condition.flush(state)
+                    finish = choice["finish_reason"]
+                state.done = finish is not None
+                if emit == content and finish == choice.get("finish_reason"):
+                    kept.append(choice)
+                elif emit or finish is not None or set(delta) - {"content"}:
+                    kept.append(dict(choice, delta=dict(delta, content=emit), finish_reason=finish))
+            if kept or not chunk["choices"]:
+                yield dict(chunk, choices=kept)
+            if choices and all(state.done for state in choices.values()):
+                await stop_stream(chunks)
+                return
+    # upstream закончил без finish_reason — отдаём придержанные хвосты
+    tail = []
+    for index, state in choices.items():
+        text = "" if state.done else condition.flush(state)
+        if text:
+            tail.append({"index": index, "delta": {"content": text}, "finish_reason": None})
+    if tail and isinstance(last, dict):
+        yield dict(last, choices=tail)
+
+
+async def _encoded(chunks):
+    async with aclosing(chunks) as chunks:
+        async for chunk in chunks:
+            yield dumps(chunk)
+
+
+def stream_limited(source, model, messages, condition, timeouts=None, raw=False, **params):
+    # source — AuthManager или StreamMultiplexer; raw=True — события байтами JSON, как stream_chat_raw
+    chunks = limit_stream(source.stream_chat(model, messages, timeouts, **condition.upstream(params)), condition)
+    return _encoded(chunks) if raw else chunks
+
+
+async def collect_completion(chunks, model):
+    # Тело не-потокового ответа (chat.completion), собранное из чанков потока
+    choices = {}
+    first = None
+    usage = None
+    async with aclosing(chunks) as chunks:
+        async for chunk in chunks:
+            if not isinstance(chunk, dict):
+                continue
+            first = first or chunk
+            usage = chunk.get("usage") or usage
+            chunk_choices = chunk.get("choices")
+            for choice in chunk_choices if isinstance(chunk_choices, list) else ():
+                if not isinstance(choice, dict):
+                    continue
+                index = choice.get("index", 0)
+                entry = choices.get(index)
+                if entry is None:
+                    entry = choices[index] = {"role": "assistant", "parts": [], "finish_reason": None}
+                delta = choice.get("delta")
+                delta = delta if isinstance(delta, dict) else {}
+                entry["role"] = delta.get("role") or entry["role"]
+                if isinstance(delta.get("content"), str):
+                    entry["parts"].append(delta["content"])
+                if choice.get("finish_reason") is not None:
+                    entry["finish_reason"] = choice["finish_reason"]
+    first = first or {}
+    created = first.get("created", int(time.time()))
+    body = {"id": first.get("id", f"chatcmpl-{created}"), "object": "chat.completion", "created": created,
+            "model": first.get("model", model),
+            "choices": [{"index": index, "message": {"role": entry["role"], "content": "".join(entry["parts"])},
+                         "finish_reason": entry["finish_reason"]} for index, entry in sorted(choices.items())]}
+    if usage is not None:
+        body["usage"] = usage
+    return dumps(body).decode('utf-8')
+
+
+async def complete_limited(source, model, messages, condition, timeouts=None, **params):
+    # Не-потоковый запрос с условием идёт в upstream потоком, чтобы его можно было оборвать;
+    # возвращает текст тела, как complete_chat
+    return await collect_completion(stream_limited(source, model, messages, condition, timeouts, **params), model)
@@ -0,0 +1,172 @@
+import asyncio
+import aiohttp
+from .errors import UpstreamError
+from .config import CONNECT_TIMEOUT, FIRST_BYTE_TIMEOUT, IDLE_TIMEOUT, REQUEST_TIMEOUT
+
+PHASES = ('connect', 'first_byte', 'idle', 'total')
+
+
+class UpstreamTimeout(UpstreamError):
+    error_type = "upstream_timeout"
+    http_status = 504
+
+    def __init__(self, phase, timeout):
+        super().__init__(f"Upstream {phase.replace('_', ' ')} timeout after {timeout}s")
+        self.phase = phase
+        self.timeout = timeout
+        # До первых данных запрос можно повторить, оборванный на середине ответ — нет
+        self.retryable = phase in ('connect', 'first_byte')
+
+
+class Timeouts:
+    # Таймауты в секундах, None — без ограничения:
+    #   connect    — установка TCP/TLS соединения;
+    #   first_byte — от начала запроса до первых данных ответа;
+    #   idle       — пауза между чанками ответа;
+    #   total      — весь запрос целиком.
+    __slots__ = PHASES
+
+    def __init__(self, connect=None, first_byte=None, idle=None, total=None):
+        self.connect = connect
+        self.first_byte = first_byte
+        self.idle = idle
+        self.total = total
+
+    @classmethod
+    def default(cls):
+        return cls(CONNECT_TIMEOUT, FIRST_BYTE_TIMEOUT, IDLE_TIMEOUT, REQUEST_TIMEOUT)
+
+    @classmethod
+    def coerce(cls, value):
+        # None, Timeouts, число (total) или словарь {"connect", "first_byte", "idle", "total"}
+        if value is None or isinstance(value, Timeouts):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return cls(total=value)
+        if isinstance(value, dict) and set(value) <= set(PHASES):
+            try:
+                return cls(**{k: None if v is None else float(v) for k, v in value.items()})
+            except (TypeError, ValueError):
+                pass
+        raise ValueError(f"timeout must be a number of seconds or an object with keys {', '.join(PHASES)}")
+
+    def merged(self, other):
+        # Значения other поверх текущих; незаданные в other остаются по умолчанию
+        other = Timeouts.coerce(other)
+        if other is None:
+            return self
+        return Timeouts(*(getattr(self, name) if getattr(other, name) is None else getattr(other, name)
+                          for name in PHASES))
+
+    def __repr__(self):
+        return "Timeouts(" + ", ".join(f"{name}={getattr(self, name)}" for name in PHASES) + ")"
+
+
+class Deadline:
+    # Сторож одного запроса к upstream. Ожидание заголовков ограничено через wait_for,
+    # дальше — один таймер на запрос: он закрывает ответ, если данных нет дольше
+    # first_byte/idle или вышел total. На каждый чанк — только запись времени, без
+    # перепланирования таймера. Пока потребитель обрабатывает отданный чанк (pause),
+    # время простоя upstream не считается. origin — начало всего запроса с повторами:
+    # total отсчитывается от него, first_byte — от начала текущей попытки.
+    __slots__ = ('timeouts', 'loop', 'origin', 'start', 'last', 'waiting', 'received', 'expired', 'response',
+                 '_handle')
+
+    def __init__(self, timeouts, origin=None):
+        self.timeouts = timeouts
+        self.loop = asyncio.get_running_loop()
+        self.start = self.last = self.loop.time()
+        self.origin = self.start if origin is None else origin
+        self.waiting = True
+        self.received = False
+        self.expired = None
+        self.response = None
+        self._handle = None
+
+    @property
+    def client_timeout(self):
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.timeouts.connect)
+
+    async def request(self, request):
+        # request — session.post(...); ждём заголовки не дольше first_byte/total
+        timeout, phase = self._header_budget()
+        try:
+            return await asyncio.wait_for(request, timeout)
+        except aiohttp.ServerTimeoutError as e:
+            raise UpstreamTimeout('connect', self.timeouts.connect) from e
+        except asyncio.TimeoutError as e:
+            raise UpstreamTimeout(phase, getattr(self.timeouts, phase)) from e
+
+    def _header_budget(self):
+        now = self.loop.time()
+        t = self.timeouts
+        budgets = []
+        if t.first_byte is not None:
+            budgets.append((self.start + t.first_byte - now, 'first_byte'))
+        if t.total is not None:
+            budgets.append((self.origin + t.total - now, 'total'))
+        if not budgets:
+            return None, None
+        timeout, phase = min(budgets)
+        return max(timeout, 0), phase
+
+    def watch(self, response):
+        self.response = response
+        t = self.timeouts
+        if t.first_byte is not None or t.idle is not None or t.total is not None:
+            self._schedule()
+
+    def touch(self):
+        # Пришли данные от upstream или потребитель вернулся за следующим чанком
+        self.last = self.loop.time()
+        self.waiting = True
+
+    def data(self):
+        self.last = self.loop.time()
+        if not self.received:
+            # Дальше действует idle вместо first_byte — один раз переставляем таймер
+            self.received = True
+            if self._handle is not None:
+                self._handle.cancel()
+                self._schedule()
+
+    def pause(self):
+        self.waiting = False
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def check(self):
+        if self.expired is not None:
+            raise UpstreamTimeout(self.expired, getattr(self.timeouts, self.expired))
+
+    def _due(self):
+        t = self.timeouts
+        due = phase = None
+        if self.waiting:
+            if self.received:
+                if t.idle is not None:
+                    due, phase = self.last + t.idle, 'idle'
+            elif t.first_byte is not None:
+                due, phase = self.start + t.first_byte, 'first_byte'
+        if t.total is not None and (due is None or self.origin + t.total < due):
+            due, phase = self.origin + t.total, 'total'
+        return due, phase
+
+    def _schedule(self):
+        due, _ = self._due()
+        if due is None:
+            # Ждёт потребитель, а не upstream — заглянем позже
+            due = self.loop.time() + (self.timeouts.idle or self.timeouts.first_byte or 1.0)
+        self._handle = self.loop.call_at(due, self._check)
+
+    def _check(self):
+        self._handle = None
+        due, phase = self._due()
+        if due is not None and self.loop.time() >= due:
+            self.expired = phase
+            self.response.close()
+        else:
+            self._schedule()
@@ -0,0 +1,110 @@
+import asyncio
+import multiprocessing
+import signal
+import socket
+import threading
+
+RESTART_DELAY = 1.0
+
+
+def _serve(server, app_factory, sock):
+    # Точка входа воркера: приложение создаётся уже в дочернем процессе
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C обрабатывает супервизор
+    app = app_factory()
+    if server == 'aiohttp':
+        from aiohttp import web
+        web.run_app(app, sock=sock, print=None, handler_cancellation=True)
+    else:
+        from werkzeug.serving import make_server
+        host, port = sock.getsockname()[:2]
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+class Supervisor:
+    # Общий слушающий сокет для N процессов-воркеров. Супервизор перезапускает упавших
+    # воркеров и сам ведёт обслуживание аккаунтов (генерация, истечение) в фоновом потоке;
+    # воркеры только читают общий accounts.json и помечают rate limited через него же.
+    def __init__(self, app_factory, host, port, workers, server='aiohttp', auth_manager_factory=None):
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.server = server
+        self.auth_manager_factory = auth_manager_factory
+        self.sock = None
+        self._processes = {}
+        self._stop = threading.Event()
+        self._loop = None
+        self._task = None
+        self._maintenance = None
+
+    def start(self):
+        self.sock = socket.create_server((self.host, self.port), backlog=2048)
+        self.sock.set_inheritable(True)
+        # spawn, а не fork: у супервизора есть потоки и event loop, которые не должны
+        # наследоваться воркерами
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers):
+            self._start_worker(context, index)
+        if self.auth_manager_factory is not None:
+            self._maintenance = threading.Thread(target=self._run_maintenance, name="inceptionlabs-maintenance",
+                                                 daemon=True)
+            self._maintenance.start()
+        return context
+
+    def _start_worker(self, context, index):
+        process = context.Process(target=_serve, args=(self.server, self.app_factory, self.sock),
+                                  name=f"inceptionlabs-worker-{index}", daemon=True)
+        process.start()
+        self._processes[index] = process
+
+    def _run_maintenance(self):
+        self._loop = asyncio.new_event_loop()
+        auth_manager = self.auth_manager_factory()
+        self._task = self._loop.create_task(auth_manager.maintain())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            auth_manager.store.flush()
+            self._loop.run_until_complete(auth_manager.close())
+            self._loop.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        context = self.start()
+        previous = {sig: signal.signal(sig, lambda *_: self.stop()) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            while not self._stop.wait(RESTART_DELAY):
+                for index, process in list(self._processes.items()):
+                    if not process.is_alive():
+                        print(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting")
+                        self._start_worker(context, index)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            self.shutdown()
+
+    def shutdown(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+        if self._maintenance is not None and self._task is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:  # loop уже закрыт
+                pass
+            self._maintenance.join(5)
+        if self.sock is not None:
+            self.sock.close()
+
+
+def run_workers(app_factory, host, port, workers, server='aiohttp', auth_manager_factory=None):
+    Supervisor(app_factory, host, port, workers, server, auth_manager_factory).run()
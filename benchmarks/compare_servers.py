@@ -0,0 +1,41 @@
+"""Flask vs aiohttp server comparison against a local stub upstream.
+
+Usage: python -m benchmarks.compare_servers --concurrency 200 --requests 1000
+"""
+import argparse
+import asyncio
+import json
+
+import aiohttp
+
+from benchmarks.run import make_auth_manager, run_concurrent, server_request, start_server
+from benchmarks.stub_server import start_stub, StubOptions
+
+
+async def main(args):
+    options = StubOptions(tokens=args.chunks, token_rate=1 / args.delay if args.delay else 0)
+    stub_runner, upstream = await start_stub(options)
+    results = {}
+    for kind in ("aiohttp", "flask"):
+        auth_manager = make_auth_manager(upstream)
+        stop_server, base_url = await start_server(kind, auth_manager)
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+            for mode in ("complete", "stream"):
+                one = server_request(session, f"{base_url}/api/chat/completions", mode)
+                results[f"{kind}_{mode}"] = await run_concurrent(one, args.requests, args.concurrency)
+        if asyncio.iscoroutinefunction(stop_server):
+            await stop_server()
+        else:
+            stop_server()
+        await auth_manager.close()
+    await stub_runner.cleanup()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Flask and aiohttp API servers")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--chunks", type=int, default=20, help="SSE chunks per streamed response")
+    parser.add_argument("--delay", type=float, default=0.01, help="Upstream delay per chunk, seconds")
+    asyncio.run(main(parser.parse_args()))
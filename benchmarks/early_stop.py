@@ -0,0 +1,114 @@
+"""Client-side stop conditions: reading the whole answer and trimming it vs cutting the upstream stream.
+
+Usage: python -m benchmarks.early_stop --tokens 2000 --token-rate 5000 --stop-at 100 --requests 20
+
+The stub upstream sends --tokens one-token chunks at --token-rate; only the first --stop-at tokens
+are wanted. Compares, for non-streaming and streaming requests through AsyncClient, waiting for the
+full answer and trimming it locally against max_chars, which closes the upstream stream once the
+limit is reached. Also measures the stop-string matcher alone: text scanned per second with
+--patterns stop strings, against searching the unmatched tail for each string.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from api_inceptionlabs.client import AsyncClient
+from api_inceptionlabs.stopping import StopMatcher
+from benchmarks.run import MODEL, MESSAGES, make_auth_manager, summarize
+from benchmarks.stub_server import start_stub, StubOptions
+
+TOKEN = "tok "
+
+
+async def run_mode(args, upstream, stream, early):
+    client = AsyncClient(make_auth_manager(upstream))
+    limit = len(TOKEN) * args.stop_at
+    expected = TOKEN * args.stop_at
+    params = {"max_chars": limit} if early else {}
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        began = time.perf_counter()
+        try:
+            if stream:
+                parts = []
+                async for chunk in await client.chat.completions.stream(model=MODEL, messages=MESSAGES, **params):
+                    if chunk.choices:
+                        parts.append(chunk.choices[0].delta.content)
+                text = "".join(parts)
+            else:
+                response = await client.chat.completions.create(model=MODEL, messages=MESSAGES, **params)
+                text = response.choices[0].message.content
+            if text[:limit] != expected:
+                raise RuntimeError("unexpected output")
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    await client.auth_manager.close()
+    result = {"stream": stream, "early_stop": early}
+    result.update(summarize(latencies, [], errors, elapsed, args.requests))
+    return result
+
+
+def matcher_throughput(args):
+    # Поток из чанков по 4 символа без совпадений: Ахо — Корасик против поиска каждой строки в хвосте
+    stops = [f"STOP{i:04d}" for i in range(args.patterns)]
+    chunks = ["abcd"] * (args.matcher_chars // 4)
+    matcher = StopMatcher(stops)
+    start = time.perf_counter()
+    state = 0
+    for chunk in chunks:
+        state = matcher.scan(state, chunk)[0]
+    automaton = time.perf_counter() - start
+    longest = max(map(len, stops))
+    start = time.perf_counter()
+    tail = ""
+    for chunk in chunks:
+        tail = tail[-longest + 1:] + chunk
+        if any(stop in tail for stop in stops):
+            break
+    naive = time.perf_counter() - start
+    return {"patterns": args.patterns, "chars": len(chunks) * 4,
+            "aho_corasick_mchars_per_s": round(len(chunks) * 4 / automaton / 1e6, 2),
+            "naive_mchars_per_s": round(len(chunks) * 4 / naive / 1e6, 2)}
+
+
+async def main(args):
+    options = StubOptions(tokens=args.tokens, token_rate=args.token_rate, chunk_size=1)
+    stub_runner, upstream = await start_stub(options)
+    results = []
+    try:
+        for stream in (False, True):
+            for early in (False, True):
+                result = await run_mode(args, upstream, stream, early)
+                results.append(result)
+                print(f"stream={stream!s:>5} early_stop={early!s:>5}: p50 {result['latency_ms']['p50']}ms "
+                      f"p99 {result['latency_ms']['p99']}ms errors={result['errors']}", flush=True)
+    finally:
+        await stub_runner.cleanup()
+    matcher = matcher_throughput(args)
+    print(f"matcher, {matcher['patterns']} patterns: Aho-Corasick {matcher['aho_corasick_mchars_per_s']} Mchar/s, "
+          f"naive {matcher['naive_mchars_per_s']} Mchar/s", flush=True)
+    report = {"args": {k: v for k, v in vars(args).items() if k != "output"}, "results": results,
+              "matcher": matcher}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Early stop benchmark")
+    parser.add_argument("--tokens", type=int, default=2000, help="One-token chunks in the full upstream answer")
+    parser.add_argument("--token-rate", type=float, default=5000.0, help="Upstream tokens per second")
+    parser.add_argument("--stop-at", type=int, default=100, help="Tokens before the stop string")
+    parser.add_argument("--requests", type=int, default=20, help="Sequential requests per scenario")
+    parser.add_argument("--patterns", type=int, default=50, help="Stop strings in the matcher benchmark")
+    parser.add_argument("--matcher-chars", type=int, default=2_000_000, help="Text scanned in the matcher benchmark")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    asyncio.run(main(parser.parse_args()))
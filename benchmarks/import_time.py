@@ -0,0 +1,124 @@
+"""Cold-start cost of the library: import time and AsyncClient/AuthManager construction.
+
+Usage: python -m benchmarks.import_time --runs 10 --budget 400 --package-budget 25
+
+Every scenario runs in a fresh interpreter; the time of a bare `python -c pass` is
+subtracted. Exits with status 1 if a budget is exceeded or if a heavy dependency
+(Flask, Playwright, requests) is imported where it is not needed, so the check can
+run in CI next to the other benchmarks.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from api_inceptionlabs import __version__
+
+HEAVY_MODULES = ("flask", "werkzeug", "playwright", "requests")
+REPORT_HEAVY = "import sys; print(','.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+
+SCENARIOS = {
+    "package": "import api_inceptionlabs",
+    "client": (
+        "import os, sys\n"
+        "from api_inceptionlabs import AsyncClient, AuthManager\n"
+        "path = os.path.join(sys.argv[1], 'accounts.json')\n"
+        "client = AsyncClient(AuthManager(accounts_file=path))\n"
+        "assert not os.path.exists(path), 'AuthManager() touched the accounts file'\n"
+    ),
+}
+
+
+def run_python(code, *args, options=()):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, *options, "-c", code, *args], capture_output=True, text=True,
+                            env=env)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return elapsed, result
+
+
+def overhead_ms(code, runs, *args):
+    # Запуски сценария чередуются с пустым интерпретатором, чтобы фоновый шум вычитался парами
+    deltas = sorted(run_python(code, *args)[0] - run_python("pass")[0] for _ in range(runs))
+    return max(0.0, deltas[len(deltas) // 2] * 1000)
+
+
+def import_times(code, *args):
+    # Импорты верхнего уровня по данным -X importtime: {модуль: микросекунды вместе с вложенными}
+    _, result = run_python(code, *args, options=("-X", "importtime"))
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # вложенные импорты идут с дополнительным отступом
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def top_imports(code, count, startup, *args):
+    rows = sorted(((us, name) for name, us in import_times(code, *args).items() if name not in startup),
+                  reverse=True)
+    return [{"module": name, "ms": round(us / 1000, 2)} for us, name in rows[:count]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="api_inceptionlabs import-time benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="Interpreter launches per scenario")
+    parser.add_argument("--budget", type=float, default=400.0,
+                        help="Max ms over bare python for importing and constructing AsyncClient")
+    parser.add_argument("--package-budget", type=float, default=25.0,
+                        help="Max ms over bare python for `import api_inceptionlabs`")
+    parser.add_argument("--top", type=int, default=10, help="Most expensive imports to report")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="inceptionlabs-import-")
+    baseline = sorted(run_python("pass")[0] for _ in range(args.runs))[args.runs // 2] * 1000
+    startup = set(import_times("pass"))  # site, encodings и прочее, что грузит сам интерпретатор
+    budgets = {"package": args.package_budget, "client": args.budget}
+    results, failures = [], []
+    for name, code in SCENARIOS.items():
+        elapsed = overhead_ms(code, args.runs, workdir)
+        heavy = run_python(code + "\n" + REPORT_HEAVY, workdir)[1].stdout.strip().splitlines()[-1:]
+        heavy = [m for m in ",".join(heavy).split(",") if m]
+        results.append({"scenario": name, "ms": round(elapsed, 2), "budget_ms": budgets[name],
+                        "heavy_modules": heavy, "top_imports": top_imports(code, args.top, startup, workdir)})
+        print(f"{name:>8} {elapsed:8.1f}ms (budget {budgets[name]}ms) heavy={heavy or '-'}", file=sys.stderr)
+        if elapsed > budgets[name]:
+            failures.append(f"{name}: {elapsed:.1f}ms > {budgets[name]}ms")
+        if heavy:
+            failures.append(f"{name}: imported {', '.join(heavy)}")
+
+    report = {
+        "meta": {
+            "version": __version__,
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "baseline_ms": round(baseline, 2),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": results,
+        "failures": failures,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Non-streaming responses through the aiohttp server: byte passthrough vs parse and re-serialize.
+
+Usage: python -m benchmarks.passthrough --tokens 20000 --requests 200 --concurrency 10 --brotli
+
+With passthrough the server forwards the upstream body as received, in its Content-Encoding
+when the client accepts it. Without passthrough it decodes the body, runs json.loads and
+serializes it again (the behaviour before passthrough existed). Every scenario runs twice:
+once for latency and throughput, once under tracemalloc for the peak of Python allocations.
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+
+from api_inceptionlabs.aio_api import create_aio_app
+from api_inceptionlabs.compression import decompress
+from benchmarks.run import MODEL, MESSAGES, make_auth_manager, run_concurrent
+from benchmarks.stub_server import start_stub, StubOptions
+
+
+def request_one(session, url, accept_encoding, expected_length, wire):
+    # Сессия без автоматической распаковки: wire[0] копит байты тела на проводе
+    payload = {"model": MODEL, "messages": MESSAGES}
+    headers = {"Accept-Encoding": accept_encoding}
+
+    async def one():
+        start = time.perf_counter()
+        async with session.post(url, json=payload, headers=headers) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            raw = await response.read()
+            body = json.loads(decompress(raw, response.headers.get("Content-Encoding")))
+        if len(body["choices"][0]["message"]["content"]) != expected_length:
+            raise RuntimeError("truncated response")
+        wire[0] += len(raw)
+        return time.perf_counter() - start, None
+    return one
+
+
+async def run_scenario(args, upstream, passthrough, accept_encoding, traced):
+    auth_manager = make_auth_manager(upstream)
+    runner = web.AppRunner(create_aio_app(auth_manager, maintain_accounts=False, passthrough=passthrough),
+                           access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/api/chat/completions"
+    wire = [0]
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), auto_decompress=False) as session:
+        one = request_one(session, url, accept_encoding, len("tok ") * args.tokens, wire)
+        if traced:
+            tracemalloc.start()
+        try:
+            result = await run_concurrent(one, args.requests, args.concurrency)
+            if traced:
+                result = {"peak_kib": round(tracemalloc.get_traced_memory()[1] / 1024)}
+        finally:
+            if traced:
+                tracemalloc.stop()
+    await runner.cleanup()
+    await auth_manager.close()
+    if not traced:
+        result["wire_bytes_per_response"] = round(wire[0] / max(1, args.requests - result["errors"]))
+    return result
+
+
+async def main(args):
+    options = StubOptions(tokens=args.tokens, brotli=args.brotli)
+    stub_runner, upstream = await start_stub(options)
+    results = []
+    try:
+        for passthrough in (False, True):
+            for accept_encoding in ("identity", "gzip, deflate, br"):
+                result = {"passthrough": passthrough, "accept_encoding": accept_encoding}
+                result.update(await run_scenario(args, upstream, passthrough, accept_encoding, traced=False))
+                result.update(await run_scenario(args, upstream, passthrough, accept_encoding, traced=True))
+                results.append(result)
+                print(f"passthrough={passthrough!s:>5} accept={accept_encoding:>17}: {result['rps']} rps "
+                      f"p50 {result['latency_ms']['p50']}ms {result['wire_bytes_per_response']} B "
+                      f"peak {result['peak_kib']} KiB errors={result['errors']}", flush=True)
+    finally:
+        await stub_runner.cleanup()
+    report = {"args": {k: v for k, v in vars(args).items() if k != "output"}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Non-streaming passthrough benchmark")
+    parser.add_argument("--tokens", type=int, default=20000, help="Tokens per upstream response")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--brotli", action="store_true", help="Upstream answers with Content-Encoding: br")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    asyncio.run(main(parser.parse_args()))
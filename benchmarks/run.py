@@ -0,0 +1,225 @@
+"""Benchmark suite for AuthManager, AsyncClient and the HTTP server against a local stub.
+
+Usage:
+    python -m benchmarks.run --targets auth_manager,client,server --concurrency 1,10,100 \
+        --requests 500 --token-rate 2000 --output results.json
+
+Results are written as JSON so runs from different releases can be diffed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+from api_inceptionlabs import __version__
+from api_inceptionlabs.auth_manager import AuthManager
+from api_inceptionlabs.client import AsyncClient
+from benchmarks.stub_server import start_stub, add_stub_arguments, options_from_args
+
+MODEL = "lambda.mercury-coder-small"
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+TARGETS = ("auth_manager", "client", "server")
+MODES = ("complete", "stream")
+
+
+def make_auth_manager(upstream, accounts=1):
+    accounts_file = os.path.join(tempfile.mkdtemp(prefix="inceptionlabs-bench-"), "accounts.json")
+    auth_manager = AuthManager(api_host=upstream, accounts_file=accounts_file)
+    for i in range(accounts):
+        auth_manager.store.add({"bearer": f"bench-{i}", "cookies": {}, "created_at": time.time()})
+    auth_manager.active_account = auth_manager.store.random_active()
+    return auth_manager
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(latencies, ttfts, errors, elapsed, total):
+    def ms(values):
+        if not values:
+            return None
+        return {"p50": round(percentile(values, 0.5) * 1000, 2),
+                "p99": round(percentile(values, 0.99) * 1000, 2),
+                "mean": round(sum(values) / len(values) * 1000, 2)}
+
+    return {"requests": total, "errors": errors, "seconds": round(elapsed, 3),
+            "rps": round(total / elapsed, 1) if elapsed else None,
+            "latency_ms": ms(latencies), "ttft_ms": ms(ttfts)}
+
+
+async def run_concurrent(one, total, concurrency):
+    # one() -> (latency, ttft или None), исключение — ошибка запроса
+    latencies, ttfts = [], []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            try:
+                latency, ttft = await one()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(latency)
+            if ttft is not None:
+                ttfts.append(ttft)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, ttfts, errors, time.perf_counter() - start, total)
+
+
+def auth_manager_request(auth_manager, mode):
+    async def one():
+        start = time.perf_counter()
+        ttft = None
+        if mode == "stream":
+            async for chunk in auth_manager.stream_chat(MODEL, MESSAGES):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+        else:
+            await auth_manager.complete_chat(MODEL, MESSAGES)
+        return time.perf_counter() - start, ttft
+    return one
+
+
+def client_request(client, mode):
+    async def one():
+        start = time.perf_counter()
+        ttft = None
+        if mode == "stream":
+            async for chunk in await client.chat.completions.stream(model=MODEL, messages=MESSAGES):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+        else:
+            await client.chat.completions.create(model=MODEL, messages=MESSAGES)
+        return time.perf_counter() - start, ttft
+    return one
+
+
+def server_request(session, url, mode):
+    payload = {"model": MODEL, "messages": MESSAGES, "stream": mode == "stream"}
+
+    async def one():
+        start = time.perf_counter()
+        ttft = None
+        async with session.post(url, json=payload) as response:
+            if response.status != 200:
+                await response.read()
+                raise RuntimeError(f"HTTP {response.status}")
+            async for data in response.content.iter_any():
+                if mode == "stream":
+                    if b"event: error" in data:
+                        raise RuntimeError(data)
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+        return time.perf_counter() - start, ttft
+    return one
+
+
+async def start_server(kind, auth_manager):
+    if kind == "flask":
+        from werkzeug.serving import make_server
+        from api_inceptionlabs.api import create_app
+        server = make_server("127.0.0.1", 0, create_app(auth_manager, maintain_accounts=False), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.shutdown, f"http://127.0.0.1:{server.server_port}"
+    from api_inceptionlabs.aio_api import create_aio_app
+    runner = web.AppRunner(create_aio_app(auth_manager, maintain_accounts=False), access_log=None,
+                           handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner.cleanup, f"http://127.0.0.1:{port}"
+
+
+async def run_suite(args):
+    stub_runner, upstream = await start_stub(options_from_args(args))
+    results = []
+    try:
+        for target in args.targets:
+            auth_manager = make_auth_manager(upstream, args.accounts)
+            stop_server = None
+            if target == "server":
+                stop_server, base_url = await start_server(args.server, auth_manager)
+                session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+            for mode in args.modes:
+                for concurrency in args.concurrency:
+                    if target == "auth_manager":
+                        one = auth_manager_request(auth_manager, mode)
+                    elif target == "client":
+                        one = client_request(AsyncClient(auth_manager), mode)
+                    else:
+                        one = server_request(session, f"{base_url}/api/chat/completions", mode)
+                    result = await run_concurrent(one, args.requests, concurrency)
+                    result.update(target=target, mode=mode, concurrency=concurrency)
+                    if target == "server":
+                        result["server"] = args.server
+                    results.append(result)
+                    print(f"{target:>12} {mode:>8} c={concurrency:<5} rps={result['rps']:<9} "
+                          f"p50={(result['latency_ms'] or {}).get('p50')}ms errors={result['errors']}",
+                          file=sys.stderr)
+            if stop_server:
+                await session.close()
+                if asyncio.iscoroutinefunction(stop_server):
+                    await stop_server()
+                else:
+                    stop_server()
+            await auth_manager.close()
+    finally:
+        await stub_runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="api_inceptionlabs benchmark suite")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"Comma-separated subset of {TARGETS}")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated subset of {MODES}")
+    parser.add_argument("--concurrency", default="1,10,100", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--server", choices=["aiohttp", "flask"], default="aiohttp",
+                        help="Server backend for the server target")
+    parser.add_argument("--accounts", type=int, default=100,
+                        help="Fake accounts to preload; 401 injection marks them rate limited")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    args.targets = [t for t in args.targets.split(",") if t]
+    args.modes = [m for m in args.modes.split(",") if m]
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c]
+
+    results = asyncio.run(run_suite(args))
+    report = {
+        "meta": {
+            "version": __version__,
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Throughput of the multi-process server (--workers) against a local stub upstream.
+
+Usage: python -m benchmarks.scaling --workers 1,2,4 --clients 4 --requests 2000 --concurrency 64
+
+The stub, the supervisor with its workers and the load generators run in separate
+processes, so on a machine with enough cores rps should grow with the worker count.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.run import MODEL, run_concurrent, server_request
+from benchmarks.stub_server import make_stub_app, add_stub_arguments, options_from_args
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_stub(options, port):
+    web.run_app(make_stub_app(options), host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def bench_app(upstream, accounts_file, server):
+    from api_inceptionlabs.auth_manager import AuthManager
+    auth_manager = AuthManager(api_host=upstream, accounts_file=accounts_file, generate_accounts=False)
+    if server == "aiohttp":
+        from api_inceptionlabs.aio_api import create_aio_app
+        return create_aio_app(auth_manager, maintain_accounts=False)
+    from api_inceptionlabs.api import create_app
+    return create_app(auth_manager, maintain_accounts=False)
+
+
+def serve_workers(upstream, accounts_file, server, port, workers):
+    from api_inceptionlabs.workers import run_workers
+    run_workers(functools.partial(bench_app, upstream, accounts_file, server), "127.0.0.1", port, workers,
+                server=server)
+
+
+def load(url, mode, requests, concurrency):
+    async def run():
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            return await run_concurrent(server_request(session, url, mode), requests, concurrency)
+    return asyncio.run(run())
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def write_accounts(count):
+    path = os.path.join(tempfile.mkdtemp(prefix="inceptionlabs-bench-"), "accounts.json")
+    accounts = [{"bearer": f"bench-{i}", "cookies": {}, "created_at": time.time()} for i in range(count)]
+    with open(path, "w") as f:
+        json.dump({"active": accounts, "rate_limited": []}, f)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process server scaling benchmark")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--server", choices=["aiohttp", "flask"], default="aiohttp")
+    parser.add_argument("--modes", default="complete,stream")
+    parser.add_argument("--clients", type=int, default=4, help="Load generator processes")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario, split across clients")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent requests, split across clients")
+    parser.add_argument("--accounts", type=int, default=100)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    stub_port = free_port()
+    stub = context.Process(target=serve_stub, args=(options_from_args(args), stub_port), daemon=True)
+    stub.start()
+    wait_for_port(stub_port)
+    upstream = f"http://127.0.0.1:{stub_port}"
+    accounts_file = write_accounts(args.accounts)
+
+    results = []
+    with context.Pool(args.clients) as pool:
+        for workers in [int(w) for w in args.workers.split(",") if w]:
+            port = free_port()
+            supervisor = context.Process(target=serve_workers,
+                                         args=(upstream, accounts_file, args.server, port, workers))
+            supervisor.start()
+            wait_for_port(port)
+            url = f"http://127.0.0.1:{port}/api/chat/completions"
+            try:
+                for mode in [m for m in args.modes.split(",") if m]:
+                    per_client = max(1, args.requests // args.clients)
+                    concurrency = max(1, args.concurrency // args.clients)
+                    start = time.perf_counter()
+                    parts = pool.starmap(load, [(url, mode, per_client, concurrency)] * args.clients)
+                    elapsed = time.perf_counter() - start
+                    total = per_client * args.clients
+                    result = {"workers": workers, "server": args.server, "mode": mode, "requests": total,
+                              "errors": sum(p["errors"] for p in parts), "seconds": round(elapsed, 3),
+                              "rps": round(total / elapsed, 1),
+                              "p50_ms": max((p["latency_ms"] or {}).get("p50") or 0 for p in parts)}
+                    results.append(result)
+                    print(f"workers={workers:<3} {mode:>8} rps={result['rps']:<9} errors={result['errors']}",
+                          file=sys.stderr)
+            finally:
+                supervisor.terminate()
+                supervisor.join(10)
+    stub.terminate()
+    print(json.dumps({"meta": {"cpus": os.cpu_count(), "model": MODEL, "args": vars(args)}, "results": results},
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Admission control under a burst: direct upstream calls vs the fair-queuing scheduler.
+
+Usage: python -m benchmarks.scheduler --capacity 8 --heavy 200 --light-clients 10 --light-requests 5
+
+The stub upstream serves --capacity requests at once and queues the rest. One heavy client sends
+--heavy requests at once while --light-clients clients each send --light-requests requests one
+after another. Without the scheduler the light requests wait behind the whole burst in the upstream
+queue; with it (--max-inflight = --capacity) clients are served round-robin, and requests that
+cannot be queued get 429/503 with Retry-After. Reports latency per client class and response codes.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+from api_inceptionlabs.aio_api import create_aio_app
+from api_inceptionlabs.scheduler import Scheduler
+from benchmarks.run import MODEL, MESSAGES, make_auth_manager, summarize
+from benchmarks.stub_server import start_stub, StubOptions
+
+
+async def one(session, url, client, latencies, statuses, retry_after):
+    start = time.perf_counter()
+    async with session.post(url, json={"model": MODEL, "messages": MESSAGES},
+                            headers={"X-Client-Id": client}) as response:
+        await response.read()
+        statuses[response.status] += 1
+        if response.status == 200:
+            latencies.append(time.perf_counter() - start)
+        elif "Retry-After" in response.headers:
+            retry_after.append(int(response.headers["Retry-After"]))
+
+
+async def run_mode(args, upstream, use_scheduler):
+    auth_manager = make_auth_manager(upstream)
+    scheduler = None
+    if use_scheduler:
+        scheduler = Scheduler(max_inflight=args.capacity, max_queue=args.max_queue,
+                              max_queue_per_client=args.max_queue_per_client, max_wait=args.max_wait)
+    runner = web.AppRunner(create_aio_app(auth_manager, maintain_accounts=False, scheduler=scheduler),
+                           access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=4096)  # весь всплеск подключается сразу
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/api/chat/completions"
+    heavy, light = [], []
+    statuses = {"heavy": Counter(), "light": Counter()}
+    retry_after = []
+
+    async def light_client(index):
+        for _ in range(args.light_requests):
+            await one(session, url, f"light-{index}", light, statuses["light"], retry_after)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        burst = [one(session, url, "heavy", heavy, statuses["heavy"], retry_after) for _ in range(args.heavy)]
+        results = await asyncio.gather(*burst, *(light_client(i) for i in range(args.light_clients)),
+                                       return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = sum(isinstance(result, Exception) for result in results)
+    await runner.cleanup()
+    await auth_manager.close()
+    result = {"scheduler": use_scheduler, "errors": errors, "seconds": round(elapsed, 3)}
+    for name, latencies, total in (("heavy", heavy, args.heavy),
+                                   ("light", light, args.light_clients * args.light_requests)):
+        summary = summarize(latencies, [], 0, elapsed, total)
+        result[name] = {"latency_ms": summary["latency_ms"], "status": dict(statuses[name])}
+    result["retry_after_s"] = {"min": min(retry_after), "max": max(retry_after)} if retry_after else None
+    if scheduler is not None:
+        result["shed"] = dict(scheduler.shed)
+    return result
+
+
+async def main(args):
+    stub_runner, upstream = await start_stub(StubOptions(latency=args.latency, capacity=args.capacity))
+    results = []
+    try:
+        for use_scheduler in (False, True):
+            result = await run_mode(args, upstream, use_scheduler)
+            results.append(result)
+            print(f"scheduler={use_scheduler!s:>5}: light p50 {(result['light']['latency_ms'] or {}).get('p50')}ms "
+                  f"p99 {(result['light']['latency_ms'] or {}).get('p99')}ms, heavy {result['heavy']['status']}, "
+                  f"light {result['light']['status']}", flush=True)
+    finally:
+        await stub_runner.cleanup()
+    report = {"args": {k: v for k, v in vars(args).items() if k != "output"}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Admission control and fair queuing benchmark")
+    parser.add_argument("--capacity", type=int, default=8, help="Upstream requests served at once (= --max-inflight)")
+    parser.add_argument("--latency", type=float, default=0.1, help="Upstream time per request, seconds")
+    parser.add_argument("--heavy", type=int, default=200, help="Requests sent at once by the heavy client")
+    parser.add_argument("--light-clients", type=int, default=10)
+    parser.add_argument("--light-requests", type=int, default=5, help="Sequential requests per light client")
+    parser.add_argument("--max-queue", type=int, default=1024)
+    parser.add_argument("--max-queue-per-client", type=int, default=64)
+    parser.add_argument("--max-wait", type=float, default=10.0, help="Seconds a request may wait for a slot")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""Long conversations through the aiohttp server: full history per request vs server-side sessions.
+
+Usage: python -m benchmarks.sessions --turns 50 --conversations 10 --message-chars 2000
+
+Each conversation runs --turns requests. Without sessions the client resends the whole history
+every turn; with sessions it sends only the new user message. Reports request bytes sent by the
+client and per-turn latency for both modes.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+from api_inceptionlabs.aio_api import create_aio_app
+from api_inceptionlabs.sessions import SessionStore
+from benchmarks.run import MODEL, make_auth_manager, summarize
+from benchmarks.stub_server import start_stub, StubOptions
+
+
+async def conversation(session, base_url, args, use_sessions, sent, latencies):
+    history = []
+    session_id = None
+    if use_sessions:
+        async with session.post(f"{base_url}/api/sessions") as response:
+            session_id = (await response.json())["session_id"]
+    for turn in range(args.turns):
+        message = {"role": "user", "content": f"{turn} " + "x" * args.message_chars}
+        if use_sessions:
+            body = {"model": MODEL, "messages": [message], "session_id": session_id}
+        else:
+            history.append(message)
+            body = {"model": MODEL, "messages": history}
+        data = json.dumps(body).encode("utf-8")
+        sent[0] += len(data)
+        start = time.perf_counter()
+        async with session.post(f"{base_url}/api/chat/completions", data=data,
+                                headers={"Content-Type": "application/json"}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            reply = await response.json()
+        latencies.append(time.perf_counter() - start)
+        if not use_sessions:
+            history.append(reply["choices"][0]["message"])
+
+
+async def run_mode(args, upstream, use_sessions):
+    auth_manager = make_auth_manager(upstream)
+    sessions = SessionStore(max_messages=None) if use_sessions else None
+    runner = web.AppRunner(create_aio_app(auth_manager, maintain_accounts=False, sessions=sessions), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    sent, latencies = [0], []
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*(conversation(session, base_url, args, use_sessions, sent, latencies)
+                                         for _ in range(args.conversations)), return_exceptions=True)
+        errors = sum(isinstance(result, Exception) for result in results)
+    elapsed = time.perf_counter() - start
+    await runner.cleanup()
+    await auth_manager.close()
+    result = {"sessions": use_sessions}
+    result.update(summarize(latencies, [], errors, elapsed, args.turns * args.conversations))
+    result["client_bytes_sent"] = sent[0]
+    return result
+
+
+async def main(args):
+    stub_runner, upstream = await start_stub(StubOptions(tokens=args.reply_tokens))
+    results = []
+    try:
+        for use_sessions in (False, True):
+            result = await run_mode(args, upstream, use_sessions)
+            results.append(result)
+            print(f"sessions={use_sessions!s:>5}: {result['client_bytes_sent']} B sent, "
+                  f"p50 {result['latency_ms']['p50']}ms p99 {result['latency_ms']['p99']}ms "
+                  f"errors={result['errors']}", flush=True)
+    finally:
+        await stub_runner.cleanup()
+    report = {"args": {k: v for k, v in vars(args).items() if k != "output"}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server-side sessions benchmark")
+    parser.add_argument("--turns", type=int, default=50, help="Requests per conversation")
+    parser.add_argument("--conversations", type=int, default=10, help="Concurrent conversations")
+    parser.add_argument("--message-chars", type=int, default=2000, help="Size of each user message")
+    parser.add_argument("--reply-tokens", type=int, default=100, help="Tokens in each upstream reply")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,147 @@
+"""SSE delivery modes: per-event forwarding vs coalescing, with and without compression.
+
+Usage: python -m benchmarks.sse_coalesce --tokens 500 --token-rate 5000 --streams 50 --concurrency 10
+
+Streams many one-token upstream events through the aiohttp server in every combination of
+--sse-mode (latency, throughput) and Content-Encoding (identity, gzip, br). Reports events and
+bytes on the wire per stream, time to first token and stream latency, and checks that the
+reassembled text matches the upstream content.
+"""
+import argparse
+import asyncio
+import json
+import time
+import zlib
+
+import aiohttp
+import brotli
+from aiohttp import web
+
+from api_inceptionlabs.aio_api import create_aio_app
+from api_inceptionlabs.coalesce import StreamCoalescer
+from api_inceptionlabs.sse import SSEParser, DONE
+from benchmarks.run import MODEL, MESSAGES, make_auth_manager, summarize
+from benchmarks.stub_server import start_stub, StubOptions
+
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def make_decoder(encoding):
+    if encoding == "br":
+        return brotli.Decompressor().process
+    if encoding == "gzip":
+        return zlib.decompressobj(31).decompress
+    return lambda data: data
+
+
+async def start_aio(auth_manager, coalescer, compression):
+    runner = web.AppRunner(create_aio_app(auth_manager, maintain_accounts=False, coalescer=coalescer,
+                                          compression=compression), access_log=None, handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/api/chat/completions"
+
+
+async def one_stream(session, url, encoding, expected):
+    # -> (latency, ttft, событий, байт на проводе); поток читается без автоматической распаковки
+    payload = {"model": MODEL, "messages": MESSAGES, "stream": True}
+    start = time.perf_counter()
+    ttft = None
+    events = wire = 0
+    parts = []
+    parser = SSEParser()
+    async with session.post(url, json=payload, headers={"Accept-Encoding": encoding}) as response:
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        received = response.headers.get("Content-Encoding", "identity")
+        if received != encoding:
+            raise RuntimeError(f"expected Content-Encoding {encoding}, got {received}")
+        decode = make_decoder(encoding)
+        async for data in response.content.iter_any():
+            wire += len(data)
+            for event in parser.feed(decode(data)):
+                if event == DONE:
+                    break
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                events += 1
+                for choice in json.loads(event)["choices"]:
+                    parts.append(choice["delta"].get("content") or "")
+    if "".join(parts) != expected:
+        raise RuntimeError("reassembled content does not match upstream")
+    return time.perf_counter() - start, ttft, events, wire
+
+
+async def run_scenario(args, upstream, mode, encoding):
+    auth_manager = make_auth_manager(upstream)
+    coalescer = StreamCoalescer(args.coalesce_bytes, args.coalesce_ms / 1000) if mode == "throughput" else None
+    runner, url = await start_aio(auth_manager, coalescer, compression=encoding != "identity")
+    expected = "tok " * args.tokens
+    latencies, ttfts, events, wire = [], [], [], []
+    errors = 0
+    remaining = args.streams
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, auto_decompress=False) as session:
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                try:
+                    latency, ttft, count, size = await one_stream(session, url, encoding, expected)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(latency)
+                ttfts.append(ttft)
+                events.append(count)
+                wire.append(size)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    await runner.cleanup()
+    await auth_manager.close()
+    result = {"mode": mode, "encoding": encoding}
+    result.update(summarize(latencies, ttfts, errors, elapsed, args.streams))
+    done = len(events) or 1
+    result["events_per_stream"] = round(sum(events) / done, 1)
+    result["wire_bytes_per_stream"] = round(sum(wire) / done)
+    return result
+
+
+async def main(args):
+    options = StubOptions(tokens=args.tokens, token_rate=args.token_rate, chunk_size=1)
+    stub_runner, upstream = await start_stub(options)
+    results = []
+    try:
+        for mode in ("latency", "throughput"):
+            for encoding in args.encodings:
+                result = await run_scenario(args, upstream, mode, encoding)
+                results.append(result)
+                print(f"{mode:>10} {encoding:>8}: {result['events_per_stream']:>7} events "
+                      f"{result['wire_bytes_per_stream']:>8} B/stream ttft p50 "
+                      f"{(result['ttft_ms'] or {}).get('p50')}ms errors={result['errors']}", flush=True)
+    finally:
+        await stub_runner.cleanup()
+    report = {"args": {k: v for k, v in vars(args).items() if k != "output"}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SSE coalescing and compression benchmark")
+    parser.add_argument("--tokens", type=int, default=500, help="One-token upstream events per stream")
+    parser.add_argument("--token-rate", type=float, default=5000.0, help="Upstream tokens per second")
+    parser.add_argument("--streams", type=int, default=50, help="Streams per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--coalesce-bytes", type=int, default=1024, help="--sse-mode throughput flush size")
+    parser.add_argument("--coalesce-ms", type=float, default=20.0, help="--sse-mode throughput flush window, ms")
+    parser.add_argument("--encodings", type=lambda value: value.split(","), default=list(ENCODINGS),
+                        help="Comma-separated subset of identity,gzip,br")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+"""Per-chunk CPU cost of the SSE pipeline, old line-based path vs SSEParser.
+
+Usage: python -m benchmarks.sse_parse --events 200000 --read-size 1400
+"""
+import argparse
+import asyncio
+import json
+import time
+from unittest import mock
+
+from aiohttp.streams import StreamReader
+
+from api_inceptionlabs.sse import SSEParser, DONE, encode_event
+
+
+def make_payload(events):
+    event = b'data: {"id": "chatcmpl-1", "choices": [{"index": 0, "delta": {"content": "tok"}}]}\n\n'
+    return event * events + b"data: [DONE]\n\n"
+
+
+def make_reader(payload, read_size):
+    # StreamReader aiohttp, наполненный кусками размера TCP-чтения
+    reader = StreamReader(mock.Mock(_reading_paused=False), 2 ** 16, loop=asyncio.get_running_loop())
+    for i in range(0, len(payload), read_size):
+        reader.feed_data(payload[i:i + read_size])
+    reader.feed_eof()
+    return reader
+
+
+async def old_pipeline(reader):
+    # stream_chat (decode/strip/json.loads) + generate_stream (json.dumps)
+    count = 0
+    async for line in reader:
+        line = line.decode('utf-8', errors='replace').strip()
+        if line.startswith('data: '):
+            if line == 'data: [DONE]':
+                break
+            chunk = json.loads(line[6:])
+            f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+            count += 1
+    return count
+
+
+async def new_pipeline(reader, parse):
+    count = 0
+    parser = SSEParser()
+    async for data in reader.iter_any():
+        for event in parser.feed(data):
+            if event == DONE:
+                return count
+            if parse:
+                json.loads(event)
+            else:
+                encode_event(event)
+            count += 1
+    return count
+
+
+async def measure(name, payload, read_size, factory):
+    reader = make_reader(payload, read_size)
+    start = time.perf_counter()
+    count = await factory(reader)
+    elapsed = time.perf_counter() - start
+    return name, {"events": count, "seconds": round(elapsed, 3), "events_per_sec": round(count / elapsed)}
+
+
+async def main(args):
+    payload = make_payload(args.events)
+    results = dict([
+        await measure("old_line_parse_loads_dumps", payload, args.read_size, old_pipeline),
+        await measure("new_passthrough", payload, args.read_size, lambda r: new_pipeline(r, False)),
+        await measure("new_parse_to_dict", payload, args.read_size, lambda r: new_pipeline(r, True)),
+    ])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SSE pipeline microbenchmark")
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--read-size", type=int, default=1400, help="Bytes per simulated TCP read")
+    asyncio.run(main(parser.parse_args()))
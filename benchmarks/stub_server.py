@@ -0,0 +1,139 @@
+"""Local stand-in for chat.inceptionlabs.ai /api/chat/completions.
+
+Usage: python -m benchmarks.stub_server --port 5101 --token-rate 500 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from contextlib import nullcontext
+
+import brotli
+from aiohttp import web
+
+
+class StubOptions:
+    def __init__(self, latency=0.0, tokens=100, token_rate=0.0, chunk_size=1, brotli=False,
+                 error_rate=0.0, unauthorized_rate=0.0, capacity=0):
+        self.latency = latency                      # задержка до первого байта, секунды
+        self.tokens = tokens                        # токенов в ответе
+        self.token_rate = token_rate                # токенов в секунду, 0 — без ограничения
+        self.chunk_size = chunk_size                # токенов в одном SSE-событии
+        self.brotli = brotli                        # Content-Encoding: br для не-потоковых ответов
+        self.error_rate = error_rate                # доля ответов 500
+        self.unauthorized_rate = unauthorized_rate  # доля ответов 401
+        self.capacity = capacity                    # одновременно обслуживаемых запросов, 0 — без ограничения
+
+
+class StubStats:
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.unauthorized = 0
+        self.disconnects = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def make_stub_app(options=None):
+    options = options or StubOptions()
+    stats = StubStats()
+    token = "tok "
+    capacity = asyncio.Semaphore(options.capacity) if options.capacity else nullcontext()
+
+    async def completions(request):
+        async with capacity:
+            return await serve(request)
+
+    async def serve(request):
+        stats.requests += 1
+        data = await request.json()
+        if options.latency:
+            await asyncio.sleep(options.latency)
+        roll = random.random()
+        if roll < options.unauthorized_rate:
+            stats.unauthorized += 1
+            return web.json_response({"detail": "Unauthorized"}, status=401)
+        if roll < options.unauthorized_rate + options.error_rate:
+            stats.errors += 1
+            return web.json_response({"detail": "Injected error"}, status=500)
+
+        created = int(time.time())
+        model = data.get("model", "stub")
+        if not data.get("stream"):
+            if options.token_rate:
+                await asyncio.sleep(options.tokens / options.token_rate)
+            body = json.dumps({
+                "id": f"chatcmpl-{created}", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": token * options.tokens}}],
+            }).encode('utf-8')
+            headers = {"Content-Type": "application/json"}
+            if options.brotli:
+                body = brotli.compress(body)
+                headers["Content-Encoding"] = "br"
+            return web.Response(body=body, headers=headers)
+
+        stats.streams += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        chunk_size = max(1, options.chunk_size)
+        delay = chunk_size / options.token_rate if options.token_rate else 0
+        event = json.dumps({"id": f"chatcmpl-{created}", "model": model,
+                            "choices": [{"index": 0, "delta": {"content": token * chunk_size}}]}).encode('utf-8')
+        try:
+            await response.prepare(request)
+            for _ in range(0, options.tokens, chunk_size):
+                if delay:
+                    await asyncio.sleep(delay)
+                await response.write(b"data: " + event + b"\n\n")
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            stats.disconnects += 1  # клиент закрыл поток раньше времени
+        return response
+
+    async def stats_handler(request):
+        return web.json_response(stats.as_dict())
+
+    app = web.Application()
+    app.router.add_post("/api/chat/completions", completions)
+    app.router.add_get("/stats", stats_handler)
+    return app
+
+
+async def start_stub(options=None, host="127.0.0.1", port=0):
+    # Возвращает (runner, base_url); port=0 — свободный порт
+    runner = web.AppRunner(make_stub_app(options), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Upstream delay before first byte, seconds")
+    parser.add_argument("--tokens", type=int, default=100, help="Tokens per response")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Tokens per second, 0 = unthrottled")
+    parser.add_argument("--chunk-size", type=int, default=1, help="Tokens per SSE event")
+    parser.add_argument("--brotli", action="store_true", help="Brotli-encode non-streaming responses")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 500 responses")
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0, help="Fraction of 401 responses")
+    parser.add_argument("--capacity", type=int, default=0, help="Requests served at once, the rest wait; 0 = unlimited")
+
+
+def options_from_args(args):
+    return StubOptions(latency=args.latency, tokens=args.tokens, token_rate=args.token_rate,
+                       chunk_size=args.chunk_size, brotli=args.brotli, error_rate=args.error_rate,
+                       unauthorized_rate=args.unauthorized_rate, capacity=args.capacity)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub inceptionlabs upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5101)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(make_stub_app(options_from_args(args)), host=args.host, port=args.port)
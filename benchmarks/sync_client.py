@@ -0,0 +1,116 @@
+"""Synchronous callers: a new event loop per call vs Client with one background loop.
+
+Usage: python -m benchmarks.sync_client --threads 1,8,32 --requests 500 --latency 0.01
+
+Threads issue non-streaming requests (and, with --stream, read whole streams). The per-call
+mode does what a sync caller without Client has to do: a fresh event loop for each call, then
+closing that loop's connection pool, as the Flask server does. The Client mode shares one
+Client, its background loop and pooled connections across all threads. Reports requests per
+second, latency and upstream connections opened.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_inceptionlabs.client import AsyncClient, Client
+from benchmarks.run import MODEL, MESSAGES, make_auth_manager, summarize
+from benchmarks.stub_server import start_stub, StubOptions
+
+
+def per_call(auth_manager, stream):
+    client = AsyncClient(auth_manager)
+
+    async def call():
+        try:
+            if stream:
+                async for _ in await client.chat.completions.stream(model=MODEL, messages=MESSAGES):
+                    pass
+            else:
+                await client.chat.completions.create(model=MODEL, messages=MESSAGES)
+        finally:
+            await auth_manager.close()
+    return lambda: asyncio.run(call())
+
+
+def shared(client, stream):
+    def call():
+        if stream:
+            for _ in client.chat.completions.stream(model=MODEL, messages=MESSAGES):
+                pass
+        else:
+            client.chat.completions.create(model=MODEL, messages=MESSAGES)
+    return call
+
+
+def run_mode(args, upstream, mode, threads):
+    auth_manager = make_auth_manager(upstream)
+    client = Client(auth_manager) if mode == "client" else None
+    call = shared(client, args.stream) if client is not None else per_call(auth_manager, args.stream)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    connections = auth_manager.pool_stats()["created"]
+    if client is not None:
+        client.close()
+    result = {"mode": mode, "threads": threads}
+    result.update(summarize(latencies, [], errors, elapsed, args.requests))
+    result["connections_created"] = connections
+    return result
+
+
+def main(args):
+    # Заглушка upstream — в своём потоке, чтобы не делить loop с измеряемым кодом
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    options = StubOptions(latency=args.latency, tokens=args.tokens)
+    stub_runner, upstream = asyncio.run_coroutine_threadsafe(start_stub(options), loop).result()
+    results = []
+    try:
+        for threads in args.threads:
+            for mode in ("per_call", "client"):
+                result = run_mode(args, upstream, mode, threads)
+                results.append(result)
+                print(f"{mode:>8} threads={threads:<3}: {result['rps']} req/s p50 {result['latency_ms']['p50']}ms "
+                      f"p99 {result['latency_ms']['p99']}ms connections={result['connections_created']} "
+                      f"errors={result['errors']}", flush=True)
+    finally:
+        asyncio.run_coroutine_threadsafe(stub_runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    report = {"args": {k: v for k, v in vars(args).items() if k != "output"}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synchronous Client benchmark")
+    parser.add_argument("--threads", type=lambda value: [int(v) for v in value.split(",")], default=[1, 8, 32],
+                        help="Comma-separated caller thread counts")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--latency", type=float, default=0.01, help="Upstream delay before first byte, seconds")
+    parser.add_argument("--tokens", type=int, default=100, help="Tokens per response")
+    parser.add_argument("--stream", action="store_true", help="Read streams instead of non-streaming responses")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    main(parser.parse_args())
@@ -9,14 +9,17 @@ setup(
     long_description=open('README.md', encoding='utf-8').read(),
     long_description_content_type="text/markdown",
     url="https://github.com/DarkPyDoor/api-inceptionlabs",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     install_requires=[
-        "aiohttp>=3.8.0",
+        "aiohttp>=3.9",
         "brotli>=1.0.9",
         "requests>=2.28.0",
         "playwright>=1.28.0",
         "flask[async]>=2.0.0",
     ],
+    extras_require={
+        "fast": ["orjson>=3.6.0"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -25,7 +28,7 @@ setup(
         "Intended Audience :: Developers",
         "Topic :: Software Development :: Libraries",
     ],
-    python_requires='>=3.7',
+    python_requires='>=3.10',
     entry_points={
         'console_scripts': [
             'inceptionlabs-API = api_inceptionlabs.cli:main',